@@ -1,117 +1,2439 @@
+import atexit
+import bisect
+import collections
+import contextlib
+import datetime
+import functools
+import heapq
 import json
 import os
-import locale
+import random
+import sqlite3
+import threading
+import time
+import zlib
+
+import metrics
+import serialization
+from snapshot import Snapshot
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock (e.g. on Windows) hotel locks only exclude threads
+    fcntl = None
+
+
+class Reservations:
+    """Insertion-ordered multiset of the customer names holding rooms.
+
+    Names map to their number of reservations in a dict, so membership,
+    adding, removing and renaming take constant time. Iterating yields
+    every name once per reservation, like the list it replaces. Hotels also
+    keep their dated stays in one, keyed by Stay instead of by name.
+    """
+
+    __slots__ = ('_counts', '_size')
+
+    def __init__(self, names=()):
+        """Initializes Reservations from an iterable of names."""
+        self._counts = {}
+        self._size = 0
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        """Adds one reservation for a name."""
+        self._counts[name] = self._counts.get(name, 0) + 1
+        self._size += 1
+
+    def remove(self, name):
+        """Removes one reservation for a name if it exists."""
+        count = self._counts.get(name)
+        if not count:
+            return False
+        if count == 1:
+            del self._counts[name]
+        else:
+            self._counts[name] = count - 1
+        self._size -= 1
+        return True
+
+    def rename(self, old_name, new_name):
+        """Moves every reservation of old_name to new_name."""
+        count = self._counts.pop(old_name, 0)
+        if count:
+            self._counts[new_name] = self._counts.get(new_name, 0) + count
+        return count
+
+    def count(self, name):
+        """Returns the number of reservations held by a name."""
+        return self._counts.get(name, 0)
+
+    def items(self):
+        """Returns (name, count) pairs in insertion order."""
+        return self._counts.items()
+
+    @classmethod
+    def from_counts(cls, pairs):
+        """Returns Reservations from (name, count) pairs."""
+        reservations = cls()
+        reservations._counts = dict(pairs)
+        reservations._size = sum(reservations._counts.values())
+        return reservations
+
+    def copy(self):
+        """Returns an independent copy of the reservations."""
+        reservations = Reservations()
+        reservations._counts = self._counts.copy()
+        reservations._size = self._size
+        return reservations
+
+    def __contains__(self, name):
+        return name in self._counts
+
+    def __iter__(self):
+        for name, count in self._counts.items():
+            for _ in range(count):
+                yield name
+
+    def __len__(self):
+        return self._size
+
+    def __eq__(self, other):
+        if isinstance(other, Reservations):
+            return list(self) == list(other)
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f'Reservations({list(self)!r})'
+
+
+Stay = collections.namedtuple('Stay', ['customer', 'check_in', 'check_out'])
+
+
+def stay_dates(check_in, check_out):
+    """Returns the check-in and check-out dates of a stay as dates, parsing
+    ISO strings; the stay takes the nights from check_in up to but not
+    including check_out."""
+    if isinstance(check_in, str):
+        check_in = datetime.date.fromisoformat(check_in)
+    if isinstance(check_out, str):
+        check_out = datetime.date.fromisoformat(check_out)
+    if check_in is None or check_out is None or check_in >= check_out:
+        raise ValueError(f'Invalid stay from {check_in} to {check_out}')
+    return check_in, check_out
+
+
+class OccupancyIndex:
+    """Number of rooms taken by dated stays on each night.
+
+    Nights are date ordinals, counted in a sparse segment tree with range
+    updates: a node holds the stays covering its whole range of nights plus
+    the peak of its subtree, so adding a stay and finding the peak over any
+    range of nights both take logarithmic time. Nodes are numbered like a
+    binary heap and only exist once a stay has touched them.
+    """
+
+    __slots__ = ('_added', '_peak')
+
+    FIRST_NIGHT = datetime.date.min.toordinal()
+    END = datetime.date.max.toordinal() + 1
+
+    def __init__(self):
+        """Initializes an empty OccupancyIndex."""
+        self._added = {}
+        self._peak = {}
+
+    def add(self, check_in, check_out, amount=1):
+        """Adds amount rooms to the nights of a stay; a negative amount
+        removes them."""
+        self._add(1, self.FIRST_NIGHT, self.END, check_in.toordinal(),
+                  check_out.toordinal(), amount)
+
+    def _add(self, node, low, high, start, end, amount):
+        """Adds amount to the nights start to end within a node."""
+        if start <= low and high <= end:
+            self._added[node] = self._added.get(node, 0) + amount
+            self._peak[node] = self._peak.get(node, 0) + amount
+            return
+        middle = (low + high) // 2
+        if start < middle:
+            self._add(2 * node, low, middle, start, end, amount)
+        if end > middle:
+            self._add(2 * node + 1, middle, high, start, end, amount)
+        self._peak[node] = self._added.get(node, 0) + max(
+            self._peak.get(2 * node, 0), self._peak.get(2 * node + 1, 0))
+
+    def peak(self, check_in=None, check_out=None):
+        """Returns the most rooms taken on any night of a stay, or on any
+        night at all without dates."""
+        if check_in is None:
+            return self._peak.get(1, 0)
+        return self._max(1, self.FIRST_NIGHT, self.END,
+                         check_in.toordinal(), check_out.toordinal())
+
+    def _max(self, node, low, high, start, end):
+        """Returns the peak of the nights start to end within a node."""
+        if node not in self._peak:
+            return 0
+        if start <= low and high <= end:
+            return self._peak[node]
+        middle = (low + high) // 2
+        peak = 0
+        if start < middle:
+            peak = self._max(2 * node, low, middle, start, end)
+        if end > middle:
+            peak = max(peak, self._max(2 * node + 1, middle, high, start, end))
+        return self._added.get(node, 0) + peak
+
+    def copy(self):
+        """Returns an independent copy of the index."""
+        index = OccupancyIndex()
+        index._added = self._added.copy()
+        index._peak = self._peak.copy()
+        return index
+
+
+# A customer waiting for a room of a full hotel, open-ended or for the
+# nights from check_in to check_out. Tickets are numbered by each hotel in
+# the order they were requested.
+Waiting = collections.namedtuple(
+    'Waiting', ['ticket', 'tier', 'customer', 'check_in', 'check_out'])
+
+
+def _waiting(ticket, tier, customer, check_in=None, check_out=None):
+    """Returns a Waiting entry, parsing ISO dates; without dates, or with
+    empty ones, the customer waits for an open-ended reservation."""
+    if check_in or check_out:
+        check_in, check_out = stay_dates(check_in, check_out)
+    else:
+        check_in = check_out = None
+    return Waiting(ticket, tier, customer, check_in, check_out)
+
+
+class Waitlist:
+    """Priority queue of the customers waiting for a room of a hotel.
+
+    Customers with a higher loyalty tier are served first, and customers of
+    one tier in the order of their tickets. Entries removed before reaching
+    the top of the heap are only dropped from it once they do.
+    """
+
+    def __init__(self, entries=()):
+        """Initializes Waitlist with Waiting entries."""
+        self._entries = {entry.ticket: entry for entry in entries}
+        self._heap = [self._key(entry) for entry in self._entries.values()]
+        heapq.heapify(self._heap)
+
+    @staticmethod
+    def _key(entry):
+        """Returns the heap key of an entry; smaller keys are served
+        first."""
+        return (-entry.tier, entry.ticket)
+
+    def add(self, entry):
+        """Adds a Waiting entry."""
+        self._entries[entry.ticket] = entry
+        heapq.heappush(self._heap, self._key(entry))
+
+    def _prune(self):
+        """Drops removed entries from the top of the heap, and rebuilds the
+        heap once most of it is removed entries."""
+        heap = self._heap
+        while heap and heap[0][1] not in self._entries:
+            heapq.heappop(heap)
+        if len(heap) > 2 * len(self._entries) + 16:
+            self._heap = [self._key(entry)
+                          for entry in self._entries.values()]
+            heapq.heapify(self._heap)
+
+    def pop(self):
+        """Removes and returns the entry served next, or None."""
+        self._prune()
+        if not self._heap:
+            return None
+        _, ticket = heapq.heappop(self._heap)
+        return self._entries.pop(ticket)
+
+    def remove(self, ticket):
+        """Removes and returns the entry of a ticket, or None."""
+        entry = self._entries.pop(ticket, None)
+        if entry is not None:
+            self._prune()
+        return entry
+
+    def get(self, ticket):
+        """Returns the entry of a ticket, or None."""
+        return self._entries.get(ticket)
+
+    def find(self, customer, check_in=None, check_out=None):
+        """Returns the entry of a customer waiting for a stay, or None."""
+        for entry in self._entries.values():
+            if (entry.customer == customer and entry.check_in == check_in
+                    and entry.check_out == check_out):
+                return entry
+        return None
+
+    def position(self, ticket):
+        """Returns the 1-based place of a ticket in the serving order, or
+        None if it is not waiting."""
+        entry = self._entries.get(ticket)
+        if entry is None:
+            return None
+        key = self._key(entry)
+        return 1 + sum(1 for other in self._entries.values()
+                       if self._key(other) < key)
+
+    def map_customers(self, function):
+        """Replaces the customer of every entry with function(customer) and
+        returns the number of entries that changed."""
+        changed = 0
+        for ticket, entry in self._entries.items():
+            customer = function(entry.customer)
+            if customer != entry.customer:
+                self._entries[ticket] = entry._replace(customer=customer)
+                changed += 1
+        return changed
+
+    def copy(self):
+        """Returns an independent copy of the waitlist."""
+        waitlist = Waitlist()
+        waitlist._entries = dict(self._entries)
+        waitlist._heap = list(self._heap)
+        return waitlist
+
+    def __iter__(self):
+        """Yields the entries in serving order."""
+        return iter(sorted(self._entries.values(), key=self._key))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f'Waitlist({list(self)!r})'
+
+
+def _map_changes(changes, function):
+    """Returns copies of journal records with function(reference) in place
+    of their customer references."""
+    mapped = []
+    for record in changes:
+        record = dict(record, customer=function(record['customer']))
+        if 'new_name' in record:
+            record['new_name'] = function(record['new_name'])
+        mapped.append(record)
+    return mapped
+
+
+# The rest of a lazily loaded hotel: a function returning a Hotel object
+# with its reservations, whether it has dated stays, and the functions to
+# apply to that object, such as replaying journal records
+_Pending = collections.namedtuple('_Pending', ['load', 'stays', 'steps'])
+
+
+class _Build:
+    """Builds the reservations of a lazily loaded hotel once, for all of its
+    copies, and hands out copies of them."""
+
+    def __init__(self, pending):
+        """Initializes _Build with the _Pending of a hotel."""
+        self.pending = pending
+        self.hotel = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            if self.hotel is None:
+                hotel = self.pending.load()
+                for step in self.pending.steps:
+                    step(hotel)
+                self.hotel = hotel
+                self.pending = None
+        return self.hotel.copy()
 
 
 class Hotel:
+    # Without a __dict__ per instance, a loaded chain of hotels takes far
+    # less memory
+    __slots__ = ('name', 'rooms', '_reservations', '_stays', '_occupancy',
+                 '_waitlist', 'tickets', 'version', 'sequence', 'changes',
+                 'journal_length', '_pending')
+
     def __init__(self, name, rooms):
         """Initializes Hotel with a name and number of rooms."""
+        # A _Pending while only the header of a loaded hotel is parsed
+        self._pending = None
         self.name = name
         self.rooms = rooms
-        self.reservations = []
+        self.reservations = Reservations()
+        # Dated stays and the rooms they take per night. Undated
+        # reservations are open-ended stays: they hold a room on every night
+        # and are already subtracted from rooms.
+        self.stays = Reservations()
+        self.occupancy = OccupancyIndex()
+        # Customers waiting for a room, and the number of the last ticket
+        # handed out, which is never handed out again
+        self.waitlist = Waitlist()
+        self.tickets = 0
+        # Incremented by every compare-and-swap save of the hotel
+        self.version = 0
+        # Sequence number of the last journal record applied; records up to
+        # it are already part of the hotel
+        self.sequence = 0
+        # Journal records not yet persisted; None while the hotel is not
+        # tracked against a stored copy
+        self.changes = None
+        self.journal_length = 0
+
+    @classmethod
+    def from_header(cls, header, load=None):
+        """Returns a Hotel object from the Header of its data that builds
+        its reservations and stays on first use, from the data of the
+        header or else from the data load() returns."""
+        fields = header.fields
+        hotel = cls(fields['name'], fields['rooms'])
+        hotel.version = fields.get('version', 0)
+        hotel.sequence = fields.get('sequence', 0)
+        hotel.tickets = fields.get('tickets', 0)
+        if header.data is not None:
+            load = functools.partial(getattr, header, 'data')
+        hotel._pending = _Pending(lambda: cls.from_data(load()),
+                                  'stays' in header.lists, [])
+        return hotel
+
+    def _materialize(self):
+        """Builds the reservations, stays, occupancy and waitlist of a lazily
+        loaded hotel."""
+        pending = self._pending
+        hotel = pending.load()
+        for step in pending.steps:
+            step(hotel)
+        self._reservations = hotel._reservations
+        self._stays = hotel._stays
+        self._occupancy = hotel._occupancy
+        self._waitlist = hotel._waitlist
+        # Cleared last, so other threads never see half of the fields
+        self._pending = None
+
+    @property
+    def reservations(self):
+        """Returns the names of the customers holding rooms."""
+        if self._pending is not None:
+            self._materialize()
+        return self._reservations
+
+    @reservations.setter
+    def reservations(self, names):
+        """Replaces the reservations with an iterable of names."""
+        if self._pending is not None:
+            self._materialize()
+        if not isinstance(names, Reservations):
+            names = Reservations(names)
+        self._reservations = names
+        # A wholesale replacement cannot be expressed as journal records
+        self.changes = None
+
+    @property
+    def stays(self):
+        """Returns the dated stays."""
+        if self._pending is not None:
+            self._materialize()
+        return self._stays
+
+    @stays.setter
+    def stays(self, stays):
+        """Replaces the dated stays."""
+        if self._pending is not None:
+            self._materialize()
+        self._stays = stays
+
+    @property
+    def occupancy(self):
+        """Returns the OccupancyIndex of the dated stays."""
+        if self._pending is not None:
+            self._materialize()
+        return self._occupancy
+
+    @occupancy.setter
+    def occupancy(self, occupancy):
+        """Replaces the OccupancyIndex of the dated stays."""
+        if self._pending is not None:
+            self._materialize()
+        self._occupancy = occupancy
+
+    @property
+    def waitlist(self):
+        """Returns the Waitlist of the customers waiting for a room."""
+        if self._pending is not None:
+            self._materialize()
+        return self._waitlist
+
+    @waitlist.setter
+    def waitlist(self, waitlist):
+        """Replaces the Waitlist."""
+        if self._pending is not None:
+            self._materialize()
+        self._waitlist = waitlist
+
+    def track_changes(self, journal_length=0):
+        """Starts recording journal records against the stored copy."""
+        self.changes = []
+        self.journal_length = journal_length
+
+    def _record(self, op, customer_name, new_name=None, stay=None,
+                **fields):
+        """Records an operation for the journal if changes are tracked."""
+        if self.changes is not None:
+            record = {'op': op, 'customer': customer_name,
+                      'rooms': self.rooms}
+            if new_name is not None:
+                record['new_name'] = new_name
+            if stay is not None:
+                record['check_in'] = stay.check_in.isoformat()
+                record['check_out'] = stay.check_out.isoformat()
+            record.update(fields)
+            self.changes.append(record)
+
+    def replay(self, record):
+        """Applies a journal record without recording it again, unless the
+        hotel already includes it."""
+        sequence = record.get('seq')
+        if sequence is not None:
+            if sequence <= self.sequence:
+                # Left behind by a crash between writing a snapshot and
+                # removing the journal it folded in
+                return
+            self.sequence = sequence
+        pending = self._pending
+        if pending is not None:
+            # Only the header fields change until the rest is built
+            pending.steps.append(functools.partial(Hotel.replay,
+                                                   record=record))
+            if 'check_in' in record and record['op'] != 'wait':
+                self._pending = pending._replace(stays=True)
+            self.rooms = record['rooms']
+            self.tickets = max(self.tickets, record.get('ticket', 0))
+            self.version = record.get('version', self.version)
+            return
+        if record['op'] == 'wait':
+            self.waitlist.add(_waiting(
+                record['ticket'], record['tier'], record['customer'],
+                record.get('check_in'), record.get('check_out')))
+            self.tickets = max(self.tickets, record['ticket'])
+        elif record['op'] == 'unwait':
+            self.waitlist.remove(record['ticket'])
+        elif 'check_in' in record:
+            stay = Stay(record['customer'], *stay_dates(
+                record['check_in'], record['check_out']))
+            if record['op'] == 'reserve':
+                self._add_stay(stay)
+            elif record['op'] == 'cancel':
+                self._remove_stay(stay)
+        elif record['op'] == 'reserve':
+            self.reservations.add(record['customer'])
+        elif record['op'] == 'cancel':
+            self.reservations.remove(record['customer'])
+        elif record['op'] == 'rename':
+            self.reservations.rename(record['customer'], record['new_name'])
+            self._rename_stays(record['customer'], record['new_name'])
+            self._rename_waitlist(record['customer'], record['new_name'])
+        self.rooms = record['rooms']
+        self.version = record.get('version', self.version)
+
+    def _add_stay(self, stay):
+        """Adds a dated stay to the stays and the occupancy index."""
+        self.stays.add(stay)
+        self.occupancy.add(stay.check_in, stay.check_out)
+
+    def _remove_stay(self, stay):
+        """Removes a dated stay if it exists."""
+        if self.stays.remove(stay):
+            self.occupancy.add(stay.check_in, stay.check_out, -1)
+            return True
+        return False
+
+    def _rename_stays(self, old_name, new_name):
+        """Moves the dated stays of old_name to new_name."""
+        renamed = 0
+        for stay, _ in list(self.stays.items()):
+            if stay.customer == old_name:
+                renamed += self.stays.rename(
+                    stay, stay._replace(customer=new_name))
+        return renamed
+
+    def _rename_waitlist(self, old_name, new_name):
+        """Moves the waitlist entries of old_name to new_name."""
+        return self.waitlist.map_customers(
+            lambda customer: new_name if customer == old_name else customer)
+
+    def map_customers(self, function):
+        """Replaces every customer reference of the reservations, stays,
+        waitlist and unsaved changes with function(reference), such as names
+        with customer ids."""
+        if self.changes:
+            self.changes = _map_changes(self.changes, function)
+        if self._pending is not None:
+            self._pending.steps.append(functools.partial(
+                Hotel.map_customers, function=function))
+            return
+        counts = {}
+        for customer, count in self._reservations.items():
+            customer = function(customer)
+            counts[customer] = counts.get(customer, 0) + count
+        stays = {}
+        for stay, count in self.stays.items():
+            stay = stay._replace(customer=function(stay.customer))
+            stays[stay] = stays.get(stay, 0) + count
+        # Assigned past the setter, which would stop tracking changes
+        self._reservations = Reservations.from_counts(counts.items())
+        self.stays = Reservations.from_counts(stays.items())
+        self.waitlist.map_customers(function)
+
+    def is_available(self, check_in, check_out):
+        """Returns whether a room is free on every night of a stay."""
+        check_in, check_out = stay_dates(check_in, check_out)
+        return self.occupancy.peak(check_in, check_out) < self.rooms
+
+    def peak_occupancy(self, check_in, check_out):
+        """Returns the most rooms taken on any night of a stay, counting
+        undated reservations as taking a room every night."""
+        check_in, check_out = stay_dates(check_in, check_out)
+        return len(self.reservations) + self.occupancy.peak(check_in,
+                                                            check_out)
 
-    def reserve_room(self, customer):
-        """Reserves a room for a customer if rooms are available."""
-        if self.rooms > 0:
+    def free_rooms(self):
+        """Returns the number of rooms free on every night, which an
+        open-ended reservation can take."""
+        if self._pending is not None and not self._pending.stays:
+            # Known from the header alone
+            return self.rooms
+        return self.rooms - self.occupancy.peak()
+
+    def customer_counts(self):
+        """Returns (customer name, count) pairs of the reservations and
+        dated stays."""
+        counts = dict(self.reservations.items())
+        for stay, count in self.stays.items():
+            counts[stay.customer] = counts.get(stay.customer, 0) + count
+        return counts.items()
+
+    def reserve_room(self, customer, check_in=None, check_out=None):
+        """Reserves a room for a customer if rooms are available, either
+        open-ended or for the nights from check_in to check_out."""
+        if check_in is not None or check_out is not None:
+            stay = Stay(customer.name, *stay_dates(check_in, check_out))
+            if self.occupancy.peak(stay.check_in, stay.check_out) < self.rooms:
+                self._add_stay(stay)
+                self._record('reserve', customer.name, stay=stay)
+                return True
+            return False
+        # An open-ended reservation needs a room no dated stay ever uses
+        if self.free_rooms() > 0:
             self.rooms -= 1
-            self.reservations.append(customer.name)
+            self.reservations.add(customer.name)
+            self._record('reserve', customer.name)
             return True
         return False
 
-    def cancel_reservation(self, customer):
-        """Cancels a reservation for a customer if it exists."""
-        if customer.name in self.reservations:
+    def cancel_reservation(self, customer, check_in=None, check_out=None):
+        """Cancels a reservation for a customer if it exists, or the stay
+        from check_in to check_out."""
+        if check_in is not None or check_out is not None:
+            stay = Stay(customer.name, *stay_dates(check_in, check_out))
+            if self._remove_stay(stay):
+                self._record('cancel', customer.name, stay=stay)
+                return True
+            return False
+        if self.reservations.remove(customer.name):
             self.rooms += 1
-            self.reservations.remove(customer.name)
+            self._record('cancel', customer.name)
             return True
         return False
 
     def update_reservation(self, old_name, new_name):
         """Updates a reservation with a new customer name if it exists."""
-        if old_name in self.reservations:
-            self.reservations.remove(old_name)
-            self.reservations.append(new_name)
+        renamed = self.reservations.rename(old_name, new_name)
+        renamed += self._rename_stays(old_name, new_name)
+        renamed += self._rename_waitlist(old_name, new_name)
+        if renamed:
+            self._record('rename', old_name, new_name)
             return True
         return False
 
+    def join_waitlist(self, customer, check_in=None, check_out=None,
+                      ticket=None):
+        """Puts a customer in line for a room, open-ended or for the nights
+        from check_in to check_out, and returns its Waiting entry; a
+        customer already waiting for the stay keeps its entry, and a ticket
+        number given, such as one of an imported waitlist, is kept."""
+        waiting = self.waiting_entry(customer.name, check_in, check_out)
+        if waiting is not None:
+            return waiting
+        entry = _waiting(self.tickets + 1 if ticket is None else ticket,
+                         customer.tier, customer.name, check_in, check_out)
+        self.tickets = max(self.tickets, entry.ticket)
+        self.waitlist.add(entry)
+        self._record('wait', entry.customer, stay=self._waiting_stay(entry),
+                     ticket=entry.ticket, tier=entry.tier)
+        return entry
+
+    def waiting_entry(self, customer_name, check_in=None, check_out=None):
+        """Returns the Waiting entry of a customer waiting for a stay, or
+        None."""
+        entry = _waiting(None, 0, customer_name, check_in, check_out)
+        return self.waitlist.find(customer_name, entry.check_in,
+                                  entry.check_out)
+
+    @staticmethod
+    def _waiting_stay(entry):
+        """Returns the Stay a Waiting entry is for, or None if it is
+        open-ended."""
+        if entry.check_in is None:
+            return None
+        return Stay(entry.customer, entry.check_in, entry.check_out)
+
+    def leave_waitlist(self, ticket):
+        """Takes a ticket out of the waitlist and returns its Waiting entry,
+        or None if it is not waiting."""
+        entry = self.waitlist.remove(ticket)
+        if entry is not None:
+            self._record('unwait', entry.customer, ticket=ticket)
+        return entry
+
+    def drain_waitlist(self, accept=None):
+        """Gives free rooms to waiting customers in serving order and
+        returns the Waiting entries that got one.
+
+        Customers whose stay does not fit keep their place, and customers
+        for whose name accept returns a false value, such as deleted ones,
+        are taken out of the waitlist.
+        """
+        served = []
+        unfit = []
+        while self.rooms > 0 and self.waitlist:
+            entry = self.waitlist.pop()
+            if entry.check_in is None:
+                fits = self.free_rooms() > 0
+            else:
+                fits = self.occupancy.peak(entry.check_in,
+                                           entry.check_out) < self.rooms
+            if not fits:
+                unfit.append(entry)
+                continue
+            if accept is None or accept(entry.customer):
+                self.reserve_room(Customer(entry.customer), entry.check_in,
+                                  entry.check_out)
+                served.append(entry)
+            self._record('unwait', entry.customer, ticket=entry.ticket)
+        for entry in unfit:
+            self.waitlist.add(entry)
+        return served
+
+    def copy(self):
+        """Returns an independent copy of the hotel that tracks changes
+        against the same stored state."""
+        hotel = Hotel(self.name, self.rooms)
+        pending = self._pending
+        if pending is not None:
+            # Copies, such as those of the object cache, share one build
+            # but each applies its own later steps
+            load = pending.load
+            if pending.steps or not isinstance(load, _Build):
+                load = _Build(pending._replace(steps=list(pending.steps)))
+            hotel._pending = _Pending(load, pending.stays, [])
+        else:
+            hotel.reservations = self.reservations.copy()
+            hotel.stays = self.stays.copy()
+            hotel.occupancy = self.occupancy.copy()
+            hotel.waitlist = self.waitlist.copy()
+        hotel.tickets = self.tickets
+        hotel.version = self.version
+        hotel.sequence = self.sequence
+        hotel.track_changes(self.journal_length)
+        return hotel
+
+    def to_data(self):
+        """Returns the plain data the codecs store the hotel as, with the
+        integer and string fields ahead of the lists."""
+        data = {'name': self.name, 'rooms': self.rooms}
+        if self.tickets:
+            data['tickets'] = self.tickets
+        if self.version:
+            data['version'] = self.version
+        if self.sequence:
+            data['sequence'] = self.sequence
+        data['reservations'] = serialization.Runs.from_pairs(
+            self.reservations.items())
+        if self.stays:
+            data['stays'] = [[stay.customer, stay.check_in.isoformat(),
+                              stay.check_out.isoformat()]
+                             for stay in self.stays]
+        if self.waitlist:
+            data['waitlist'] = [
+                [entry.ticket, entry.tier, entry.customer,
+                 entry.check_in.isoformat() if entry.check_in else '',
+                 entry.check_out.isoformat() if entry.check_out else '']
+                for entry in sorted(self.waitlist,
+                                    key=lambda entry: entry.ticket)]
+        return data
+
+    @classmethod
+    def from_data(cls, data):
+        """Returns a Hotel object from its plain data."""
+        hotel = cls(data['name'], data['rooms'])
+        names = data['reservations']
+        if isinstance(names, serialization.Runs):
+            names = Reservations.from_counts(names.pairs())
+        hotel.reservations = names
+        for customer, check_in, check_out in data.get('stays', []):
+            hotel._add_stay(Stay(customer, *stay_dates(check_in, check_out)))
+        hotel.waitlist = Waitlist(_waiting(*row)
+                                  for row in data.get('waitlist', []))
+        hotel.tickets = data.get('tickets', 0)
+        hotel.version = data.get('version', 0)
+        hotel.sequence = data.get('sequence', 0)
+        return hotel
+
     def to_json(self):
         """Returns a JSON string representation of the hotel."""
-        return json.dumps(self.__dict__)
+        return serialization.JSON.encode(self.to_data()).decode('utf-8')
 
     @classmethod
     def from_json(cls, json_str):
-        """Returns a Hotel object from a JSON string representation."""
-        data = json.loads(json_str)
-        hotel = cls(data['name'], data['rooms'])
-        hotel.reservations = data['reservations']
-        return hotel
+        """Returns a Hotel object from a JSON string representation, whose
+        reservations are built on first use."""
+        return cls.from_header(serialization.JSON.decode_header(json_str),
+                               functools.partial(serialization.JSON.decode,
+                                                 json_str))
 
 
 class Customer:
-    def __init__(self, name):
-        """Initializes Customer with a name."""
+    __slots__ = ('name', 'id', 'tier', 'hotels', 'waiting')
+
+    def __init__(self, name, customer_id=None):
+        """Initializes Customer with a name and, once stored, an id."""
         self.name = name
+        # Immutable number hotels refer to the customer by, where the
+        # storage backend assigns ids
+        self.id = customer_id
+        # Loyalty tier; waitlists serve higher tiers first
+        self.tier = 0
+        # Reverse index of the hotels this customer has reservations in,
+        # one entry per reservation
+        self.hotels = []
+        # Hotels whose waitlist holds the customer, one entry per ticket
+        self.waiting = []
+
+    def add_hotel(self, hotel_name):
+        """Records a reservation of the customer in a hotel."""
+        self.hotels.append(hotel_name)
+
+    def remove_hotel(self, hotel_name, count=1):
+        """Forgets up to count reservations of the customer in a hotel."""
+        for _ in range(count):
+            if hotel_name not in self.hotels:
+                break
+            self.hotels.remove(hotel_name)
+
+    def add_waiting(self, hotel_name):
+        """Records a ticket of the customer on the waitlist of a hotel."""
+        self.waiting.append(hotel_name)
+
+    def remove_waiting(self, hotel_name):
+        """Forgets a ticket of the customer on the waitlist of a hotel."""
+        if hotel_name in self.waiting:
+            self.waiting.remove(hotel_name)
+
+    def copy(self):
+        """Returns an independent copy of the customer."""
+        customer = Customer(self.name, self.id)
+        customer.tier = self.tier
+        customer.hotels = list(self.hotels)
+        customer.waiting = list(self.waiting)
+        return customer
+
+    def to_data(self):
+        """Returns the plain data the codecs store the customer as."""
+        data = {'name': self.name}
+        if self.id is not None:
+            data['id'] = self.id
+        if self.tier:
+            data['tier'] = self.tier
+        if self.hotels:
+            data['hotels'] = self.hotels
+        if self.waiting:
+            data['waiting'] = self.waiting
+        return data
+
+    @classmethod
+    def from_data(cls, data):
+        """Returns a Customer object from its plain data."""
+        customer = cls(data['name'], data.get('id'))
+        customer.tier = data.get('tier', 0)
+        customer.hotels = list(data.get('hotels', []))
+        customer.waiting = list(data.get('waiting', []))
+        return customer
 
     def to_json(self):
         """Returns a JSON string representation of the customer."""
-        return json.dumps(self.__dict__)
+        return serialization.JSON.encode(self.to_data()).decode('utf-8')
 
     @classmethod
     def from_json(cls, json_str):
         """Returns a Customer object from a JSON string representation."""
-        data = json.loads(json_str)
-        return cls(data['name'])
+        return cls.from_data(serialization.JSON.decode(json_str))
+
+
+class ObjectCache:
+    """Bounded LRU cache of objects loaded from files.
+
+    Entries are keyed by path and remember the size and modification time
+    of the file (and of its journal) they were read from, so a file changed
+    by another process is read again. Objects are copied in and out, so
+    callers never share an instance with the cache.
+    """
+
+    def __init__(self, maxsize=1024):
+        """Initializes ObjectCache holding up to maxsize objects."""
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        # Watchers such as the change feed read files on their own threads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, filename, signature):
+        """Returns a copy of the cached object if its file is unchanged."""
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None or entry[0] != signature:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(filename)
+            self.hits += 1
+        return entry[1].copy()
+
+    def put(self, filename, obj, signature):
+        """Caches a copy of an object read from or written to a file."""
+        if signature is None or self.maxsize <= 0:
+            self.invalidate(filename)
+            return
+        obj = obj.copy()
+        with self._lock:
+            self._entries[filename] = (signature, obj)
+            self._entries.move_to_end(filename)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, filename):
+        """Drops the cached object of a file."""
+        with self._lock:
+            self._entries.pop(filename, None)
+
+    def clear(self):
+        """Drops every cached object and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Returns the hit, miss and eviction counters and the size."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._entries),
+                'maxsize': self.maxsize}
+
+
+object_cache = ObjectCache()
+
+
+def cache_stats():
+    """Returns the counters of the object cache in front of
+    load_from_file."""
+    return object_cache.stats()
+
+
+def _file_signature(cls, filename):
+    """Returns the sizes and modification times identifying the current
+    contents of a file and its journal, or None if the file is missing."""
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if hasattr(cls, 'replay'):
+        try:
+            stat = os.stat(journal_path(filename))
+            signature += (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+    return signature
 
 
-def save_to_file(obj, filename):
-    """Saves an object to a file in JSON format."""
-    with open(filename, 'w', encoding=locale.getencoding()) as file:
-        file.write(obj.to_json())
+# Journals are compacted into their snapshot once they hold this many
+# records, or as many records as the hotel has reservations if that is more,
+# which keeps the amortized cost of a booking constant
+COMPACT_JOURNAL_AFTER = 100
 
 
-def load_from_file(cls, filename):
-    """Loads an object from a file in JSON format."""
+def journal_path(filename):
+    """Returns the path of the journal kept next to a snapshot file."""
+    return f'{filename}.log'
+
+
+def _fsync_path(path, directory=False):
+    """Flushes a file or directory to disk."""
+    descriptor = os.open(path, os.O_RDONLY | (
+        getattr(os, 'O_DIRECTORY', 0) if directory else 0))
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _fsync_directories(paths):
+    """Flushes the directories holding some paths, each once, so renames
+    and newly created files in them are durable."""
+    if os.name == 'nt':
+        # Windows cannot open a directory to flush it
+        return
+    for directory in dict.fromkeys(
+            os.path.dirname(path) or os.curdir for path in paths):
+        _fsync_path(directory, directory=True)
+
+
+class Fsync:
+    """Durability mode flushing every write to disk before it returns.
+
+    Each save costs one fsync of the file and one of its directory.
+    """
+
+    def commit(self, path, target=None, created=False):
+        """Flushes a written file to disk and then renames it to target,
+        if given; the directory is flushed as well when target is given or
+        the file was created."""
+        _fsync_path(path)
+        if target is not None:
+            os.replace(path, target)
+        if target is not None or created:
+            _fsync_directories([target or path])
+
+
+class GroupCommit(Fsync):
+    """Durability mode sharing the disk flushes of concurrent writes.
+
+    Writes are committed in groups, one group at a time. The first writer
+    of a group waits for the previous group to finish, and for an optional
+    flush window after that; writers committing meanwhile join its group.
+    It then flushes every file of the group, renames them and flushes their
+    directories once, and all of them return together. A write is still
+    durable when it returns, but the slower the disk, the more concurrent
+    bookings share one round of flushes.
+    """
+
+    def __init__(self, window=0):
+        """Initializes GroupCommit with a flush window in seconds."""
+        self.window = window
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._batch = None
+
+    def commit(self, path, target=None, created=False):
+        """Flushes a written file to disk and renames it to target, if
+        given, together with the other files of its group."""
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = {'commits': [], 'error': None,
+                                       'done': threading.Event()}
+            batch['commits'].append((path, target, created))
+        if not leader:
+            batch['done'].wait()
+        else:
+            with self._flushing:
+                if self.window:
+                    time.sleep(self.window)
+                with self._lock:
+                    self._batch = None
+                try:
+                    self._flush(batch['commits'])
+                except OSError as e:
+                    batch['error'] = e
+                finally:
+                    batch['done'].set()
+            if metrics.enabled:
+                metrics.increment('group_commits_total')
+                metrics.increment('group_committed_files_total',
+                                  len(batch['commits']))
+        if batch['error'] is not None:
+            raise batch['error']
+
+    @staticmethod
+    def _flush(commits):
+        """Flushes and renames the files of a group."""
+        for path in dict.fromkeys(path for path, _, _ in commits):
+            _fsync_path(path)
+        for path, target, _ in commits:
+            if target is not None:
+                os.replace(path, target)
+        _fsync_directories([target or path for path, target, created
+                            in commits if target is not None or created])
+
+
+def file_codec(filename):
+    """Returns the codec an existing file was written with, or None."""
+    try:
+        with open(filename, 'rb') as file:
+            return serialization.detect(
+                file.read(len(serialization.MAGIC)))
+    except FileNotFoundError:
+        return None
+
+
+@metrics.instrument
+def save_to_file(obj, filename, codec=None, snapshot=None, durability=None):
+    """Saves an object to a file with a codec, and to a snapshot if given;
+    by default an existing file keeps its format and a new one is written
+    as JSON.
+
+    The data is written to a temporary file that then replaces the file, so
+    readers and a crash only ever see the old or the new contents. With a
+    durability mode such as Fsync or GroupCommit, the new contents are also
+    on disk when the function returns.
+    """
+    if codec is None:
+        codec = file_codec(filename) or serialization.JSON
+    data = codec.encode(obj.to_data())
+    # Unique per writer, and never listed as an entity by FileStorage
+    temporary = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
     try:
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding=locale.getencoding()) as file:
-                return cls.from_json(file.read())
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        if durability is None:
+            os.replace(temporary, filename)
         else:
+            durability.commit(temporary, filename)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary)
+        raise
+    if metrics.enabled:
+        metrics.increment('files_opened_total')
+        metrics.increment('bytes_written_total', len(data))
+    if hasattr(obj, 'replay'):
+        # The snapshot now includes everything the journal recorded
+        try:
+            os.remove(journal_path(filename))
+        except FileNotFoundError:
+            pass
+        if obj.changes is not None:
+            obj.track_changes()
+    filename = os.path.normpath(filename)
+    signature = _file_signature(type(obj), filename)
+    object_cache.put(filename, obj, signature)
+    if snapshot is not None:
+        snapshot.put(os.path.basename(filename), data, signature)
+
+
+@metrics.instrument
+def append_to_journal(obj, filename, durability=None, records=None):
+    """Appends the unsaved changes of an object to the journal of its
+    snapshot file, without rewriting the snapshot, and flushes the journal
+    to disk with a durability mode if given.
+
+    Records stored in place of the changes may be given; the object then
+    differs from what its file holds and is not cached. Every record is
+    numbered after the last one the object holds, so replaying a journal
+    onto a snapshot that already folded it in changes nothing.
+    """
+    cached = records is None
+    if cached:
+        records = obj.changes
+    for record in records:
+        obj.sequence += 1
+        record['seq'] = obj.sequence
+    data = ''.join(json.dumps(record) + '\n' for record in records)
+    path = journal_path(filename)
+    created = not os.path.exists(path)
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(data)
+    if durability is not None:
+        durability.commit(path, created=created)
+    if metrics.enabled:
+        metrics.increment('files_opened_total')
+        metrics.increment('bytes_written_total', len(data))
+    obj.journal_length += len(obj.changes)
+    obj.changes = []
+    filename = os.path.normpath(filename)
+    if cached:
+        object_cache.put(filename, obj, _file_signature(type(obj), filename))
+    else:
+        object_cache.invalidate(filename)
+
+
+def replay_journal(obj, filename):
+    """Applies the journal of a snapshot file to an object loaded from it
+    and starts tracking its changes."""
+    journal_length = 0
+    size = 0
+    try:
+        with open(journal_path(filename), 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last record from an interrupted append
+                    break
+                obj.replay(record)
+                journal_length += 1
+                size += len(line)
+    except FileNotFoundError:
+        pass
+    else:
+        if metrics.enabled:
+            metrics.increment('files_opened_total')
+            metrics.increment('bytes_read_total', size)
+    obj.track_changes(journal_length)
+
+
+@metrics.instrument
+def compact_journal(cls, filename):
+    """Rewrites a snapshot file with its journal applied and removes the
+    journal."""
+    obj = load_from_file(cls, filename)
+    if obj:
+        save_to_file(obj, filename)
+
+
+def _parse(codec, data, header=False):
+    """Returns the plain data, or with header=True the Header, of some
+    bytes in a codec's format."""
+    decode = codec.decode_header if header else codec.decode
+    if not metrics.enabled:
+        return decode(data)
+    start = time.perf_counter()
+    parsed = decode(data)
+    metrics.observe(f'{codec.name}_parse_seconds',
+                    time.perf_counter() - start)
+    return parsed
+
+
+def _decode(cls, data):
+    """Returns an object from data in any codec's format; objects with a
+    from_header method are built from the header of the data, and parse
+    the rest when they need it."""
+    codec = serialization.detect(data)
+    if metrics.enabled:
+        metrics.increment('bytes_read_total', len(data))
+    if hasattr(cls, 'from_header'):
+        return cls.from_header(_parse(codec, data, header=True),
+                               functools.partial(_parse, codec, data))
+    return cls.from_data(_parse(codec, data))
+
+
+@metrics.instrument
+def load_from_file(cls, filename, snapshot=None):
+    """Loads an object from a file in any codec's format, or from the object
+    cache or a snapshot if the file has not changed since they took it."""
+    codec = serialization.JSON
+    try:
+        filename = os.path.normpath(filename)
+        signature = _file_signature(cls, filename)
+        if signature is None:
             return None
-    except json.JSONDecodeError as e:
-        print(f"Error loading data from {filename}: Invalid JSON data. {e}")
+        obj = object_cache.get(filename, signature)
+        if obj is not None:
+            return obj
+        name = os.path.basename(filename)
+        stored = (snapshot.get(name, signature) if snapshot is not None
+                  else None)
+        if stored is not None:
+            data, journal_length = stored
+            codec = serialization.detect(data)
+            if metrics.enabled:
+                metrics.increment('snapshot_hits_total')
+            obj = _decode(cls, data)
+            if hasattr(obj, 'replay'):
+                obj.track_changes(journal_length)
+            object_cache.put(filename, obj, signature)
+            return obj
+        with open(filename, 'rb') as file:
+            data = file.read()
+        codec = serialization.detect(data)
+        if metrics.enabled:
+            metrics.increment('files_opened_total')
+        obj = _decode(cls, data)
+        if hasattr(obj, 'replay'):
+            replay_journal(obj, filename)
+        object_cache.put(filename, obj, signature)
+        if snapshot is not None:
+            journal_length = getattr(obj, 'journal_length', 0)
+            if journal_length:
+                # The snapshot holds the state with the journal applied
+                data = serialization.BINARY.encode(obj.to_data())
+            snapshot.put(name, data, signature, journal_length)
+        return obj
+    except ValueError as e:
+        print(f"Error loading data from {filename}: Invalid "
+              f"{codec.name} data. {e}")
         return None
     except FileNotFoundError:
         print(f"Error loading data from {filename}: File not found.")
         return None
 
 
+class AvailabilityIndex:
+    """Hotel names sorted by their number of free rooms.
+
+    Entries are (-free rooms, name) pairs in a sorted list, so the hotels
+    with the most free rooms come first. Updates take a binary search and a
+    list insertion, and threshold and top-k queries slice the list without
+    loading any hotel.
+    """
+
+    def __init__(self):
+        """Initializes an empty AvailabilityIndex."""
+        self._lock = threading.Lock()
+        self._entries = []
+        self._free = {}
+
+    def update(self, name, free_rooms):
+        """Records the number of free rooms of a hotel."""
+        with self._lock:
+            self._discard(name)
+            bisect.insort(self._entries, (-free_rooms, name))
+            self._free[name] = free_rooms
+
+    def add(self, name, free_rooms):
+        """Records the number of free rooms of a hotel not in the index
+        yet."""
+        with self._lock:
+            if name not in self._free:
+                bisect.insort(self._entries, (-free_rooms, name))
+                self._free[name] = free_rooms
+
+    def discard(self, name):
+        """Forgets a hotel if it is in the index."""
+        with self._lock:
+            self._discard(name)
+
+    def _discard(self, name):
+        """Forgets a hotel while the lock is held."""
+        free_rooms = self._free.pop(name, None)
+        if free_rooms is not None:
+            del self._entries[bisect.bisect_left(self._entries,
+                                                 (-free_rooms, name))]
+
+    def rename(self, old_name, new_name):
+        """Moves the entry of a hotel to a new name."""
+        with self._lock:
+            free_rooms = self._free.get(old_name)
+            self._discard(old_name)
+        if free_rooms is not None:
+            self.update(new_name, free_rooms)
+
+    def free_rooms(self, name):
+        """Returns the number of free rooms of a hotel, or None."""
+        return self._free.get(name)
+
+    def at_least(self, minimum=1, limit=None):
+        """Returns the names of the hotels with at least minimum free rooms,
+        most free first, and at most limit of them."""
+        with self._lock:
+            end = bisect.bisect_left(self._entries, (1 - minimum,))
+            if limit is not None:
+                end = min(end, limit)
+            return [name for _, name in self._entries[:end]]
+
+    def __len__(self):
+        return len(self._free)
+
+
+class StripedLock:
+    """Fixed set of locks that entity keys are hashed onto.
+
+    Different hotels usually land on different stripes and proceed in
+    parallel. With a directory, every stripe also takes an flock on a file
+    there, so other processes sharing the data directory are excluded too.
+    """
+
+    def __init__(self, directory=None, stripes=64):
+        """Initializes StripedLock with a number of stripes."""
+        self.directory = directory
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def stripe(self, key):
+        """Returns the stripe of a key, stable across processes."""
+        return zlib.crc32(key.encode()) % len(self._locks)
+
+    @contextlib.contextmanager
+    def __call__(self, key):
+        """Holds the stripe of a key for the duration of a with block."""
+        index = self.stripe(key)
+        with self._locks[index]:
+            if self.directory is None or fcntl is None:
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f'{index}.lock'),
+                      'a') as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class CustomerIds:
+    """Table of the names of the customer ids of a data directory.
+
+    The table is a file of JSON lines, each giving an id and the name it has
+    from then on, so creating or renaming a customer appends one line and
+    no hotel file changes. Lines appended by other processes are read before
+    ids are resolved. A name a customer had before a rename still resolves
+    to its id until another customer takes the name, so hotels loaded before
+    the rename save correctly.
+    """
+
+    def __init__(self, path, durability=None):
+        """Initializes CustomerIds on a table file, which is created by
+        create() or the first id added."""
+        self.path = path
+        self.durability = durability
+        self._names = {}
+        self._ids = {}
+        self._last = 0
+        # Bytes of the file read so far
+        self.offset = 0
+        self._lock = threading.Lock()
+        self.created = os.path.exists(path)
+
+    def create(self):
+        """Creates the table file if it is missing, which marks its
+        directory as referring to customers by id."""
+        if not self.created:
+            with contextlib.suppress(FileNotFoundError):
+                open(self.path, 'ab').close()
+                self.created = True
+
+    def refresh(self):
+        """Reads the lines appended since the table was last read."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if size > self.offset:
+                with open(self.path, 'rb') as file:
+                    file.seek(self.offset)
+                    self._read(file.read(size - self.offset))
+
+    def _read(self, data):
+        """Applies the complete lines of data read from the offset."""
+        # A line another process is still appending is read next time
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            customer_id, name = json.loads(line)
+            self._names[customer_id] = name
+            self._ids[name] = customer_id
+            self._last = max(self._last, customer_id)
+        self.offset += end
+
+    def _append(self, name, customer_id=None):
+        """Appends a line giving a name to an id, by default a new one, and
+        returns the id."""
+        with self._lock, open(self.path, 'a+b') as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(self.offset)
+            self._read(file.read())
+            if customer_id is None:
+                customer_id = self._last + 1
+            line = (json.dumps([customer_id, name]) + '\n').encode('utf-8')
+            file.write(line)
+            file.flush()
+            if self.durability is not None:
+                self.durability.commit(self.path)
+            self._read(line)
+            self.created = True
+        return customer_id
+
+    def add(self, name):
+        """Returns the id of a new customer: the id the name has, if any,
+        or else a new one."""
+        self.refresh()
+        customer_id = self._ids.get(name)
+        if customer_id is not None and self._names[customer_id] == name:
+            return customer_id
+        return self._append(name)
+
+    def rename(self, customer_id, name):
+        """Gives a customer id a new name."""
+        self._append(name, customer_id)
+
+    def name(self, reference):
+        """Returns the name of a customer id; names are returned as they
+        are."""
+        return self._names.get(reference, reference)
+
+    def key(self, name):
+        """Returns the id of a customer name, adding the name if it has
+        none."""
+        customer_id = self._ids.get(name)
+        return self.add(name) if customer_id is None else customer_id
+
+
+class Storage:
+    """Interface every storage backend implements.
+
+    The module-level functions never touch files or tables directly; they go
+    through the backend installed with use_storage().
+    """
+
+    # Built on first use by availability(), then kept up to date by the
+    # saves, renames and deletions going through this backend
+    _availability = None
+    _availability_lock = threading.Lock()
+
+    def availability(self):
+        """Returns the AvailabilityIndex of the stored hotels."""
+        with self._availability_lock:
+            if self._availability is None:
+                # Published before it is filled so that saves made while
+                # it is built update it; their counts are newer and win
+                index = self._availability = AvailabilityIndex()
+                for name in self.hotel_names():
+                    hotel = self.load_hotel(name)
+                    if hotel:
+                        index.add(name, hotel.free_rooms())
+            return self._availability
+
+    def _index_availability(self, hotel):
+        """Updates the free rooms of a saved hotel in the index."""
+        index = self._availability
+        if index is not None:
+            index.update(hotel.name, hotel.free_rooms())
+
+    def _rename_availability(self, old_name, new_name):
+        """Renames or, without a new name, removes a hotel in the index."""
+        index = self._availability
+        if index is None:
+            return
+        if new_name is None:
+            index.discard(old_name)
+        else:
+            index.rename(old_name, new_name)
+
+    def load_hotel(self, name):
+        """Returns the hotel with the given name, or None."""
+        raise NotImplementedError
+
+    def save_hotel(self, hotel):
+        """Creates or replaces the stored record of a hotel."""
+        raise NotImplementedError
+
+    def compare_and_save_hotel(self, hotel):
+        """Saves a hotel with its version incremented if the stored version
+        still equals hotel.version, and returns whether it did."""
+        raise NotImplementedError
+
+    def update_hotel(self, name, update):
+        """Loads a hotel, applies update to it and saves it if update
+        returns a true value, which is then returned.
+
+        Saving is an optimistic compare-and-swap; when another writer saved
+        the hotel in between, the update is retried on a fresh copy, so it
+        must only change the hotel it is given.
+        """
+        attempt = 0
+        while True:
+            hotel = self.load_hotel(name)
+            if hotel is None:
+                return None
+            result = update(hotel)
+            if not result or self.compare_and_save_hotel(hotel):
+                return result
+            attempt += 1
+            time.sleep(random.uniform(0, 0.001 * min(attempt, 10)))
+
+    def update_customer(self, name, update):
+        """Loads a customer under its lock, applies update to it and saves
+        it; returns the customer, or None if it does not exist."""
+        with self.lock(f'customer:{name}'):
+            customer = self.load_customer(name)
+            if customer:
+                update(customer)
+                self.save_customer(customer)
+            return customer
+
+    def lock(self, key):
+        """Returns a context manager excluding other writers of a key."""
+        return contextlib.nullcontext()
+
+    def delete_hotel(self, name):
+        """Removes a hotel if it exists."""
+        raise NotImplementedError
+
+    def rename_hotel(self, old_name, new_name):
+        """Moves a hotel to a new name, keeping its reservations."""
+        raise NotImplementedError
+
+    def hotel_names(self):
+        """Returns the names of all stored hotels."""
+        raise NotImplementedError
+
+    def iter_reservations(self, name):
+        """Yields (customer name, check_in, check_out, count) tuples of the
+        reservations of a hotel, without dates for the open-ended ones, and
+        then of its dated stays."""
+        hotel = self.load_hotel(name)
+        if hotel:
+            for customer, count in hotel.reservations.items():
+                yield customer, None, None, count
+            for stay, count in hotel.stays.items():
+                yield stay.customer, stay.check_in, stay.check_out, count
+
+    def load_customer(self, name):
+        """Returns the customer with the given name, or None."""
+        raise NotImplementedError
+
+    def load_customers(self, names):
+        """Returns a dict of the stored customers among the given names."""
+        customers = {}
+        for name in names:
+            customer = self.load_customer(name)
+            if customer:
+                customers[name] = customer
+        return customers
+
+    def save_customer(self, customer):
+        """Creates or replaces the stored record of a customer."""
+        raise NotImplementedError
+
+    def delete_customer(self, name):
+        """Removes a customer if it exists."""
+        raise NotImplementedError
+
+    def rename_customer(self, old_name, new_name):
+        """Renames a customer and every reservation held under the name."""
+        raise NotImplementedError
+
+    def customer_names(self):
+        """Returns the names of all stored customers."""
+        raise NotImplementedError
+
+    def hotels_with_reservation(self, customer_name):
+        """Returns the hotels a customer has reservations in."""
+        raise NotImplementedError
+
+    def customers_without_reservation(self):
+        """Returns the names of customers without any reservation."""
+        raise NotImplementedError
+
+    def rebuild_index(self):
+        """Recomputes the customer-to-hotel index from the hotels."""
+
+    def close(self):
+        """Releases any resources held by the backend."""
+
+
+class FileStorage(Storage):
+    """Stores every hotel and customer in its own file.
+
+    Files are written with the given codec, or without one in the format
+    they already have, new files as JSON. Files of any format are read.
+
+    With snapshot=True, the data of every file read or written is also kept
+    in a memory-mapped snapshot file in the directory, and later loads take
+    it from there while the file is unchanged.
+
+    Files are replaced atomically. With a durability mode, Fsync() or
+    GroupCommit(), every save is also flushed to disk before it returns.
+
+    Customers get ids from the CustomerIds table of the directory, and hotel
+    files refer to customers by id, so renaming a customer rewrites no hotel
+    file. Directories written before customers had ids refer to them by
+    name until migrate_customer_ids() converts them.
+
+    Directories written before customer files had an index of their hotels
+    are indexed once, on the first lookup, and marked as indexed.
+    """
+
+    SNAPSHOT_NAME = 'dataset.snapshot'
+    CUSTOMER_IDS_NAME = 'customers.ids'
+    INDEXED_NAME = 'customers.indexed'
+
+    def __init__(self, directory=os.curdir, codec=None, snapshot=False,
+                 durability=None):
+        """Initializes FileStorage on a data directory."""
+        self.directory = directory
+        self.codec = codec
+        self.durability = durability
+        self.lock = StripedLock(os.path.join(directory, '.locks'))
+        self.snapshot = None
+        if snapshot:
+            self.snapshot = Snapshot(
+                os.path.join(directory, self.SNAPSHOT_NAME))
+            atexit.register(self.snapshot.flush)
+        self.customer_ids = None
+        self._indexed = False
+        try:
+            fresh = not any(name.endswith(('.hotel', '.customer'))
+                            for name in os.listdir(directory))
+        except FileNotFoundError:
+            fresh = True
+        # New directories use customer ids from the start; the table is
+        # only written with the first hotel or customer
+        if fresh or os.path.exists(self._customer_ids_path()):
+            self.customer_ids = CustomerIds(self._customer_ids_path(),
+                                            durability)
+
+    def _ensure_index(self):
+        """Builds the customer-to-hotel index of a directory that has none
+        yet, once."""
+        if self._indexed:
+            return
+        with self.lock('index'):
+            if (not os.path.exists(os.path.join(self.directory,
+                                                self.INDEXED_NAME))
+                    and self.customer_names()):
+                self.rebuild_index()
+        self._indexed = True
+
+    def _customer_ids_path(self):
+        """Returns the path of the table of customer ids."""
+        return os.path.join(self.directory, self.CUSTOMER_IDS_NAME)
+
+    def _ids(self):
+        """Returns the table of customer ids, or None while the directory
+        refers to customers by name."""
+        if (self.customer_ids is None
+                and os.path.exists(self._customer_ids_path())):
+            # Migrated by another FileStorage
+            self.customer_ids = CustomerIds(self._customer_ids_path(),
+                                            self.durability)
+        return self.customer_ids
+
+    def _stored(self, hotel):
+        """Returns a copy of a hotel referring to customers by id, or the
+        hotel itself without customer ids."""
+        ids = self._ids()
+        if ids is None:
+            return hotel
+        ids.refresh()
+        stored = hotel.copy()
+        # Mapping replaces the records rather than changing them
+        stored.changes = hotel.changes
+        stored.map_customers(ids.key)
+        return stored
+
+    def _cache_named(self, hotel, ids):
+        """Caches a hotel with customer names under its file, valid until
+        the file or the table of customer ids changes."""
+        path = os.path.normpath(self.hotel_path(hotel.name))
+        signature = _file_signature(Hotel, path)
+        if signature is not None:
+            # One element longer than the signature of the stored data
+            signature += (ids.offset,)
+        object_cache.put(path, hotel, signature)
+
+    def hotel_path(self, name):
+        """Returns the path of the file holding a hotel."""
+        return os.path.join(self.directory, f'{name}.hotel')
+
+    def customer_path(self, name):
+        """Returns the path of the file holding a customer."""
+        return os.path.join(self.directory, f'{name}.customer')
+
+    def _names(self, extension):
+        """Returns the entity names of all files with an extension."""
+        return [f[:-len(extension)] for f in os.listdir(self.directory)
+                if f.endswith(extension)]
+
+    def load_hotel(self, name):
+        """Returns the hotel with the given name, or None."""
+        ids = self._ids()
+        if ids is None:
+            return load_from_file(Hotel, self.hotel_path(name),
+                                  self.snapshot)
+        # Mapping a large hotel costs more than copying it from the cache
+        path = os.path.normpath(self.hotel_path(name))
+        ids.refresh()
+        signature = _file_signature(Hotel, path)
+        if signature is None:
+            return None
+        hotel = object_cache.get(path, signature + (ids.offset,))
+        if hotel is None:
+            hotel = load_from_file(Hotel, path, self.snapshot)
+            if hotel is not None:
+                hotel.map_customers(ids.name)
+                self._cache_named(hotel, ids)
+        return hotel
+
+    def save_hotel(self, hotel):
+        """Appends the changes of a hotel to its journal, or rewrites its
+        file when the changes cannot be journaled or the journal is due for
+        compaction."""
+        changes = hotel.changes
+        journaled = (changes and changes[-1]['rooms'] == hotel.rooms
+                     and hotel.journal_length + len(changes) < max(
+                         COMPACT_JOURNAL_AFTER,
+                         len(hotel.reservations) + len(hotel.stays)))
+        ids = self._ids()
+        if ids is not None:
+            ids.create()
+        if journaled:
+            # The last record carries the version the hotel is saved at
+            changes[-1]['version'] = hotel.version
+            records = None
+            if ids is not None:
+                ids.refresh()
+                records = _map_changes(changes, ids.key)
+            append_to_journal(hotel, self.hotel_path(hotel.name),
+                              self.durability, records)
+        else:
+            stored = self._stored(hotel)
+            save_to_file(stored, self.hotel_path(hotel.name), self.codec,
+                         self.snapshot, self.durability)
+            if stored is not hotel and hotel.changes is not None:
+                hotel.track_changes()
+        if ids is not None:
+            self._cache_named(hotel, ids)
+        self._index_availability(hotel)
+
+    def compare_and_save_hotel(self, hotel):
+        """Saves a hotel under its lock if its file still holds the version
+        the hotel was loaded at."""
+        with self.lock(f'hotel:{hotel.name}'):
+            stored = self.load_hotel(hotel.name)
+            if stored is None or stored.version != hotel.version:
+                return False
+            hotel.version += 1
+            self.save_hotel(hotel)
+            return True
+
+    def delete_hotel(self, name):
+        """Removes the file and journal of a hotel if they exist."""
+        object_cache.invalidate(os.path.normpath(self.hotel_path(name)))
+        for path in (self.hotel_path(name),
+                     journal_path(self.hotel_path(name))):
+            if os.path.exists(path):
+                os.remove(path)
+        if self.snapshot is not None:
+            self.snapshot.remove(os.path.basename(self.hotel_path(name)))
+        self._rename_availability(name, None)
+
+    def rename_hotel(self, old_name, new_name):
+        """Moves a hotel to a new file, keeping its reservations."""
+        hotel = self.load_hotel(old_name)
+        if hotel and old_name != new_name:
+            hotel.name = new_name
+            # The new file starts from a full snapshot
+            save_to_file(self._stored(hotel), self.hotel_path(new_name),
+                         self.codec, self.snapshot, self.durability)
+            self.delete_hotel(old_name)
+            self._index_availability(hotel)
+
+    def hotel_names(self):
+        """Returns the names of all hotel files."""
+        return self._names('.hotel')
+
+    def iter_reservations(self, name):
+        """Yields (customer name, check_in, check_out, count) tuples of the
+        reservations and then the dated stays of a hotel, streamed from its
+        file a chunk at a time unless the hotel has a journal."""
+        path = self.hotel_path(name)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with file:
+            try:
+                current = (os.stat(path).st_ino
+                           == os.fstat(file.fileno()).st_ino)
+            except FileNotFoundError:
+                current = False
+            if not current or os.path.exists(journal_path(path)):
+                # The file alone does not hold the current reservations
+                yield from super().iter_reservations(name)
+                return
+            ids = self._ids()
+            if ids is not None:
+                ids.refresh()
+            for customer, count in serialization.iter_runs(file,
+                                                           'reservations'):
+                if ids:
+                    customer = ids.name(customer)
+                yield customer, None, None, count
+            try:
+                for (customer, check_in, check_out), count in (
+                        serialization.iter_runs(file, 'stays')):
+                    if ids:
+                        customer = ids.name(customer)
+                    yield (customer, datetime.date.fromisoformat(check_in),
+                           datetime.date.fromisoformat(check_out), count)
+            except serialization.MissingFieldError:
+                # Hotels without dated stays are written without the list
+                pass
+
+    def load_customer(self, name):
+        """Returns the customer with the given name, or None."""
+        return load_from_file(Customer, self.customer_path(name),
+                              self.snapshot)
+
+    def save_customer(self, customer):
+        """Creates or replaces the file of a customer, giving a new customer
+        an id."""
+        ids = self._ids()
+        if customer.id is None and ids is not None:
+            customer.id = ids.add(customer.name)
+        save_to_file(customer, self.customer_path(customer.name),
+                     self.codec, self.snapshot, self.durability)
+
+    def delete_customer(self, name):
+        """Removes the file of a customer if it exists."""
+        object_cache.invalidate(os.path.normpath(self.customer_path(name)))
+        if os.path.exists(self.customer_path(name)):
+            os.remove(self.customer_path(name))
+        if self.snapshot is not None:
+            self.snapshot.remove(os.path.basename(self.customer_path(name)))
+
+    def move_customer(self, old_name, new_name):
+        """Renames a customer file without updating its hotels and returns
+        the names of the hotels still holding the old name."""
+        self._ensure_index()
+        with self.lock(f'customer:{old_name}'):
+            customer = self.load_customer(old_name)
+            if not customer:
+                return []
+            customer.name = new_name
+            if old_name == new_name:
+                self.save_customer(customer)
+                return []
+            ids = self._ids()
+            if customer.id is not None and ids is not None:
+                # The hotels refer to the id, whose name is all that changes
+                ids.rename(customer.id, new_name)
+                self.save_customer(customer)
+                self.delete_customer(old_name)
+                return []
+            self.save_customer(customer)
+            self.delete_customer(old_name)
+        # Only the hotels in the customer's index hold the old name
+        return list(dict.fromkeys(customer.hotels + customer.waiting))
+
+    def rename_customer(self, old_name, new_name):
+        """Renames a customer file and updates the hotels it has
+        reservations in."""
+        for hotel_name in self.move_customer(old_name, new_name):
+            self.update_hotel(
+                hotel_name,
+                lambda hotel: hotel.update_reservation(old_name, new_name))
+
+    def convert(self, codec):
+        """Rewrites every hotel and customer file with a codec, folding in
+        the hotel journals, and returns the number of files rewritten."""
+        count = 0
+        for cls, names, path in ((Hotel, self.hotel_names(), self.hotel_path),
+                                 (Customer, self.customer_names(),
+                                  self.customer_path)):
+            for name in names:
+                with self.lock(f'{cls.__name__.lower()}:{name}'):
+                    obj = load_from_file(cls, path(name), self.snapshot)
+                    if obj and file_codec(path(name)) is not codec:
+                        save_to_file(obj, path(name), codec, self.snapshot,
+                                     self.durability)
+                        count += 1
+        return count
+
+    def migrate_customer_ids(self):
+        """Gives every customer an id and rewrites the hotel files that
+        refer to customers by name, returning the number of files
+        rewritten."""
+        if self._ids() is None:
+            self.customer_ids = CustomerIds(self._customer_ids_path(),
+                                            self.durability)
+        count = 0
+        for name in self.customer_names():
+            with self.lock(f'customer:{name}'):
+                customer = self.load_customer(name)
+                if customer and customer.id is None:
+                    self.save_customer(customer)
+                    count += 1
+        for name in self.hotel_names():
+            with self.lock(f'hotel:{name}'):
+                hotel = load_from_file(Hotel, self.hotel_path(name),
+                                       self.snapshot)
+                if hotel and any(isinstance(customer, str) for customer, _
+                                 in hotel.customer_counts()):
+                    hotel.map_customers(self.customer_ids.key)
+                    # Writers holding the hotel by names must load it again
+                    hotel.version += 1
+                    save_to_file(hotel, self.hotel_path(name), self.codec,
+                                 self.snapshot, self.durability)
+                    count += 1
+        return count
+
+    def customer_names(self):
+        """Returns the names of all customer files."""
+        return self._names('.customer')
+
+    def hotels_with_reservation(self, customer_name):
+        """Returns the hotels in the index of a customer file."""
+        self._ensure_index()
+        customer = self.load_customer(customer_name)
+        return list(dict.fromkeys(customer.hotels)) if customer else []
+
+    def customers_without_reservation(self):
+        """Returns the customers whose file has an empty index."""
+        self._ensure_index()
+        names = []
+        for name in self.customer_names():
+            customer = self.load_customer(name)
+            # Files removed since they were listed, or invalid, are skipped
+            if customer is not None and not customer.hotels:
+                names.append(name)
+        return names
+
+    def rebuild_index(self):
+        """Recomputes the index of every customer file from the hotel
+        files."""
+        hotels_by_customer = {}
+        waiting_by_customer = {}
+        for hotel_name in self.hotel_names():
+            hotel = self.load_hotel(hotel_name)
+            if hotel is None:
+                continue
+            for customer_name, count in hotel.customer_counts():
+                hotels_by_customer.setdefault(customer_name, []).extend(
+                    [hotel_name] * count)
+            for entry in hotel.waitlist:
+                waiting_by_customer.setdefault(entry.customer, []).append(
+                    hotel_name)
+        ids = self._ids()
+        for customer_name in self.customer_names():
+            customer = self.load_customer(customer_name)
+            if customer is None:
+                continue
+            hotels = hotels_by_customer.get(customer_name, [])
+            waiting = waiting_by_customer.get(customer_name, [])
+            # Files already up to date are left alone
+            if (customer.hotels != hotels or customer.waiting != waiting
+                    or (customer.id is None and ids is not None)):
+                customer.hotels = hotels
+                customer.waiting = waiting
+                self.save_customer(customer)
+        with open(os.path.join(self.directory, self.INDEXED_NAME), 'ab'):
+            pass
+        self._indexed = True
+        # Hotel files may have been changed by other processes as well
+        with self._availability_lock:
+            self._availability = None
+
+    def close(self):
+        """Writes and unmaps the snapshot, if any."""
+        if self.snapshot is not None:
+            atexit.unregister(self.snapshot.flush)
+            self.snapshot.close()
+
+
+class SQLiteStorage(Storage):
+    """Stores all hotels, customers and reservations in one SQLite file."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS hotels (
+            name TEXT PRIMARY KEY,
+            rooms INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            tickets INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS customers (
+            name TEXT PRIMARY KEY,
+            tier INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS reservations (
+            id INTEGER PRIMARY KEY,
+            hotel TEXT NOT NULL REFERENCES hotels (name)
+                ON UPDATE CASCADE ON DELETE CASCADE,
+            customer TEXT NOT NULL,
+            check_in TEXT,
+            check_out TEXT
+        );
+        CREATE INDEX IF NOT EXISTS reservations_by_hotel
+            ON reservations (hotel);
+        CREATE INDEX IF NOT EXISTS reservations_by_customer
+            ON reservations (customer);
+        CREATE TABLE IF NOT EXISTS waitlist (
+            hotel TEXT NOT NULL REFERENCES hotels (name)
+                ON UPDATE CASCADE ON DELETE CASCADE,
+            ticket INTEGER NOT NULL,
+            tier INTEGER NOT NULL,
+            customer TEXT NOT NULL,
+            check_in TEXT,
+            check_out TEXT,
+            PRIMARY KEY (hotel, ticket)
+        );
+    """
+
+    # Stays below SQLite's limit on the number of query parameters
+    CHUNK_SIZE = 500
+
+    def __init__(self, path='hotels.db'):
+        """Initializes SQLiteStorage on a database file."""
+        self.path = path
+        # One connection is shared by all threads, one statement at a time;
+        # other processes are kept out by SQLite's own file locking
+        self._mutex = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(self.SCHEMA)
+        columns = [row[1] for row in self._query('PRAGMA table_info(hotels)')]
+        for column in ('version', 'tickets'):
+            if column not in columns:
+                with self._transaction() as connection:
+                    connection.execute(f'ALTER TABLE hotels ADD COLUMN '
+                                       f'{column} INTEGER NOT NULL DEFAULT 0')
+        columns = [row[1] for row in
+                   self._query('PRAGMA table_info(customers)')]
+        if 'tier' not in columns:
+            with self._transaction() as connection:
+                connection.execute('ALTER TABLE customers ADD COLUMN '
+                                   'tier INTEGER NOT NULL DEFAULT 0')
+        # Reservations stored before stays had dates stay open-ended
+        columns = [row[1] for row in
+                   self._query('PRAGMA table_info(reservations)')]
+        if 'check_in' not in columns:
+            with self._transaction() as connection:
+                connection.execute(
+                    'ALTER TABLE reservations ADD COLUMN check_in TEXT')
+                connection.execute(
+                    'ALTER TABLE reservations ADD COLUMN check_out TEXT')
+
+    def _query(self, sql, parameters=()):
+        """Runs a query and returns all of its rows."""
+        with self._mutex:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Runs a with block as one transaction on the connection."""
+        with self._mutex, self.connection:
+            yield self.connection
+
+    def load_hotel(self, name):
+        """Returns the hotel with the given name, or None."""
+        with self._mutex:
+            rows = self._query(
+                'SELECT name, rooms, version, tickets FROM hotels '
+                'WHERE name = ?', (name,))
+            if not rows:
+                return None
+            hotel = Hotel(rows[0][0], rows[0][1])
+            reservations = self._query(
+                'SELECT customer, check_in, check_out FROM reservations '
+                'WHERE hotel = ? ORDER BY id', (name,))
+            waiting = self._query(
+                'SELECT ticket, tier, customer, check_in, check_out '
+                'FROM waitlist WHERE hotel = ?', (name,))
+        hotel.reservations = [customer for customer, check_in, _
+                              in reservations if check_in is None]
+        for customer, check_in, check_out in reservations:
+            if check_in is not None:
+                hotel._add_stay(
+                    Stay(customer, *stay_dates(check_in, check_out)))
+        hotel.waitlist = Waitlist(_waiting(*row) for row in waiting)
+        hotel.tickets = rows[0][3]
+        hotel.version = rows[0][2]
+        hotel.track_changes()
+        return hotel
+
+    def save_hotel(self, hotel):
+        """Applies the changes of a hotel row by row, or replaces its rows
+        when the changes were not tracked."""
+        with self._transaction() as connection:
+            self._write_hotel(connection, hotel)
+            self._index_availability(hotel)
+
+    def compare_and_save_hotel(self, hotel):
+        """Saves a hotel in one transaction if its row still holds the
+        version the hotel was loaded at."""
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'UPDATE hotels SET version = version + 1 '
+                'WHERE name = ? AND version = ?', (hotel.name, hotel.version))
+            if cursor.rowcount == 0:
+                return False
+            hotel.version += 1
+            self._write_hotel(connection, hotel)
+            # Indexed under the mutex so concurrent saves land in order
+            self._index_availability(hotel)
+            return True
+
+    def _write_hotel(self, connection, hotel):
+        """Writes a hotel inside the current transaction."""
+        if hotel.changes is None:
+            connection.execute(
+                'INSERT INTO hotels (name, rooms, version, tickets) '
+                'VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET rooms = excluded.rooms, '
+                'version = excluded.version, tickets = excluded.tickets',
+                (hotel.name, hotel.rooms, hotel.version, hotel.tickets))
+            connection.execute(
+                'DELETE FROM reservations WHERE hotel = ?', (hotel.name,))
+            connection.executemany(
+                'INSERT INTO reservations (hotel, customer) VALUES (?, ?)',
+                [(hotel.name, customer) for customer in hotel.reservations])
+            connection.executemany(
+                'INSERT INTO reservations (hotel, customer, check_in, '
+                'check_out) VALUES (?, ?, ?, ?)',
+                [(hotel.name, stay.customer, stay.check_in.isoformat(),
+                  stay.check_out.isoformat()) for stay in hotel.stays])
+            connection.execute(
+                'DELETE FROM waitlist WHERE hotel = ?', (hotel.name,))
+            connection.executemany(
+                'INSERT INTO waitlist (hotel, ticket, tier, customer, '
+                'check_in, check_out) VALUES (?, ?, ?, ?, ?, ?)',
+                [(hotel.name, entry.ticket, entry.tier, entry.customer,
+                  entry.check_in and entry.check_in.isoformat(),
+                  entry.check_out and entry.check_out.isoformat())
+                 for entry in hotel.waitlist])
+            return
+        # Only the reservations touched by the changes are written
+        for record in hotel.changes:
+            if record['op'] == 'wait':
+                connection.execute(
+                    'INSERT INTO waitlist (hotel, ticket, tier, customer, '
+                    'check_in, check_out) VALUES (?, ?, ?, ?, ?, ?)',
+                    (hotel.name, record['ticket'], record['tier'],
+                     record['customer'], record.get('check_in'),
+                     record.get('check_out')))
+            elif record['op'] == 'unwait':
+                connection.execute(
+                    'DELETE FROM waitlist WHERE hotel = ? AND ticket = ?',
+                    (hotel.name, record['ticket']))
+            elif record['op'] == 'reserve':
+                connection.execute(
+                    'INSERT INTO reservations (hotel, customer, check_in, '
+                    'check_out) VALUES (?, ?, ?, ?)',
+                    (hotel.name, record['customer'], record.get('check_in'),
+                     record.get('check_out')))
+            elif record['op'] == 'cancel':
+                connection.execute(
+                    'DELETE FROM reservations WHERE id = ('
+                    'SELECT MAX(id) FROM reservations '
+                    'WHERE hotel = ? AND customer = ? '
+                    'AND check_in IS ? AND check_out IS ?)',
+                    (hotel.name, record['customer'], record.get('check_in'),
+                     record.get('check_out')))
+            elif record['op'] == 'rename':
+                for table in ('reservations', 'waitlist'):
+                    connection.execute(
+                        f'UPDATE {table} SET customer = ? '
+                        f'WHERE hotel = ? AND customer = ?',
+                        (record['new_name'], hotel.name, record['customer']))
+        connection.execute(
+            'UPDATE hotels SET rooms = ?, version = ?, tickets = ? '
+            'WHERE name = ?',
+            (hotel.rooms, hotel.version, hotel.tickets, hotel.name))
+        hotel.changes = []
+
+    def delete_hotel(self, name):
+        """Removes a hotel and its reservations if it exists."""
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM hotels WHERE name = ?', (name,))
+            self._rename_availability(name, None)
+
+    def rename_hotel(self, old_name, new_name):
+        """Renames a hotel; its reservations follow through the foreign key."""
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE hotels SET name = ?, version = version + 1 '
+                'WHERE name = ?', (new_name, old_name))
+            self._rename_availability(old_name, new_name)
+
+    def hotel_names(self):
+        """Returns the names of all hotel rows."""
+        return [name for (name,) in self._query('SELECT name FROM hotels')]
+
+    def load_customer(self, name):
+        """Returns the customer with the given name, or None."""
+        with self._mutex:
+            rows = self._query('SELECT tier FROM customers WHERE name = ?',
+                               (name,))
+            if not rows:
+                return None
+            customer = Customer(name)
+            customer.tier = rows[0][0]
+            customer.hotels = [hotel for (hotel,) in self._query(
+                'SELECT hotel FROM reservations WHERE customer = ? '
+                'ORDER BY id', (name,))]
+        return customer
+
+    def load_customers(self, names):
+        """Returns a dict of the stored customers among the given names,
+        loaded with one query per chunk of names."""
+        names = list(names)
+        customers = {}
+        for start in range(0, len(names), self.CHUNK_SIZE):
+            chunk = names[start:start + self.CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            for name, tier in self._query(
+                    f'SELECT name, tier FROM customers '
+                    f'WHERE name IN ({placeholders})', chunk):
+                customers[name] = Customer(name)
+                customers[name].tier = tier
+            for name, hotel in self._query(
+                    f'SELECT customer, hotel FROM reservations '
+                    f'WHERE customer IN ({placeholders}) ORDER BY id', chunk):
+                if name in customers:
+                    customers[name].add_hotel(hotel)
+        return customers
+
+    def save_customer(self, customer):
+        """Creates or updates the row of a customer."""
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT INTO customers (name, tier) VALUES (?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET tier = excluded.tier',
+                (customer.name, customer.tier))
+
+    def delete_customer(self, name):
+        """Removes a customer if it exists."""
+        with self._transaction() as connection:
+            connection.execute(
+                'DELETE FROM customers WHERE name = ?', (name,))
+
+    def rename_customer(self, old_name, new_name):
+        """Renames a customer and its reservations in one transaction."""
+        if old_name == new_name:
+            return
+        with self._transaction() as connection:
+            rows = connection.execute(
+                'SELECT tier FROM customers WHERE name = ?',
+                (old_name,)).fetchall()
+            if not rows:
+                return
+            connection.execute(
+                'DELETE FROM customers WHERE name = ?', (old_name,))
+            connection.execute(
+                'INSERT OR IGNORE INTO customers (name, tier) VALUES (?, ?)',
+                (new_name, rows[0][0]))
+            # Hotels loaded before the rename must not be saved over it
+            connection.execute(
+                'UPDATE hotels SET version = version + 1 WHERE name IN ('
+                'SELECT hotel FROM reservations WHERE customer = ? UNION '
+                'SELECT hotel FROM waitlist WHERE customer = ?)',
+                (old_name, old_name))
+            for table in ('reservations', 'waitlist'):
+                connection.execute(
+                    f'UPDATE {table} SET customer = ? WHERE customer = ?',
+                    (new_name, old_name))
+
+    def customer_names(self):
+        """Returns the names of all customer rows."""
+        return [name for (name,) in self._query('SELECT name FROM customers')]
+
+    def hotels_with_reservation(self, customer_name):
+        """Returns the hotels a customer has reservations in."""
+        return [hotel for (hotel,) in self._query(
+            'SELECT DISTINCT hotel FROM reservations WHERE customer = ?',
+            (customer_name,))]
+
+    def customers_without_reservation(self):
+        """Returns the names of customers without any reservation."""
+        return [name for (name,) in self._query(
+            'SELECT name FROM customers WHERE NOT EXISTS ('
+            'SELECT 1 FROM reservations '
+            'WHERE reservations.customer = customers.name)')]
+
+    def close(self):
+        """Closes the database connection."""
+        with self._mutex:
+            self.connection.close()
+
+
+_storage = FileStorage()
+
+
+def use_storage(storage):
+    """Installs the backend used by all hotel and customer functions."""
+    global _storage
+    _storage = storage
+
+
+def get_storage():
+    """Returns the backend used by all hotel and customer functions."""
+    return _storage
+
+
+@metrics.instrument
 def create_hotel(name, rooms):
-    """Creates a new hotel and saves it to a file."""
-    hotel = Hotel(name, rooms)
-    save_to_file(hotel, f'{name}.hotel')
+    """Creates a new hotel and saves it."""
+    _storage.save_hotel(Hotel(name, rooms))
 
 
+def _reindex_customers(hotel, new_name=None):
+    """Removes a hotel from the index of its customers and of the customers
+    on its waitlist, or renames it."""
+    for customer_name, count in hotel.customer_counts():
+        customer = _storage.load_customer(customer_name)
+        if customer:
+            customer.remove_hotel(hotel.name, count)
+            if new_name is not None:
+                customer.hotels.extend([new_name] * count)
+            _storage.save_customer(customer)
+    for entry in hotel.waitlist:
+        customer = _storage.load_customer(entry.customer)
+        if customer:
+            customer.remove_waiting(hotel.name)
+            if new_name is not None:
+                customer.add_waiting(new_name)
+            _storage.save_customer(customer)
+
+
+@metrics.instrument
 def delete_hotel(name):
-    """Deletes a hotel by removing its file."""
-    if os.path.exists(f'{name}.hotel'):
-        os.remove(f'{name}.hotel')
+    """Deletes a hotel."""
+    hotel = _storage.load_hotel(name)
+    if hotel:
+        _reindex_customers(hotel)
+        _storage.delete_hotel(name)
 
 
+@metrics.instrument
+def rename_hotel(old_name, new_name):
+    """Renames a hotel, keeping its rooms and reservations."""
+    hotel = _storage.load_hotel(old_name)
+    if hotel and old_name != new_name:
+        _storage.rename_hotel(old_name, new_name)
+        _reindex_customers(hotel, new_name)
+
+
+@metrics.instrument
 def display_hotel(name):
     """Displays the details of a hotel."""
-    hotel = load_from_file(Hotel, f'{name}.hotel')
+    hotel = _storage.load_hotel(name)
     if hotel:
         print(f'Hotel Name: {hotel.name}')
         print(f'Available Rooms: {hotel.rooms}')
         print('Reservations:')
         for customer in hotel.reservations:
             print(f' - {customer}')
+        for stay in hotel.stays:
+            print(f' - {stay.customer} ({stay.check_in} to {stay.check_out})')
 
 
+@metrics.instrument
 def modify_hotel(name, new_rooms):
-    """Modifies the number of rooms in a hotel."""
-    hotel = load_from_file(Hotel, f'{name}.hotel')
-    if hotel and new_rooms is not None:
+    """Modifies the number of rooms in a hotel, giving added rooms to the
+    customers on its waitlist, and returns the Waiting entries of the
+    customers served."""
+    def update(hotel):
         # Calculate the difference between the old and new total
         # number of rooms
         room_difference = new_rooms - (hotel.rooms + len(hotel.reservations))
@@ -119,57 +2441,312 @@ def modify_hotel(name, new_rooms):
         hotel.rooms += room_difference
         # Ensure that the number of available rooms does not become negative
         hotel.rooms = max(hotel.rooms, 0)
-        save_to_file(hotel, f'{name}.hotel')
+        return True, hotel.drain_waitlist(_customer_exists)
+
+    if new_rooms is None:
+        return []
+    result = _storage.update_hotel(name, update)
+    if not result:
+        return []
+    _index_served(name, result[1])
+    return result[1]
 
 
+@metrics.instrument
 def create_customer(name):
-    """Creates a new customer and saves it to a file."""
-    customer = Customer(name)
-    save_to_file(customer, f'{name}.customer')
+    """Creates a new customer and saves it."""
+    _storage.save_customer(Customer(name))
+
+
+@metrics.instrument
+def set_loyalty_tier(name, tier):
+    """Sets the loyalty tier of a customer; waitlists serve customers of
+    higher tiers first."""
+    def update(customer):
+        customer.tier = tier
+
+    _storage.update_customer(name, update)
 
 
+@metrics.instrument
 def delete_customer(name):
-    """Deletes a customer by removing its file."""
-    if os.path.exists(f'{name}.customer'):
-        os.remove(f'{name}.customer')
+    """Deletes a customer."""
+    _storage.delete_customer(name)
 
 
+@metrics.instrument
 def display_customer(name):
     """Displays the details of a customer."""
-    customer = load_from_file(Customer, f'{name}.customer')
+    customer = _storage.load_customer(name)
     if customer:
         print(f'Customer Name: {customer.name}')
 
 
+@metrics.instrument
 def modify_customer(old_name, new_name):
     """Modifies the name of a customer."""
-    customer = load_from_file(Customer, f'{old_name}.customer')
-    if customer:
-        customer.name = new_name
-        save_to_file(customer, f'{new_name}.customer')
-        if old_name != new_name:
-            os.remove(f'{old_name}.customer')
-            # Update customer name in all hotels
-            for hotel_file in os.listdir():
-                if hotel_file.endswith('.hotel'):
-                    hotel = load_from_file(Hotel, hotel_file)
-                    if hotel.update_reservation(old_name, new_name):
-                        save_to_file(hotel, hotel_file)
-
-
-def create_reservation(customer_name, hotel_name):
-    """Creates a reservation for a customer in a hotel."""
-    customer = load_from_file(Customer, f'{customer_name}.customer')
-    hotel = load_from_file(Hotel, f'{hotel_name}.hotel')
-    if customer and hotel:
-        if hotel.reserve_room(customer):
-            save_to_file(hotel, f'{hotel_name}.hotel')
-
-
-def cancel_reservation(customer_name, hotel_name):
-    """Cancels a reservation for a customer in a hotel."""
-    customer = load_from_file(Customer, f'{customer_name}.customer')
-    hotel = load_from_file(Hotel, f'{hotel_name}.hotel')
-    if customer and hotel:
-        if hotel.cancel_reservation(customer):
-            save_to_file(hotel, f'{hotel_name}.hotel')
+    _storage.rename_customer(old_name, new_name)
+
+
+@metrics.instrument
+def hotels_with_reservation(customer_name):
+    """Returns the hotels a customer has reservations in."""
+    return _storage.hotels_with_reservation(customer_name)
+
+
+@metrics.instrument
+def customers_without_reservation():
+    """Returns the names of customers without any reservation."""
+    return _storage.customers_without_reservation()
+
+
+@metrics.instrument
+def rebuild_reservation_index():
+    """Recomputes the customer-to-hotel index, e.g. for data files written
+    before the index existed."""
+    _storage.rebuild_index()
+
+
+Ticket = collections.namedtuple('Ticket', ['hotel', 'number', 'position'])
+
+
+def _customer_exists(name):
+    """Returns whether a customer is stored."""
+    return _storage.load_customer(name) is not None
+
+
+def _index_served(hotel_name, served):
+    """Moves a hotel from the waiting to the reservations of the customers
+    it gave rooms to."""
+    def serve(customer):
+        customer.remove_waiting(hotel_name)
+        customer.add_hotel(hotel_name)
+
+    for entry in served:
+        _storage.update_customer(entry.customer, serve)
+
+
+def _waiting_ticket(hotel_name, customer_name, check_in, check_out):
+    """Returns the Ticket of a customer waiting for a stay in a hotel, or
+    None."""
+    hotel = _storage.load_hotel(hotel_name)
+    entry = hotel and hotel.waiting_entry(customer_name, check_in, check_out)
+    if not entry:
+        return None
+    return Ticket(hotel_name, entry.ticket,
+                  hotel.waitlist.position(entry.ticket))
+
+
+@metrics.instrument
+def create_reservation(customer_name, hotel_name, check_in=None,
+                       check_out=None, wait=False):
+    """Creates a reservation for a customer in a hotel, open-ended or for
+    the nights from check_in to check_out.
+
+    With wait=True, a customer the hotel has no room for is put on its
+    waitlist instead, and the Ticket of its place is returned; rooms freed
+    later are given to the waiting customers without further requests.
+    """
+    customer = _storage.load_customer(customer_name)
+    if not customer:
+        return None
+    if wait:
+        # Customers asking again are told their place without a save
+        ticket = _waiting_ticket(hotel_name, customer_name, check_in,
+                                 check_out)
+        if ticket:
+            return ticket
+
+    def update(hotel):
+        if hotel.reserve_room(customer, check_in, check_out):
+            return True
+        if not wait or hotel.waiting_entry(customer_name, check_in,
+                                           check_out):
+            return False
+        entry = hotel.join_waitlist(customer, check_in, check_out)
+        return Ticket(hotel_name, entry.ticket,
+                      hotel.waitlist.position(entry.ticket))
+
+    result = _storage.update_hotel(hotel_name, update)
+    if isinstance(result, Ticket):
+        _storage.update_customer(
+            customer_name,
+            lambda customer: customer.add_waiting(hotel_name))
+        return result
+    if result:
+        _storage.update_customer(
+            customer_name, lambda customer: customer.add_hotel(hotel_name))
+    elif wait:
+        # Put on the waitlist by a concurrent request
+        return _waiting_ticket(hotel_name, customer_name, check_in,
+                               check_out)
+    return None
+
+
+@metrics.instrument
+def cancel_reservation(customer_name, hotel_name, check_in=None,
+                       check_out=None):
+    """Cancels a reservation for a customer in a hotel, or the stay from
+    check_in to check_out, gives the freed room to the hotel's waitlist and
+    returns the Waiting entries of the customers served."""
+    customer = _storage.load_customer(customer_name)
+    if not customer:
+        return []
+
+    def update(hotel):
+        if hotel.cancel_reservation(customer, check_in, check_out):
+            return True, hotel.drain_waitlist(_customer_exists)
+        return False
+
+    result = _storage.update_hotel(hotel_name, update)
+    if not result:
+        return []
+    _storage.update_customer(
+        customer_name, lambda customer: customer.remove_hotel(hotel_name))
+    _index_served(hotel_name, result[1])
+    return result[1]
+
+
+@metrics.instrument
+def waitlist_position(hotel_name, ticket):
+    """Returns the 1-based place of a ticket on the waitlist of a hotel, or
+    None once it got a room or left."""
+    hotel = _storage.load_hotel(hotel_name)
+    return hotel.waitlist.position(ticket) if hotel else None
+
+
+@metrics.instrument
+def leave_waitlist(hotel_name, ticket):
+    """Takes a ticket off the waitlist of a hotel and returns whether it
+    was waiting."""
+    entry = _storage.update_hotel(hotel_name,
+                                  lambda hotel: hotel.leave_waitlist(ticket))
+    if entry:
+        _storage.update_customer(
+            entry.customer,
+            lambda customer: customer.remove_waiting(hotel_name))
+    return bool(entry)
+
+
+@metrics.instrument
+def hotels_with_free_rooms(minimum=1, limit=None):
+    """Returns the names of the hotels with at least minimum free rooms,
+    most free first, and at most limit of them."""
+    return _storage.availability().at_least(minimum, limit)
+
+
+@metrics.instrument
+def room_available(hotel_name, check_in, check_out):
+    """Returns whether a hotel has a room free on every night from
+    check_in to check_out."""
+    hotel = _storage.load_hotel(hotel_name)
+    return bool(hotel) and hotel.is_available(check_in, check_out)
+
+
+@metrics.instrument
+def peak_occupancy(hotel_name, check_in, check_out):
+    """Returns the most rooms of a hotel taken on any night from check_in
+    to check_out, or None if the hotel does not exist."""
+    hotel = _storage.load_hotel(hotel_name)
+    return hotel.peak_occupancy(check_in, check_out) if hotel else None
+
+
+BatchResult = collections.namedtuple(
+    'BatchResult', ['customer', 'hotel', 'ok', 'reason'])
+
+
+def _apply_batch(pairs, reserve):
+    """Reserves or cancels (customer name, hotel name) pairs, optionally
+    followed by check_in and check_out dates, grouped by hotel, saving each
+    touched hotel and customer once; rooms freed by cancellations go to the
+    waitlist of their hotel; items with invalid dates are refused before
+    any hotel is touched."""
+    pairs = list(pairs)
+    results = [None] * len(pairs)
+    indexes_by_hotel = {}
+    for index, pair in enumerate(pairs):
+        dates = pair[2:]
+        if any(date is not None for date in dates):
+            try:
+                pairs[index] = pair[:2] + stay_dates(*dates)
+            except (TypeError, ValueError):
+                results[index] = BatchResult(pair[0], pair[1], False,
+                                             'invalid dates')
+                continue
+        indexes_by_hotel.setdefault(pair[1], []).append(index)
+    customers = _storage.load_customers(
+        {pairs[index][0] for indexes in indexes_by_hotel.values()
+         for index in indexes})
+
+    applied_by_customer = {}
+    served_by_hotel = {}
+    for hotel_name, indexes in indexes_by_hotel.items():
+        def apply(hotel, indexes=indexes):
+            applied = []
+            for index in indexes:
+                customer_name, _, *dates = pairs[index]
+                customer = customers.get(customer_name)
+                if customer is None:
+                    continue
+                if reserve:
+                    succeeded = hotel.reserve_room(customer, *dates)
+                else:
+                    succeeded = hotel.cancel_reservation(customer, *dates)
+                if succeeded:
+                    applied.append(index)
+            if not applied:
+                # Nothing to save
+                return ()
+            served = [] if reserve else hotel.drain_waitlist(_customer_exists)
+            return applied, served
+
+        # None when the hotel does not exist, otherwise the applied indexes
+        # and the waiting customers given rooms
+        applied = _storage.update_hotel(hotel_name, apply)
+        if applied is not None:
+            applied, served = applied or ((), ())
+            applied = set(applied)
+            served_by_hotel[hotel_name] = served
+        for index in indexes:
+            customer_name = pairs[index][0]
+            if customer_name not in customers:
+                reason = 'unknown customer'
+            elif applied is None:
+                reason = 'unknown hotel'
+            elif index in applied:
+                reason = None
+                applied_by_customer.setdefault(customer_name, []).append(
+                    hotel_name)
+            else:
+                reason = 'no rooms available' if reserve else 'no reservation'
+            results[index] = BatchResult(customer_name, hotel_name,
+                                         reason is None, reason)
+
+    for customer_name, hotel_names in applied_by_customer.items():
+        def index(customer, hotel_names=hotel_names):
+            for hotel_name in hotel_names:
+                if reserve:
+                    customer.add_hotel(hotel_name)
+                else:
+                    customer.remove_hotel(hotel_name)
+
+        _storage.update_customer(customer_name, index)
+    for hotel_name, served in served_by_hotel.items():
+        _index_served(hotel_name, served)
+    return results
+
+
+@metrics.instrument
+def create_reservations(pairs):
+    """Creates reservations for (customer name, hotel name) pairs, or
+    (customer name, hotel name, check_in, check_out) tuples for dated stays,
+    and returns a BatchResult for each, in order."""
+    return _apply_batch(pairs, reserve=True)
+
+
+@metrics.instrument
+def cancel_reservations(pairs):
+    """Cancels reservations for (customer name, hotel name) pairs, or
+    (customer name, hotel name, check_in, check_out) tuples for dated stays,
+    and returns a BatchResult for each, in order."""
+    return _apply_batch(pairs, reserve=False)
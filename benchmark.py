@@ -0,0 +1,362 @@
+"""
+This benchmark module measures how the hotel reservation system scales with
+the size of its data.
+
+It generates a synthetic dataset of configurable size, with reservations
+spread over the hotels following a Zipf distribution so a few popular
+hotels hold most bookings, and then times every public function of the
+abstractions module plus loading the dataset model and the query helpers of
+the GUI. For each operation it reports operations per second and the p50/p99
+latency, optionally saves the results as JSON and compares them with an
+earlier run.
+
+Example:
+
+    python benchmark.py --hotels 1000 --customers 20000 \\
+        --reservations 50000 --output after.json --compare before.json
+
+The benchmark can be run by executing this module.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import abstractions as a
+import model
+import serialization
+import sharding
+
+try:
+    import gui
+except ImportError:
+    # Without tkinter the GUI query helpers are not benchmarked
+    gui = None
+
+
+# Durability modes of the file backend by name
+DURABILITY = {'none': lambda: None, 'fsync': a.Fsync,
+              'group': a.GroupCommit}
+
+
+def zipf_weights(count, skew):
+    """Returns cumulative Zipf weights for count ranked items."""
+    return list(itertools.accumulate(
+        1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def generate_dataset(hotels, customers, reservations, skew=1.0,
+                     min_rooms=10, max_rooms=500, seed=0, batch_size=1000):
+    """Fills the current storage backend with a synthetic dataset and
+    returns the hotel and customer names.
+
+    Hotels get a random number of rooms, and reservations pick their hotel
+    with Zipf-distributed popularity and their customer uniformly.
+    """
+    rng = random.Random(seed)
+    storage = a.get_storage()
+    hotel_names = [f'hotel-{i}' for i in range(hotels)]
+    customer_names = [f'customer-{i}' for i in range(customers)]
+    for name in hotel_names:
+        storage.save_hotel(a.Hotel(name, rng.randint(min_rooms, max_rooms)))
+    for name in customer_names:
+        storage.save_customer(a.Customer(name))
+    if hotel_names and customer_names:
+        weights = zipf_weights(hotels, skew)
+        for start in range(0, reservations, batch_size):
+            count = min(batch_size, reservations - start)
+            a.create_reservations(zip(
+                rng.choices(customer_names, k=count),
+                rng.choices(hotel_names, cum_weights=weights, k=count)))
+    return hotel_names, customer_names
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value at a fraction of a sorted list."""
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def measure(operation, iterations):
+    """Calls operation(i) for each iteration and returns its statistics."""
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(iterations):
+            start = time.perf_counter()
+            operation(i)
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / total if total else float('inf'),
+        'mean_ms': total / iterations * 1000,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def operations(hotel_names, customer_names, skew, batch_size, seed=1,
+               router=None):
+    """Returns (name, operation, heavy) triples for every benchmarked
+    function, and for the batches of a ShardRouter if given; heavy
+    operations scan the whole dataset."""
+    rng = random.Random(seed)
+    weights = zipf_weights(len(hotel_names), skew)
+
+    def hotel():
+        return rng.choices(hotel_names, cum_weights=weights)[0]
+
+    def customer():
+        return rng.choice(customer_names)
+
+    def pairs():
+        return list(zip(rng.choices(customer_names, k=batch_size),
+                        rng.choices(hotel_names, cum_weights=weights,
+                                    k=batch_size)))
+
+    def stay():
+        check_in = datetime.date(2024, 1, 1) + datetime.timedelta(
+            days=rng.randrange(365))
+        return check_in, check_in + datetime.timedelta(
+            days=rng.randint(1, 14))
+
+    def modify_hotel(i):
+        name = hotel()
+        stored = a.get_storage().load_hotel(name)
+        a.modify_hotel(name, stored.rooms + len(stored.reservations) + 1)
+
+    # A hotel without rooms, whose waitlist takes every request
+    a.create_hotel('bench-waitlist', 0)
+
+    ops = [
+        ('create_hotel', lambda i: a.create_hotel(f'bench-hotel-{i}', 100),
+         False),
+        ('display_hotel', lambda i: a.display_hotel(hotel()), False),
+        ('modify_hotel', modify_hotel, False),
+        ('rename_hotel',
+         lambda i: a.rename_hotel(f'bench-hotel-{i}', f'bench-renamed-{i}'),
+         False),
+        ('delete_hotel', lambda i: a.delete_hotel(f'bench-renamed-{i}'),
+         False),
+        ('create_customer',
+         lambda i: a.create_customer(f'bench-customer-{i}'), False),
+        ('display_customer', lambda i: a.display_customer(customer()),
+         False),
+        ('create_reservation',
+         lambda i: a.create_reservation(f'bench-customer-{i}', hotel()),
+         False),
+        ('hotels_with_reservation',
+         lambda i: a.hotels_with_reservation(customer()), False),
+        ('modify_customer',
+         lambda i: a.modify_customer(f'bench-customer-{i}',
+                                     f'bench-renamed-customer-{i}'),
+         False),
+        ('cancel_reservation',
+         lambda i: a.cancel_reservation(customer(), hotel()), False),
+        ('delete_customer',
+         lambda i: a.delete_customer(f'bench-renamed-customer-{i}'), False),
+        ('create_reservations', lambda i: a.create_reservations(pairs()),
+         False),
+        ('cancel_reservations', lambda i: a.cancel_reservations(pairs()),
+         False),
+        ('set_loyalty_tier',
+         lambda i: a.set_loyalty_tier(customer(), rng.randrange(4)), False),
+        ('create_reservation.wait',
+         lambda i: a.create_reservation(customer(), 'bench-waitlist',
+                                        wait=True), False),
+        ('waitlist_position',
+         lambda i: a.waitlist_position('bench-waitlist', i + 1), False),
+        ('leave_waitlist',
+         lambda i: a.leave_waitlist('bench-waitlist', i + 1), False),
+        ('hotels_with_free_rooms',
+         lambda i: a.hotels_with_free_rooms(5, limit=20), False),
+        ('room_available', lambda i: a.room_available(hotel(), *stay()),
+         False),
+        ('peak_occupancy', lambda i: a.peak_occupancy(hotel(), *stay()),
+         False),
+        ('customers_without_reservation',
+         lambda i: a.customers_without_reservation(), True),
+        ('rebuild_reservation_index',
+         lambda i: a.rebuild_reservation_index(), True),
+        ('model.load', lambda i: model.DatasetModel().load(), True),
+    ]
+    storage = a.get_storage()
+    if isinstance(storage, a.FileStorage):
+        ops[:0] = [
+            ('load_from_file',
+             lambda i: a.load_from_file(a.Hotel, storage.hotel_path(hotel())),
+             False),
+            ('save_to_file',
+             lambda i: a.save_to_file(a.Hotel('bench-file', 100),
+                                      storage.hotel_path('bench-file')),
+             False),
+        ]
+    if router is not None:
+        ops += [
+            ('sharded.create_reservations',
+             lambda i: router.create_reservations(pairs()), False),
+            ('sharded.cancel_reservations',
+             lambda i: router.cancel_reservations(pairs()), False),
+        ]
+    if gui is not None:
+        # The query helpers do not touch any widget, only the model
+        window = gui.HotelReservationGUI.__new__(gui.HotelReservationGUI)
+        window.model = model.DatasetModel()
+        window.model.load()
+        ops += [
+            ('gui.get_all_hotels', lambda i: window.get_all_hotels(), True),
+            ('gui.get_all_customers', lambda i: window.get_all_customers(),
+             True),
+            ('gui.get_hotels_with_available_rooms',
+             lambda i: window.get_hotels_with_available_rooms(), False),
+            ('gui.get_customers_without_reservation',
+             lambda i: window.get_customers_without_reservation(), True),
+            ('gui.get_hotels_with_reservations',
+             lambda i: window.get_hotels_with_reservations(customer()),
+             False),
+        ]
+    return ops
+
+
+def run(hotels, customers, reservations, skew=1.0, backend='file',
+        iterations=200, scan_iterations=3, batch_size=100, seed=0,
+        codec='json', shards=0, durability='none'):
+    """Generates a dataset in a temporary directory, benchmarks every
+    operation on it, with shards worker processes for the sharded batches
+    of the file backend, and returns the results."""
+    config = {'hotels': hotels, 'customers': customers,
+              'reservations': reservations, 'skew': skew,
+              'backend': backend, 'iterations': iterations,
+              'scan_iterations': scan_iterations, 'batch_size': batch_size,
+              'seed': seed, 'codec': codec, 'shards': shards,
+              'durability': durability}
+    previous_storage = a.get_storage()
+    with tempfile.TemporaryDirectory() as directory:
+        if backend == 'sqlite':
+            storage = a.SQLiteStorage(os.path.join(directory, 'bench.db'))
+        else:
+            storage = a.FileStorage(directory,
+                                    serialization.get_codec(codec),
+                                    durability=DURABILITY[durability]())
+        a.use_storage(storage)
+        router = None
+        try:
+            start = time.perf_counter()
+            hotel_names, customer_names = generate_dataset(
+                hotels, customers, reservations, skew, seed=seed)
+            config['generate_seconds'] = time.perf_counter() - start
+            if shards and backend == 'file':
+                router = sharding.ShardRouter(
+                    shards, directory, serialization.get_codec(codec))
+            results = {}
+            for name, operation, heavy in operations(
+                    hotel_names, customer_names, skew, batch_size,
+                    router=router):
+                results[name] = measure(
+                    operation, scan_iterations if heavy else iterations)
+        finally:
+            if router is not None:
+                router.close()
+            a.use_storage(previous_storage)
+            storage.close()
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'config': config,
+        'results': results,
+    }
+
+
+def compare(previous, current, threshold=1.5):
+    """Returns report lines comparing the p50 latency of two runs and the
+    names of operations that got slower by more than threshold times."""
+    lines = [f'{"operation":40} {"before":>10} {"after":>10} {"ratio":>7}']
+    if previous['config'] != current['config']:
+        lines.insert(0, 'Note: the runs used different configurations')
+    regressions = []
+    for name, result in current['results'].items():
+        before = previous['results'].get(name)
+        if before is None:
+            continue
+        ratio = (result['p50_ms'] / before['p50_ms']
+                 if before['p50_ms'] else float('inf'))
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        lines.append(f'{name:40} {before["p50_ms"]:10.3f} '
+                     f'{result["p50_ms"]:10.3f} {ratio:7.2f}{flag}')
+    return lines, regressions
+
+
+def format_results(report):
+    """Returns report lines for the results of a run."""
+    lines = [f'{"operation":40} {"ops/sec":>12} {"p50 ms":>10} '
+             f'{"p99 ms":>10}']
+    for name, result in report['results'].items():
+        lines.append(f'{name:40} {result["ops_per_sec"]:12.1f} '
+                     f'{result["p50_ms"]:10.3f} {result["p99_ms"]:10.3f}')
+    return lines
+
+
+def main():
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--hotels', type=int, default=100)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--reservations', type=int, default=2000)
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='Zipf exponent of hotel popularity')
+    parser.add_argument('--backend', choices=['file', 'sqlite'],
+                        default='file')
+    parser.add_argument('--codec', choices=sorted(serialization.CODECS),
+                        default='json',
+                        help='file format of the file backend')
+    parser.add_argument('--durability', choices=sorted(DURABILITY),
+                        default='none',
+                        help='disk flushes of the file backend')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='worker processes for sharded batches')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--scan-iterations', type=int, default=3,
+                        help='iterations of operations that scan all data')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare with the results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='p50 slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    report = run(args.hotels, args.customers, args.reservations, args.skew,
+                 args.backend, args.iterations, args.scan_iterations,
+                 args.batch_size, args.seed, args.codec, args.shards,
+                 args.durability)
+    print(f'Generated dataset in '
+          f'{report["config"]["generate_seconds"]:.2f} s')
+    print('\n'.join(format_results(report)))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            previous = json.load(file)
+        lines, regressions = compare(previous, report, args.threshold)
+        print()
+        print('\n'.join(lines))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
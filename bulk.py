@@ -0,0 +1,354 @@
+"""
+This bulk module imports and exports hotels, customers, reservations and
+waitlists as CSV or JSON Lines files.
+
+Both directions stream: the import reads one record at a time and commits
+every batch of records together, and the export streams the reservations
+of one hotel at a time with Storage.iter_reservations, so memory use does
+not grow with the size of the data. A record is a hotel
+with its total number of rooms and the last ticket its waitlist gave out, a
+customer with its loyalty tier, a reservation of a customer in a hotel,
+open-ended or for the nights from check_in to check_out, or a customer
+waiting for such a reservation with its ticket and the tier it joined
+with. CSV files have a header row naming the columns of FIELDS; JSON Lines
+files have one object per line with the same keys.
+
+Records may refer to hotels and customers stored before, or defined earlier
+in the same file. Invalid records and reservations that cannot be made are
+reported with their line number and skipped. An export lists the customers
+first and then every hotel followed by its reservations and waitlist, so
+importing it into an empty directory recreates the dataset.
+
+Example:
+
+    python bulk.py import bookings.csv --directory data/
+    python bulk.py export dataset.jsonl --directory data/
+
+The import and export can be run by executing this module.
+"""
+import argparse
+import collections
+import csv
+import json
+import os
+import sys
+
+import abstractions as a
+
+FIELDS = ['type', 'name', 'rooms', 'customer', 'hotel', 'check_in',
+          'check_out', 'tier', 'ticket']
+
+FORMATS = ['csv', 'jsonl']
+
+# Records committed at once
+BATCH_SIZE = 50000
+
+Rejection = collections.namedtuple('Rejection', ['line', 'reason'])
+
+
+def file_format(path):
+    """Returns the format of a file from its extension."""
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension in ('json', 'ndjson'):
+        extension = 'jsonl'
+    if extension not in FORMATS:
+        raise ValueError(f'Unknown format of {path!r}')
+    return extension
+
+
+def read_records(file, fmt):
+    """Yields (line number, record dict) pairs from an open file; records
+    that cannot be parsed are yielded as their error message."""
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, {key: value
+                                    for key, value in record.items()
+                                    if key is not None and value != ''}
+        return
+    for line, text in enumerate(file, 1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except json.JSONDecodeError as e:
+            yield line, f'Invalid JSON: {e}'
+            continue
+        yield line, record if isinstance(record, dict) else (
+            'Records must be JSON objects')
+
+
+def _count(record, key, default=None):
+    """Returns a non-negative integer field of a record, or default if it is
+    missing and has one, or raises ValueError."""
+    value = record.get(key, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{key.capitalize()} must be an integer') from None
+    if value < 0:
+        raise ValueError(f'{key.capitalize()} cannot be negative')
+    return value
+
+
+def validate(record):
+    """Returns the record with its values checked and converted, or raises
+    ValueError."""
+    if not isinstance(record, dict):
+        raise ValueError(record)
+    kind = record.get('type')
+    names = {'hotel': ['name'], 'customer': ['name'],
+             'reservation': ['customer', 'hotel'],
+             'waiting': ['customer', 'hotel']}.get(kind)
+    if names is None:
+        raise ValueError(f'Unknown record type {kind!r}')
+    for key in names:
+        if not isinstance(record.get(key), str) or not record[key]:
+            raise ValueError(f'Missing {key} of {kind}')
+    if kind == 'hotel':
+        return {'type': kind, 'name': record['name'],
+                'rooms': _count(record, 'rooms'),
+                'ticket': _count(record, 'ticket', 0)}
+    if kind == 'customer':
+        return {'type': kind, 'name': record['name'],
+                'tier': _count(record, 'tier', 0)}
+    check_in, check_out = record.get('check_in'), record.get('check_out')
+    if not all(isinstance(date, (str, type(None)))
+               for date in (check_in, check_out)):
+        raise ValueError('Dates must be ISO strings')
+    if check_in is not None or check_out is not None:
+        check_in, check_out = a.stay_dates(check_in, check_out)
+    validated = {'type': kind, 'customer': record['customer'],
+                 'hotel': record['hotel'], 'check_in': check_in,
+                 'check_out': check_out}
+    if kind == 'waiting':
+        validated['ticket'] = _count(record, 'ticket')
+        validated['tier'] = _count(record, 'tier', 0)
+    return validated
+
+
+def _join_waitlist(storage, record):
+    """Puts the customer of a waiting record on the waitlist of its hotel
+    with the record's ticket and tier, and returns None or the reason it
+    could not."""
+    if storage.load_customer(record['customer']) is None:
+        return 'unknown customer'
+    customer = a.Customer(record['customer'])
+    # The tier the customer joined with, which orders its entry
+    customer.tier = record['tier']
+
+    def join(hotel):
+        if hotel.waiting_entry(customer.name, record['check_in'],
+                               record['check_out']) is not None:
+            return False
+        hotel.join_waitlist(customer, record['check_in'],
+                            record['check_out'], record['ticket'])
+        return True
+
+    joined = storage.update_hotel(record['hotel'], join)
+    if joined is None:
+        return 'unknown hotel'
+    if not joined:
+        return 'already waiting'
+    storage.update_customer(
+        customer.name,
+        lambda stored: stored.add_waiting(record['hotel']))
+    return None
+
+
+def import_records(records, batch_size=BATCH_SIZE, on_reject=None):
+    """Stores (line number, record) pairs in batches and returns the number
+    of stored records of each type; on_reject(Rejection) is called for
+    every record skipped."""
+    storage = a.get_storage()
+    counts = collections.Counter()
+    batch = []
+
+    def reject(line, reason):
+        counts['rejected'] += 1
+        if on_reject:
+            on_reject(Rejection(line, reason))
+
+    def commit():
+        # Hotels and customers first, so the reservations can refer to them,
+        # and waitlists last, behind the reservations holding the rooms
+        reservations = []
+        waiting = []
+        for line, record in batch:
+            if record['type'] == 'hotel':
+                hotel = a.Hotel(record['name'], record['rooms'])
+                hotel.tickets = record['ticket']
+                storage.save_hotel(hotel)
+            elif record['type'] == 'customer':
+                customer = a.Customer(record['name'])
+                customer.tier = record['tier']
+                storage.save_customer(customer)
+            elif record['type'] == 'waiting':
+                waiting.append((line, record))
+                continue
+            else:
+                reservations.append(line)
+                continue
+            counts[record['type']] += 1
+        results = a.create_reservations(
+            (record['customer'], record['hotel'], record['check_in'],
+             record['check_out'])
+            for _, record in batch if record['type'] == 'reservation')
+        for line, result in zip(reservations, results):
+            if result.ok:
+                counts['reservation'] += 1
+            else:
+                reject(line, result.reason)
+        for line, record in waiting:
+            reason = _join_waitlist(storage, record)
+            if reason is None:
+                counts['waiting'] += 1
+            else:
+                reject(line, reason)
+        batch.clear()
+
+    for line, record in records:
+        try:
+            batch.append((line, validate(record)))
+        except ValueError as e:
+            reject(line, str(e))
+            continue
+        if len(batch) >= batch_size:
+            commit()
+    commit()
+    return dict(counts)
+
+
+def import_file(path, fmt=None, batch_size=BATCH_SIZE, on_reject=None):
+    """Imports the records of a CSV or JSON Lines file."""
+    fmt = fmt or file_format(path)
+    with open(path, encoding='utf-8', newline='') as file:
+        return import_records(read_records(file, fmt), batch_size,
+                              on_reject)
+
+
+def export_records():
+    """Yields a record for every customer, hotel, reservation and waitlist
+    entry of the storage backend."""
+    storage = a.get_storage()
+    names = list(storage.customer_names())
+    for start in range(0, len(names), BATCH_SIZE):
+        chunk = names[start:start + BATCH_SIZE]
+        customers = storage.load_customers(chunk)
+        for name in chunk:
+            record = {'type': 'customer', 'name': name}
+            tier = getattr(customers.get(name), 'tier', 0)
+            if tier:
+                record['tier'] = tier
+            yield record
+    for name in storage.hotel_names():
+        # Only the header of the hotel is parsed; the reservations are
+        # streamed, once to count the open-ended ones, which are already
+        # subtracted from rooms, and once to write them
+        hotel = storage.load_hotel(name)
+        if hotel is None:
+            continue
+        reserved = 0
+        for _, check_in, _, count in storage.iter_reservations(name):
+            if check_in is not None:
+                # The dated stays come after the open-ended reservations
+                break
+            reserved += count
+        record = {'type': 'hotel', 'name': name,
+                  'rooms': hotel.rooms + reserved}
+        if hotel.tickets:
+            record['ticket'] = hotel.tickets
+        yield record
+        for customer, check_in, check_out, count in (
+                storage.iter_reservations(name)):
+            record = {'type': 'reservation', 'customer': customer,
+                      'hotel': name}
+            if check_in is not None:
+                record['check_in'] = check_in.isoformat()
+                record['check_out'] = check_out.isoformat()
+            for _ in range(count):
+                yield dict(record)
+        if not hotel.tickets:
+            # No customer ever waited, so the waitlist is not built
+            continue
+        for entry in sorted(hotel.waitlist, key=lambda entry: entry.ticket):
+            record = {'type': 'waiting', 'customer': entry.customer,
+                      'hotel': name, 'ticket': entry.ticket,
+                      'tier': entry.tier}
+            if entry.check_in is not None:
+                record['check_in'] = entry.check_in.isoformat()
+                record['check_out'] = entry.check_out.isoformat()
+            yield record
+
+
+def write_records(records, file, fmt):
+    """Writes records to an open file and returns their number."""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, FIELDS)
+        writer.writeheader()
+        for count, record in enumerate(records, 1):
+            writer.writerow(record)
+        return count
+    for count, record in enumerate(records, 1):
+        file.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return count
+
+
+def export_file(path, fmt=None):
+    """Exports the whole dataset to a CSV or JSON Lines file and returns
+    the number of records written."""
+    fmt = fmt or file_format(path)
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        return write_records(export_records(), file, fmt)
+
+
+def main():
+    """Run the import or export from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('path', help="the file to read or write, or '-'")
+    parser.add_argument('--format', choices=FORMATS,
+                        help='the file format, by default from the '
+                             'extension')
+    parser.add_argument('--directory', default=os.curdir,
+                        help='the data directory of FileStorage')
+    parser.add_argument('--sqlite', metavar='PATH',
+                        help='use a SQLite database instead of files')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or (
+        'jsonl' if args.path == '-' else file_format(args.path))
+    if args.command == 'import' and not args.sqlite:
+        os.makedirs(args.directory, exist_ok=True)
+    storage = (a.SQLiteStorage(args.sqlite) if args.sqlite
+               else a.FileStorage(args.directory))
+    a.use_storage(storage)
+    try:
+        if args.command == 'import':
+            def report(rejection):
+                print(f'{args.path}:{rejection.line}: {rejection.reason}',
+                      file=sys.stderr)
+
+            if args.path == '-':
+                counts = import_records(read_records(sys.stdin, fmt),
+                                        args.batch_size, report)
+            else:
+                counts = import_file(args.path, fmt, args.batch_size, report)
+            print(f'Imported {counts.get("hotel", 0)} hotels, '
+                  f'{counts.get("customer", 0)} customers, '
+                  f'{counts.get("reservation", 0)} reservations and '
+                  f'{counts.get("waiting", 0)} waitlist entries; '
+                  f'rejected {counts.get("rejected", 0)} records')
+        elif args.path == '-':
+            write_records(export_records(), sys.stdout, fmt)
+        else:
+            count = export_file(args.path, fmt)
+            print(f'Exported {count} records')
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
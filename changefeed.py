@@ -0,0 +1,282 @@
+"""
+This changefeed module reports changes made to a data directory of
+FileStorage by any process, as typed events.
+
+A watcher finds out which files of the directory changed: on Linux it uses
+inotify, elsewhere, or when inotify is not available, it compares the sizes
+and modification times of the files at an interval. A ChangeFeed turns the
+changed files into events by comparing each changed hotel and customer with
+the state it last saw, so a booking shows up as a reservation added to a
+hotel rather than as a rewritten file.
+
+Example:
+
+    feed = ChangeFeed('data')
+    while True:
+        for event in feed.poll(timeout=1.0):
+            print(event)
+"""
+import collections
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+import abstractions as a
+
+HOTEL_CREATED = 'hotel_created'
+HOTEL_MODIFIED = 'hotel_modified'
+HOTEL_DELETED = 'hotel_deleted'
+CUSTOMER_CREATED = 'customer_created'
+CUSTOMER_MODIFIED = 'customer_modified'
+CUSTOMER_DELETED = 'customer_deleted'
+RESERVATION_ADDED = 'reservation_added'
+RESERVATION_REMOVED = 'reservation_removed'
+
+# Hotel events name the hotel, customer events the customer, and reservation
+# events both, with the number of reservations added or removed
+Event = collections.namedtuple('Event', ['type', 'hotel', 'customer',
+                                         'count'],
+                               defaults=(None, None, 1))
+
+# Seconds between scans of the polling watcher
+POLL_INTERVAL = 1.0
+
+# File name suffixes of the entities and of the hotel journals
+SUFFIXES = ('.hotel', '.hotel.log', '.customer')
+
+
+def _relevant(name):
+    """Returns whether a file name belongs to a hotel or customer."""
+    return name.endswith(SUFFIXES)
+
+
+class PollingWatcher:
+    """Finds changed files by comparing their sizes and modification times
+    at an interval."""
+
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        """Initializes PollingWatcher on a directory."""
+        self.directory = directory
+        self.interval = interval
+        self._signatures = self._scan()
+        self._scanned = time.monotonic()
+
+    def _scan(self):
+        """Returns the signature of every relevant file."""
+        signatures = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if _relevant(entry.name):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    signatures[entry.name] = (stat.st_mtime_ns,
+                                              stat.st_size)
+        return signatures
+
+    def changes(self, timeout=None):
+        """Waits up to timeout seconds for the next scan and returns the
+        names of the files changed, created or deleted since the last
+        one."""
+        delay = self._scanned + self.interval - time.monotonic()
+        if delay > 0:
+            if timeout is not None and timeout < delay:
+                time.sleep(timeout)
+                return set()
+            time.sleep(delay)
+        signatures = self._scan()
+        self._scanned = time.monotonic()
+        changed = {name for name in signatures.keys() | self._signatures
+                   if signatures.get(name) != self._signatures.get(name)}
+        self._signatures = signatures
+        return changed
+
+    def close(self):
+        """Stops watching."""
+
+
+class InotifyWatcher:
+    """Finds changed files with the inotify API of Linux."""
+
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+            | IN_DELETE)
+
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, directory):
+        """Initializes InotifyWatcher on a directory, or raises OSError if
+        inotify is not available."""
+        self.directory = directory
+        library = ctypes.util.find_library('c')
+        if not library:
+            raise OSError('The C library was not found')
+        libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory),
+                                  self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f'Cannot watch {directory}')
+
+    def changes(self, timeout=None):
+        """Waits up to timeout seconds for changes and returns the names of
+        the files changed, created or deleted; after an overflow of the
+        kernel queue every file counts as changed."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    overflow = True
+                elif _relevant(name):
+                    changed.add(name)
+        if overflow:
+            changed.update(name for name in os.listdir(self.directory)
+                           if _relevant(name))
+            changed.add(None)
+        return changed
+
+    def close(self):
+        """Stops watching."""
+        os.close(self._fd)
+
+
+def watcher(directory, interval=POLL_INTERVAL, polling=False):
+    """Returns an inotify watcher on a directory where possible, or else a
+    polling one."""
+    if not polling:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(directory, interval)
+
+
+class ChangeFeed:
+    """Typed events of the changes made to a data directory."""
+
+    def __init__(self, directory=os.curdir, interval=POLL_INTERVAL,
+                 polling=False):
+        """Initializes ChangeFeed on a data directory, starting from the
+        hotels and customers it holds now."""
+        self.storage = a.FileStorage(directory)
+        self.watcher = watcher(directory, interval, polling)
+        # Total rooms and reservation counts of every hotel, and every
+        # customer, as last seen
+        self._hotels = {}
+        self._customers = set(self.storage.customer_names())
+        for name in self.storage.hotel_names():
+            state = self._state(name)
+            if state is not None:
+                self._hotels[name] = state
+
+    def _state(self, name):
+        """Returns the total rooms and the reservation counts of a hotel, or
+        None."""
+        hotel = self.storage.load_hotel(name)
+        if hotel is None:
+            return None
+        # Open-ended reservations are subtracted from rooms
+        return (hotel.rooms + len(hotel.reservations),
+                collections.Counter(dict(hotel.customer_counts())))
+
+    def poll(self, timeout=None):
+        """Waits up to timeout seconds for changes and returns their
+        events."""
+        changed = self.watcher.changes(timeout)
+        if None in changed:
+            # Missed changes: compare everything known and stored
+            changed.discard(None)
+            changed.update(f'{name}.hotel' for name in self._hotels)
+            changed.update(f'{name}.customer' for name in self._customers)
+        hotels = set()
+        customers = set()
+        for name in changed:
+            if name.endswith('.customer'):
+                customers.add(name[:-len('.customer')])
+            elif name.endswith('.hotel.log'):
+                hotels.add(name[:-len('.hotel.log')])
+            else:
+                hotels.add(name[:-len('.hotel')])
+        for name in customers - self._customers:
+            # A renamed customer holds the reservations of its old name
+            # without any hotel file changing
+            hotels.update(self.storage.hotels_with_reservation(name))
+        events = []
+        for name in sorted(hotels):
+            events += self._hotel_events(name)
+        for name in sorted(customers):
+            events += self._customer_events(name)
+        return events
+
+    def _hotel_events(self, name):
+        """Returns the events of a hotel whose files changed."""
+        before = self._hotels.pop(name, None)
+        after = self._state(name)
+        if after is not None:
+            self._hotels[name] = after
+        if before == after:
+            return []
+        if before is None:
+            events = [Event(HOTEL_CREATED, name)]
+            before = (None, collections.Counter())
+        elif after is None:
+            events = [Event(HOTEL_DELETED, name)]
+            after = (None, collections.Counter())
+        else:
+            events = []
+        if None not in (before[0], after[0]) and before[0] != after[0]:
+            events.append(Event(HOTEL_MODIFIED, name))
+        for customer in sorted(before[1].keys() | after[1].keys()):
+            difference = after[1][customer] - before[1][customer]
+            if difference > 0:
+                events.append(Event(RESERVATION_ADDED, name, customer,
+                                    difference))
+            elif difference < 0:
+                events.append(Event(RESERVATION_REMOVED, name, customer,
+                                    -difference))
+        return events
+
+    def _customer_events(self, name):
+        """Returns the events of a customer whose file changed."""
+        exists = os.path.exists(self.storage.customer_path(name))
+        if name not in self._customers:
+            if not exists:
+                return []
+            self._customers.add(name)
+            return [Event(CUSTOMER_CREATED, customer=name)]
+        if not exists:
+            self._customers.discard(name)
+            return [Event(CUSTOMER_DELETED, customer=name)]
+        return [Event(CUSTOMER_MODIFIED, customer=name)]
+
+    def close(self):
+        """Stops watching the directory."""
+        self.watcher.close()
+        self.storage.close()
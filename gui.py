@@ -1,7 +1,39 @@
+import collections
+import concurrent.futures
+import queue
+import threading
 import tkinter as tk
 from tkinter import messagebox, ttk, simpledialog
 import abstractions as a
-import os
+import changefeed
+import model
+
+# Milliseconds between checks for finished background tasks
+POLL_INTERVAL = 50
+
+# Rows shown per page of the hotel and customer listings
+PAGE_SIZE = 100
+
+# Milliseconds between checks for changes made by other processes
+CHANGE_POLL_INTERVAL = 500
+
+
+class BackgroundTask:
+    """A function run on the worker thread whose result is handed back to the Tk main thread."""
+
+    def __init__(self, description, func, on_done=None, cancellable=False):
+        self.description = description
+        self.func = func
+        self.on_done = on_done
+        self.cancellable = cancellable
+        self.cancelled = threading.Event()
+        # (done, total) as last reported by the worker thread
+        self.progress = None
+        self.future = None
+
+    def report(self, done, total):
+        """Record the progress of the task; called from the worker thread."""
+        self.progress = (done, total)
 
 
 class HotelReservationGUI:
@@ -9,6 +41,15 @@ class HotelReservationGUI:
         self.root = root
         self.root.title("Hotel Reservation System")
 
+        # All storage access happens on a single worker thread, in order
+        self.model = model.DatasetModel()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.tasks = []
+
+        # Change events of the data directory, queued by the watcher thread
+        self.changes = queue.Queue()
+        self.watching = threading.Event()
+
         # Main Frame
         self.main_frame = tk.Frame(self.root)
         self.main_frame.pack(pady=20)
@@ -24,78 +65,254 @@ class HotelReservationGUI:
         tk.Button(self.main_frame, text="Delete Customer", command=self.delete_customer).grid(row=3, column=1, padx=10)
         tk.Button(self.main_frame, text="Make Reservation", command=self.make_reservation).grid(row=4, column=0, padx=10)
         tk.Button(self.main_frame, text="Cancel Reservation", command=self.cancel_reservation).grid(row=4, column=1, padx=10)
-
-        # Output Area
-        self.output_text = tk.Text(self.root, wrap=tk.WORD, width=80, height=20)
-        self.output_text.pack(pady=20)
+        tk.Button(self.main_frame, text="Reload Data", command=self.load_data).grid(row=5, column=0, columnspan=2, padx=10)
+
+        # Listing: only the rows of the current page exist as tree items,
+        # and the reservations of a row are inserted when it is expanded
+        self.list_frame = tk.Frame(self.root)
+        self.list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        search_frame = tk.Frame(self.list_frame)
+        search_frame.pack(fill=tk.X)
+        tk.Label(search_frame, text="Search:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add('write', lambda *args: self.show_page(0))
+        tk.Entry(search_frame, textvariable=self.search_var).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+
+        tree_frame = tk.Frame(self.list_frame)
+        tree_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+        self.tree = ttk.Treeview(tree_frame, columns=('rooms', 'reservations'), height=20)
+        self.tree.heading('#0', text="Name")
+        self.tree.heading('rooms', text="Available Rooms")
+        self.tree.heading('reservations', text="Reservations")
+        self.tree.column('#0', width=320)
+        self.tree.column('rooms', width=120, anchor=tk.E)
+        self.tree.column('reservations', width=120, anchor=tk.E)
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+        self.tree.bind('<<TreeviewOpen>>', self.expand_row)
+
+        page_frame = tk.Frame(self.list_frame)
+        page_frame.pack()
+        tk.Button(page_frame, text="< Previous", command=lambda: self.show_page(self.page - 1)).pack(side=tk.LEFT)
+        self.page_var = tk.StringVar()
+        tk.Label(page_frame, textvariable=self.page_var, width=20).pack(side=tk.LEFT)
+        tk.Button(page_frame, text="Next >", command=lambda: self.show_page(self.page + 1)).pack(side=tk.LEFT)
+
+        # 'hotels' or 'customers' once a listing is shown
+        self.listing = None
+        self.page = 0
+
+        # Status Bar
+        self.status_frame = tk.Frame(self.root)
+        self.status_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        self.status_var = tk.StringVar(value="Ready")
+        tk.Label(self.status_frame, textvariable=self.status_var, anchor=tk.W).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.progress_bar = ttk.Progressbar(self.status_frame, length=200, mode='determinate')
+        self.progress_bar.pack(side=tk.LEFT, padx=10)
+        self.cancel_button = tk.Button(self.status_frame, text="Cancel", command=self.cancel_task, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT)
+
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        self.load_data()
+        self.watch_changes()
+
+    def run_task(self, description, func, on_done=None, cancellable=False):
+        """Run func(task) on the worker thread and on_done(result) on the main thread."""
+        task = BackgroundTask(description, func, on_done, cancellable)
+        task.future = self.executor.submit(func, task)
+        self.tasks.append(task)
+        if len(self.tasks) == 1:
+            self.root.after(POLL_INTERVAL, self.poll_tasks)
+        self.update_status()
+        return task
+
+    def poll_tasks(self):
+        """Hand the results of finished tasks to their callbacks."""
+        while self.tasks and self.tasks[0].future.done():
+            task = self.tasks.pop(0)
+            try:
+                result = task.future.result()
+            except Exception as error:
+                messagebox.showerror("Error", f"{task.description} failed: {error}")
+                continue
+            if task.on_done and not task.cancelled.is_set():
+                task.on_done(result)
+            if self.listing:
+                self.show_page(self.page)
+        self.update_status()
+        if self.tasks:
+            self.root.after(POLL_INTERVAL, self.poll_tasks)
+
+    def update_status(self):
+        """Show the running task, its progress and whether it can be cancelled."""
+        if not self.tasks:
+            self.status_var.set("Ready")
+            self.progress_bar['value'] = 0
+            self.cancel_button['state'] = tk.DISABLED
+            return
+        task = self.tasks[0]
+        self.status_var.set(f"{task.description}...")
+        if task.progress:
+            done, total = task.progress
+            self.progress_bar['maximum'] = max(total, 1)
+            self.progress_bar['value'] = done
+        self.cancel_button['state'] = tk.NORMAL if task.cancellable else tk.DISABLED
+
+    def cancel_task(self):
+        """Cancel the running task if it allows it."""
+        if self.tasks and self.tasks[0].cancellable:
+            self.tasks[0].cancelled.set()
+
+    def close(self):
+        """Cancel pending work and close the window."""
+        self.watching.clear()
+        for task in self.tasks:
+            task.cancelled.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
+    def load_data(self):
+        """Load all hotels and customers into the model in the background."""
+        def done(loaded):
+            self.status_var.set("Ready" if loaded else "Loading cancelled")
+
+        self.run_task(
+            "Loading data",
+            lambda task: self.model.load(progress=task.report, cancelled=task.cancelled),
+            done, cancellable=True)
+
+    def watch_changes(self):
+        """Follow the changes other processes make to the data directory."""
+        storage = a.get_storage()
+        if not isinstance(storage, a.FileStorage):
+            return
+        self.watching.set()
+        threading.Thread(target=self.read_changes, args=(storage.directory,), daemon=True).start()
+        self.root.after(CHANGE_POLL_INTERVAL, self.apply_changes)
+
+    def read_changes(self, directory):
+        """Queue the events of a change feed on the directory; runs on its own thread."""
+        try:
+            feed = changefeed.ChangeFeed(directory)
+        except OSError:
+            return
+        try:
+            while self.watching.is_set():
+                events = feed.poll(timeout=1.0)
+                if events:
+                    self.changes.put(events)
+        finally:
+            feed.close()
+
+    def apply_changes(self):
+        """Reload only the hotels and customers named by queued change events."""
+        events = []
+        while True:
+            try:
+                events += self.changes.get_nowait()
+            except queue.Empty:
+                break
+        if events:
+            # Queued behind any running load, so no change is overwritten
+            self.run_task("Applying changes", lambda task: self.model.apply(events))
+        if self.watching.is_set():
+            self.root.after(CHANGE_POLL_INTERVAL, self.apply_changes)
+
+    def require_data(self):
+        """Warn and return False while the model is not loaded yet."""
+        if not self.model.loaded:
+            messagebox.showinfo("Please wait", "The data is still loading.")
+            return False
+        return True
 
     def get_all_hotels(self):
         """Retrieve all hotel names from the system."""
-        return [f[:-6] for f in os.listdir() if f.endswith('.hotel')]
+        return self.model.hotel_names()
 
     def get_all_customers(self):
         """Retrieve all customer names from the system."""
-        return [f[:-9] for f in os.listdir() if f.endswith('.customer')]
+        return self.model.customer_names()
 
     def get_hotels_with_available_rooms(self):
-        """Retrieve hotels that have available rooms."""
-        hotels = []
-        for hotel_name in self.get_all_hotels():
-            hotel = a.load_from_file(a.Hotel, f"{hotel_name}.hotel")
-            if hotel.rooms > 0:
-                hotels.append(hotel_name)
-        return hotels
+        """Retrieve hotels that have available rooms, most free first."""
+        return self.model.hotels_with_available_rooms()
 
     def get_customers_without_reservation(self):
         """Retrieve customers who do not have a reservation."""
-        customers = []
-        for customer_name in self.get_all_customers():
-            reserved = False
-            for hotel_name in self.get_all_hotels():
-                hotel = a.load_from_file(a.Hotel, f"{hotel_name}.hotel")
-                if customer_name in hotel.reservations:
-                    reserved = True
-                    break
-            if not reserved:
-                customers.append(customer_name)
-        return customers
+        return self.model.customers_without_reservation()
 
     def get_hotels_with_reservations(self, customer_name):
         """Retrieve hotels where a specific customer has a reservation."""
-        hotels = []
-        for hotel_name in self.get_all_hotels():
-            hotel = a.load_from_file(a.Hotel, f"{hotel_name}.hotel")
-            if customer_name in hotel.reservations:
-                hotels.append(hotel_name)
-        return hotels
+        return self.model.hotels_with_reservation(customer_name)
 
     def view_hotels(self):
         """Display all hotels."""
-        self.output_text.delete(1.0, tk.END)
-        hotel_files = self.get_all_hotels()
-        if not hotel_files:
-            self.output_text.insert(tk.END, "No hotels available.\n")
+        if not self.require_data():
             return
-        for hotel_name in hotel_files:
-            hotel = a.load_from_file(a.Hotel, f'{hotel_name}.hotel')
-            self.output_text.insert(tk.END, f"Hotel Name: {hotel.name}\n")
-            self.output_text.insert(tk.END, f"Available Rooms: {hotel.rooms}\n")
-            self.output_text.insert(tk.END, "Reservations:\n")
-            for reservation in hotel.reservations:
-                self.output_text.insert(tk.END, f" - {reservation}\n")
-            self.output_text.insert(tk.END, "\n")
+        self.listing = 'hotels'
+        self.show_page(0)
 
     def view_customers(self):
         """Display all customers."""
-        self.output_text.delete(1.0, tk.END)
-        customer_files = self.get_all_customers()
-        if not customer_files:
-            self.output_text.insert(tk.END, "No customers available.\n")
+        if not self.require_data():
+            return
+        self.listing = 'customers'
+        self.show_page(0)
+
+    def show_page(self, page):
+        """Show one page of the hotels or customers matching the search text."""
+        if not self.listing:
             return
-        for customer_name in customer_files:
-            customer = a.load_from_file(a.Customer, f'{customer_name}.customer')
-            self.output_text.insert(tk.END, f"Customer Name: {customer.name}\n")
-        self.output_text.insert(tk.END, "\n")
+        if self.listing == 'hotels':
+            names = model.matching(self.get_all_hotels(), self.search_var.get())
+        else:
+            names = model.matching(self.get_all_customers(), self.search_var.get())
+        rows, self.page, page_count = model.paginate(names, page, PAGE_SIZE)
+        self.tree.delete(*self.tree.get_children())
+        self.page_var.set(f"Page {self.page + 1} of {page_count}")
+        if not rows:
+            self.tree.insert('', tk.END, text=f"No {self.listing} available.")
+            return
+        for name in rows:
+            if self.listing == 'hotels':
+                hotel = self.model.hotel(name)
+                if hotel is None:
+                    continue
+                values = (hotel.rooms, len(hotel.reservations) + len(hotel.stays))
+                has_details = bool(hotel.reservations or hotel.stays)
+            else:
+                customer = self.model.customer(name)
+                if customer is None:
+                    continue
+                values = ('', len(customer.hotels))
+                has_details = bool(customer.hotels)
+            row = self.tree.insert('', tk.END, text=name, values=values, tags=(self.listing,))
+            if has_details:
+                # Placeholder child so the row can be expanded
+                self.tree.insert(row, tk.END, tags=('placeholder',))
+
+    def expand_row(self, event):
+        """Insert the reservations of the expanded hotel or customer."""
+        row = self.tree.focus()
+        children = self.tree.get_children(row)
+        if not children or 'placeholder' not in self.tree.item(children[0], 'tags'):
+            return
+        self.tree.delete(*children)
+        name = self.tree.item(row, 'text')
+        if 'hotels' in self.tree.item(row, 'tags'):
+            hotel = self.model.hotel(name)
+            details = list(hotel.reservations.items()) if hotel else []
+            if hotel:
+                details += [(f"{stay.customer} ({stay.check_in} to {stay.check_out})", count)
+                            for stay, count in hotel.stays.items()]
+        else:
+            customer = self.model.customer(name)
+            details = collections.Counter(customer.hotels if customer else []).items()
+        for detail, count in details:
+            self.tree.insert(row, tk.END, text=detail, values=('', count))
 
     def add_hotel(self):
         """Add a new hotel."""
@@ -105,19 +322,25 @@ class HotelReservationGUI:
         rooms = simpledialog.askinteger("Add Hotel", "Enter number of rooms:")
         if not rooms:
             return
-        a.create_hotel(name, rooms)
-        messagebox.showinfo("Success", f"Hotel '{name}' added with {rooms} rooms!")
+        self.run_task(
+            f"Adding hotel '{name}'",
+            lambda task: self.model.create_hotel(name, rooms),
+            lambda _: messagebox.showinfo("Success", f"Hotel '{name}' added with {rooms} rooms!"))
 
     def add_customer(self):
         """Add a new customer."""
         name = simpledialog.askstring("Add Customer", "Enter customer name:")
         if not name:
             return
-        a.create_customer(name)
-        messagebox.showinfo("Success", f"Customer '{name}' added!")
+        self.run_task(
+            f"Adding customer '{name}'",
+            lambda task: self.model.create_customer(name),
+            lambda _: messagebox.showinfo("Success", f"Customer '{name}' added!"))
 
     def modify_hotel(self):
         """Modify hotel attributes like name or room count."""
+        if not self.require_data():
+            return
         hotels = self.get_all_hotels()
         if not hotels:
             messagebox.showwarning("Error", "No hotels available!")
@@ -151,16 +374,22 @@ class HotelReservationGUI:
                 messagebox.showerror("Error", "Please fill all fields!")
                 return
 
-            a.modify_hotel(selected_hotel, new_rooms)
-            if selected_hotel != new_name:
-                os.rename(f"{selected_hotel}.hotel", f"{new_name}.hotel")
-            messagebox.showinfo("Success", f"Hotel '{selected_hotel}' modified!")
+            def modify(task):
+                self.model.modify_hotel(selected_hotel, new_rooms)
+                if selected_hotel != new_name:
+                    self.model.rename_hotel(selected_hotel, new_name)
+
+            self.run_task(
+                f"Modifying hotel '{selected_hotel}'", modify,
+                lambda _: messagebox.showinfo("Success", f"Hotel '{selected_hotel}' modified!"))
             modify_window.destroy()
 
         tk.Button(modify_window, text="Confirm Modification", command=confirm_modification).pack(pady=20)
 
     def modify_customer(self):
         """Modify customer name."""
+        if not self.require_data():
+            return
         customers = self.get_all_customers()
         if not customers:
             messagebox.showwarning("Error", "No customers available!")
@@ -188,14 +417,18 @@ class HotelReservationGUI:
                 messagebox.showerror("Error", "Please fill all fields!")
                 return
 
-            a.modify_customer(selected_customer, new_name)
-            messagebox.showinfo("Success", f"Customer '{selected_customer}' renamed to '{new_name}'!")
+            self.run_task(
+                f"Renaming customer '{selected_customer}'",
+                lambda task: self.model.modify_customer(selected_customer, new_name),
+                lambda _: messagebox.showinfo("Success", f"Customer '{selected_customer}' renamed to '{new_name}'!"))
             modify_window.destroy()
 
         tk.Button(modify_window, text="Confirm Modification", command=confirm_modification).pack(pady=20)
 
     def delete_hotel(self):
         """Delete a hotel."""
+        if not self.require_data():
+            return
         hotels = self.get_all_hotels()
         if not hotels:
             messagebox.showwarning("Error", "No hotels available!")
@@ -216,14 +449,18 @@ class HotelReservationGUI:
                 messagebox.showerror("Error", "Please select a hotel to delete.")
                 return
 
-            a.delete_hotel(selected_hotel)
-            messagebox.showinfo("Success", f"Hotel '{selected_hotel}' deleted!")
+            self.run_task(
+                f"Deleting hotel '{selected_hotel}'",
+                lambda task: self.model.delete_hotel(selected_hotel),
+                lambda _: messagebox.showinfo("Success", f"Hotel '{selected_hotel}' deleted!"))
             delete_window.destroy()
 
         tk.Button(delete_window, text="Confirm Deletion", command=confirm_deletion).pack(pady=20)
 
     def delete_customer(self):
         """Delete a customer."""
+        if not self.require_data():
+            return
         customers = self.get_all_customers()
         if not customers:
             messagebox.showwarning("Error", "No customers available!")
@@ -244,14 +481,18 @@ class HotelReservationGUI:
                 messagebox.showerror("Error", "Please select a customer to delete.")
                 return
 
-            a.delete_customer(selected_customer)
-            messagebox.showinfo("Success", f"Customer '{selected_customer}' deleted!")
+            self.run_task(
+                f"Deleting customer '{selected_customer}'",
+                lambda task: self.model.delete_customer(selected_customer),
+                lambda _: messagebox.showinfo("Success", f"Customer '{selected_customer}' deleted!"))
             delete_window.destroy()
 
         tk.Button(delete_window, text="Confirm Deletion", command=confirm_deletion).pack(pady=20)
 
     def make_reservation(self):
         """Make a reservation."""
+        if not self.require_data():
+            return
         customer_names = self.get_customers_without_reservation()
         if not customer_names:
             messagebox.showwarning("Error", "All customers already have reservations!")
@@ -284,14 +525,18 @@ class HotelReservationGUI:
                 messagebox.showerror("Error", "Please select both a customer and a hotel.")
                 return
 
-            a.create_reservation(customer_name, hotel_name)
-            messagebox.showinfo("Success", f"Reservation made for '{customer_name}' at '{hotel_name}'!")
+            self.run_task(
+                f"Reserving a room at '{hotel_name}'",
+                lambda task: self.model.create_reservation(customer_name, hotel_name),
+                lambda _: messagebox.showinfo("Success", f"Reservation made for '{customer_name}' at '{hotel_name}'!"))
             reservation_window.destroy()
 
         tk.Button(reservation_window, text="Confirm Reservation", command=confirm_reservation).pack(pady=20)
 
     def cancel_reservation(self):
         """Cancel a reservation."""
+        if not self.require_data():
+            return
         customer_names = self.get_all_customers()
         if not customer_names:
             messagebox.showwarning("Error", "No customers available!")
@@ -326,14 +571,19 @@ class HotelReservationGUI:
                 messagebox.showerror("Error", "Please select both a customer and a hotel.")
                 return
 
-            a.cancel_reservation(customer_name, hotel_name)
-            messagebox.showinfo("Success", f"Reservation for '{customer_name}' at '{hotel_name}' canceled!")
+            self.run_task(
+                f"Cancelling the reservation at '{hotel_name}'",
+                lambda task: self.model.cancel_reservation(customer_name, hotel_name),
+                lambda _: messagebox.showinfo("Success", f"Reservation for '{customer_name}' at '{hotel_name}' canceled!"))
             cancel_window.destroy()
 
         tk.Button(cancel_window, text="Confirm Cancellation", command=confirm_cancellation).pack(pady=20)
 
 
 if __name__ == "__main__":
+    # The snapshot lets later starts skip opening every file of the dataset
+    a.use_storage(a.FileStorage(snapshot=True))
     root = tk.Tk()
     app = HotelReservationGUI(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    a.get_storage().close()
\ No newline at end of file
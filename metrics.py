@@ -0,0 +1,180 @@
+"""
+This metrics module provides opt-in instrumentation for the hotel
+reservation system.
+
+Once enabled, it records call counts and latency histograms of the
+instrumented operations, bytes read and written, files opened and JSON parse
+time. The data can be read in process with snapshot() or dumped as JSON or in
+the Prometheus text exposition format.
+
+Instrumentation is disabled by default. While disabled, an instrumented
+function costs one extra call and a flag check, so it can stay in place on
+hot paths.
+"""
+import bisect
+import functools
+import json
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+           0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+           5.0, 10.0)
+
+# Prefix of every exported metric name
+PREFIX = 'hotel_'
+
+enabled = False
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+class Histogram:
+    """Latency histogram with fixed bucket bounds."""
+
+    def __init__(self, buckets=BUCKETS):
+        """Initializes an empty Histogram."""
+        self.buckets = buckets
+        # One count per bucket plus one for values above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Adds a value to the histogram."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Returns (upper bound, cumulative count) pairs, ending with
+        +Inf."""
+        pairs = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+def enable():
+    """Starts recording metrics."""
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Stops recording metrics; recorded values are kept."""
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Forgets every recorded value."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def increment(name, amount=1, operation=None):
+    """Adds an amount to a counter if metrics are enabled."""
+    if not enabled:
+        return
+    key = (name, operation)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, seconds, operation=None):
+    """Adds a duration to a histogram if metrics are enabled."""
+    if not enabled:
+        return
+    key = (name, operation)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def instrument(func):
+    """Decorates a function to record its calls and latency under its name
+    in the operation_seconds histogram."""
+    operation = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe('operation_seconds', time.perf_counter() - start,
+                    operation)
+
+    return wrapper
+
+
+def snapshot():
+    """Returns the recorded counters and histograms as plain data."""
+    with _lock:
+        counters = {}
+        for (name, operation), value in _counters.items():
+            counters.setdefault(name, {})[operation or ''] = value
+        histograms = {}
+        for (name, operation), histogram in _histograms.items():
+            histograms.setdefault(name, {})[operation or ''] = {
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'buckets': {
+                    ('+Inf' if bound == float('inf') else repr(bound)): count
+                    for bound, count in histogram.cumulative()
+                },
+            }
+    return {'counters': counters, 'histograms': histograms}
+
+
+def to_json():
+    """Returns the recorded metrics as a JSON string."""
+    return json.dumps(snapshot())
+
+
+def _labels(operation, **extra):
+    """Returns the Prometheus label set of a sample."""
+    labels = {'operation': operation} if operation else {}
+    labels.update(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value):
+    """Escapes a Prometheus label value."""
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def to_prometheus():
+    """Returns the recorded metrics in the Prometheus text format."""
+    data = snapshot()
+    lines = []
+    for name, values in sorted(data['counters'].items()):
+        lines.append(f'# TYPE {PREFIX}{name} counter')
+        for operation, value in sorted(values.items()):
+            lines.append(f'{PREFIX}{name}{_labels(operation)} {value}')
+    for name, values in sorted(data['histograms'].items()):
+        lines.append(f'# TYPE {PREFIX}{name} histogram')
+        for operation, histogram in sorted(values.items()):
+            for bound, count in histogram['buckets'].items():
+                labels = _labels(operation, le=bound)
+                lines.append(f'{PREFIX}{name}_bucket{labels} {count}')
+            lines.append(f'{PREFIX}{name}_sum{_labels(operation)} '
+                         f'{histogram["sum"]}')
+            lines.append(f'{PREFIX}{name}_count{_labels(operation)} '
+                         f'{histogram["count"]}')
+    return '\n'.join(lines) + '\n'
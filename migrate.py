@@ -0,0 +1,67 @@
+"""
+This migrate module converts the hotel and customer files of a data
+directory to another serialization codec, or to customer ids.
+
+Files already in the target format are left alone, so the command can be
+run again after an interruption. Hotel journals are folded into the
+rewritten snapshots. To keep new files in the target format as well, open
+the directory with FileStorage(directory, codec=...).
+
+Directories written before customers had ids refer to customers by name in
+every hotel file. With --customer-ids, every customer gets an id and the
+hotel files are rewritten to refer to the ids, after which renaming a
+customer no longer rewrites hotel files. Other processes should not write
+to the directory while it is migrated.
+
+Example:
+
+    python migrate.py --codec binary data/
+    python migrate.py --customer-ids data/
+
+The migration can be run by executing this module.
+"""
+import argparse
+import os
+
+import abstractions as a
+import serialization
+
+
+def migrate(directory, codec=None, customer_ids=False):
+    """Rewrites the files of a data directory with a codec and, if
+    customer_ids is true, to customer ids; returns the number of files
+    rewritten."""
+    storage = a.FileStorage(directory)
+    count = 0
+    if customer_ids:
+        count += storage.migrate_customer_ids()
+    if codec is not None:
+        count += storage.convert(codec)
+    return count
+
+
+def main():
+    """Run the migration from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('directory', nargs='?', default=os.curdir)
+    parser.add_argument('--codec', choices=sorted(serialization.CODECS),
+                        help='the codec to convert to; binary unless only '
+                             '--customer-ids is given')
+    parser.add_argument('--customer-ids', action='store_true',
+                        help='give every customer an id and refer to it '
+                             'from the hotel files')
+    args = parser.parse_args()
+
+    if args.codec is None and not args.customer_ids:
+        args.codec = serialization.BINARY.name
+    codec = serialization.get_codec(args.codec) if args.codec else None
+    count = migrate(args.directory, codec, args.customer_ids)
+    target = ' and '.join(
+        name for name, given in ((args.codec, args.codec),
+                                 ('customer ids', args.customer_ids))
+        if given)
+    print(f'Converted {count} files to {target}')
+
+
+if __name__ == "__main__":
+    main()
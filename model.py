@@ -0,0 +1,226 @@
+"""
+This model module keeps an in-memory copy of all hotels and customers for
+interactive front ends such as the GUI.
+
+The model is loaded once from the storage backend and then kept up to date
+incrementally: every mutation goes through the abstractions module and
+afterwards reloads only the hotels and customers it touched. Queries such as
+"customers without a reservation" are answered from memory without any
+file access.
+
+Changes made by other processes reach the model through apply(), which
+reloads only the entities named by the events of a change feed.
+
+All methods may be called from worker threads; the model guards its data
+with a lock and hands out lists rather than live views.
+"""
+import threading
+
+import abstractions as a
+
+
+def matching(names, text):
+    """Returns the names containing text, ignoring case, in sorted order."""
+    text = text.casefold()
+    return sorted(name for name in names if text in name.casefold())
+
+
+def paginate(items, page, page_size):
+    """Returns the items of a page, the clamped page number and the page
+    count."""
+    page_count = max(1, -(-len(items) // page_size))
+    page = min(max(page, 0), page_count - 1)
+    start = page * page_size
+    return items[start:start + page_size], page, page_count
+
+
+class DatasetModel:
+    """In-memory copy of every hotel and customer of the storage backend."""
+
+    # Customers are loaded in chunks so progress can be reported
+    CHUNK_SIZE = 500
+
+    def __init__(self):
+        """Initializes an empty DatasetModel."""
+        self._lock = threading.RLock()
+        self.hotels = {}
+        self.customers = {}
+        self.availability = a.AvailabilityIndex()
+        self.loaded = False
+
+    def load(self, progress=None, cancelled=None):
+        """Loads every hotel and customer, calling progress(done, total)
+        along the way; returns False if cancelled.is_set() stopped it."""
+        storage = a.get_storage()
+        hotel_names = storage.hotel_names()
+        customer_names = storage.customer_names()
+        total = len(hotel_names) + len(customer_names)
+        hotels = {}
+        customers = {}
+        availability = a.AvailabilityIndex()
+        done = 0
+        for name in hotel_names:
+            if cancelled is not None and cancelled.is_set():
+                return False
+            hotel = storage.load_hotel(name)
+            if hotel:
+                hotels[name] = hotel
+                availability.update(name, hotel.free_rooms())
+            done += 1
+            if progress:
+                progress(done, total)
+        for start in range(0, len(customer_names), self.CHUNK_SIZE):
+            if cancelled is not None and cancelled.is_set():
+                return False
+            chunk = customer_names[start:start + self.CHUNK_SIZE]
+            customers.update(storage.load_customers(chunk))
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+        with self._lock:
+            self.hotels = hotels
+            self.customers = customers
+            self.availability = availability
+            self.loaded = True
+        return True
+
+    def refresh_hotel(self, name):
+        """Reloads one hotel from storage."""
+        hotel = a.get_storage().load_hotel(name)
+        with self._lock:
+            if hotel:
+                self.hotels[name] = hotel
+                self.availability.update(name, hotel.free_rooms())
+            else:
+                self.hotels.pop(name, None)
+                self.availability.discard(name)
+
+    def refresh_customer(self, name):
+        """Reloads one customer from storage."""
+        customer = a.get_storage().load_customer(name)
+        with self._lock:
+            if customer:
+                self.customers[name] = customer
+            else:
+                self.customers.pop(name, None)
+
+    def apply(self, events):
+        """Reloads the hotels and customers named by change feed events and
+        returns their names."""
+        hotels = {event.hotel for event in events if event.hotel}
+        customers = {event.customer for event in events if event.customer}
+        for name in hotels:
+            self.refresh_hotel(name)
+        for name in customers:
+            self.refresh_customer(name)
+        return hotels, customers
+
+    def hotel_names(self):
+        """Returns the names of all hotels."""
+        with self._lock:
+            return list(self.hotels)
+
+    def customer_names(self):
+        """Returns the names of all customers."""
+        with self._lock:
+            return list(self.customers)
+
+    def hotel(self, name):
+        """Returns a hotel, or None; callers must not modify it."""
+        with self._lock:
+            return self.hotels.get(name)
+
+    def customer(self, name):
+        """Returns a customer, or None; callers must not modify it."""
+        with self._lock:
+            return self.customers.get(name)
+
+    def hotels_with_available_rooms(self, minimum=1, limit=None):
+        """Returns the names of the hotels with at least minimum free rooms,
+        most free first, and at most limit of them."""
+        with self._lock:
+            return self.availability.at_least(minimum, limit)
+
+    def customers_without_reservation(self):
+        """Returns the names of customers without any reservation."""
+        with self._lock:
+            return [name for name, customer in self.customers.items()
+                    if not customer.hotels]
+
+    def hotels_with_reservation(self, customer_name):
+        """Returns the hotels a customer has reservations in."""
+        with self._lock:
+            customer = self.customers.get(customer_name)
+            return list(dict.fromkeys(customer.hotels)) if customer else []
+
+    def _customers_of(self, hotel_name):
+        """Returns the names of the customers holding rooms in a hotel."""
+        with self._lock:
+            hotel = self.hotels.get(hotel_name)
+            if hotel is None:
+                return []
+            return [name for name, _ in hotel.customer_counts()]
+
+    def create_hotel(self, name, rooms):
+        """Creates a hotel."""
+        a.create_hotel(name, rooms)
+        self.refresh_hotel(name)
+
+    def modify_hotel(self, name, new_rooms):
+        """Changes the number of rooms of a hotel and updates the waiting
+        customers given the added rooms."""
+        served = a.modify_hotel(name, new_rooms)
+        self.refresh_hotel(name)
+        for entry in served:
+            self.refresh_customer(entry.customer)
+
+    def rename_hotel(self, old_name, new_name):
+        """Renames a hotel and updates the customers holding rooms in it."""
+        customers = self._customers_of(old_name)
+        a.rename_hotel(old_name, new_name)
+        self.refresh_hotel(old_name)
+        self.refresh_hotel(new_name)
+        for name in customers:
+            self.refresh_customer(name)
+
+    def delete_hotel(self, name):
+        """Deletes a hotel and updates the customers holding rooms in it."""
+        customers = self._customers_of(name)
+        a.delete_hotel(name)
+        self.refresh_hotel(name)
+        for customer_name in customers:
+            self.refresh_customer(customer_name)
+
+    def create_customer(self, name):
+        """Creates a customer."""
+        a.create_customer(name)
+        self.refresh_customer(name)
+
+    def modify_customer(self, old_name, new_name):
+        """Renames a customer and updates the hotels it holds rooms in."""
+        hotels = self.hotels_with_reservation(old_name)
+        a.modify_customer(old_name, new_name)
+        self.refresh_customer(old_name)
+        self.refresh_customer(new_name)
+        for name in hotels:
+            self.refresh_hotel(name)
+
+    def delete_customer(self, name):
+        """Deletes a customer."""
+        a.delete_customer(name)
+        self.refresh_customer(name)
+
+    def create_reservation(self, customer_name, hotel_name):
+        """Reserves a room for a customer in a hotel."""
+        a.create_reservation(customer_name, hotel_name)
+        self.refresh_hotel(hotel_name)
+        self.refresh_customer(customer_name)
+
+    def cancel_reservation(self, customer_name, hotel_name):
+        """Cancels a reservation of a customer in a hotel and updates the
+        waiting customer given the freed room."""
+        served = a.cancel_reservation(customer_name, hotel_name)
+        self.refresh_hotel(hotel_name)
+        self.refresh_customer(customer_name)
+        for entry in served:
+            self.refresh_customer(entry.customer)
@@ -0,0 +1,670 @@
+"""
+This serialization module provides the codecs hotel and customer files are
+written with.
+
+A codec turns the plain data of an object, the dict returned by its to_data
+method, into bytes and back. JSON is the original, human readable format.
+The binary codec is a compact length-prefixed layout: every string list is
+stored as one block of NUL-separated UTF-8 text plus an array of repeat
+counts, so a hotel with many reservations is decoded by a few C-level splits
+instead of a JSON parse and a loop over every name.
+
+Binary files start with magic bytes that no JSON document can start with,
+so detect() picks the codec of existing data. Both codecs are deterministic:
+the same data always encodes to the same bytes, in UTF-8 whatever the
+locale.
+
+Data can also be read in parts. decode_header() returns the integer and
+string fields, which the binary codec finds by skipping over the lists
+without decoding them and the JSON codec by parsing up to the first list,
+and iter_runs() streams one list from a file a chunk
+at a time, so a very large list is never held in memory as a whole.
+"""
+import array
+import codecs
+import collections
+import io
+import itertools
+import json
+import re
+import struct
+import sys
+
+# First bytes of a binary file; 0x89 cannot start a JSON document
+MAGIC = b'\x89HRB'
+FORMAT_VERSION = 1
+
+# Separator of the strings of a block; it may not occur inside them
+SEPARATOR = '\0'
+
+# Bytes read at a time when a list is streamed from a file
+CHUNK_SIZE = 1 << 16
+
+# The integer and string fields of some data and the names of its list
+# fields; data holds all of it when the codec had to decode the lists anyway
+Header = collections.namedtuple('Header', ['fields', 'lists', 'data'])
+
+
+class MissingFieldError(ValueError):
+    """Raised when a list is streamed from data that has no such field."""
+
+
+class Runs:
+    """A list of strings, or of integers, stored as runs: each value with a
+    repeat count.
+
+    Objects hand their multisets to the codecs in this form, and the binary
+    codec decodes string lists to it, so neither side has to expand every
+    repetition. Iterating yields the expanded list.
+    """
+
+    def __init__(self, values=(), counts=()):
+        """Initializes Runs from the run strings and their counts."""
+        self.values = list(values)
+        self.counts = counts if isinstance(counts, array.array) else (
+            array.array('I', counts))
+
+    @classmethod
+    def of(cls, values):
+        """Returns the runs of equal consecutive strings of a list."""
+        runs = [(value, sum(1 for _ in group))
+                for value, group in itertools.groupby(values)]
+        return cls([value for value, _ in runs], [count for _, count in runs])
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Returns Runs from (string, count) pairs."""
+        pairs = list(pairs)
+        return cls([value for value, _ in pairs],
+                   [count for _, count in pairs])
+
+    def pairs(self):
+        """Returns an iterator of (string, count) pairs."""
+        return zip(self.values, self.counts)
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(
+            itertools.repeat(value, count) for value, count in self.pairs())
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def __eq__(self, other):
+        if isinstance(other, (Runs, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f'Runs({list(self.pairs())!r})'
+
+
+class JSONCodec:
+    """Encodes data as JSON text in UTF-8."""
+
+    name = 'json'
+
+    def encode(self, data):
+        """Returns the bytes of some data."""
+        return json.dumps(data, default=list).encode('utf-8')
+
+    def decode(self, raw):
+        """Returns the data encoded in some bytes."""
+        return json.loads(raw)
+
+    def decode_header(self, raw):
+        """Returns the Header of the data encoded in some bytes.
+
+        Data written with its integer and string fields first is parsed up
+        to its first list, and the names of the other lists are found by a
+        search for the keys that follow a list, without parsing the items.
+        Older data with fields after its lists is parsed whole and returned
+        as the data of the header.
+        """
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        reader = _JSONReader(io.BytesIO(raw), CHUNK_SIZE)
+        fields, first = reader.fields()
+        if not raw.rstrip().endswith(b'}'):
+            raise ValueError('Truncated JSON data')
+        if first is None:
+            return Header(fields, (), None)
+        lists = [first]
+        for match in _JSON_KEY_AFTER_LIST.finditer(raw):
+            if not match.group(2):
+                # A field after a list is only known by parsing the lists
+                data = self.decode(raw)
+                if not isinstance(data, dict):
+                    raise ValueError('Not a JSON object')
+                return _header(data)
+            lists.append(json.loads(match.group(1)))
+        return Header(fields, tuple(dict.fromkeys(lists)), None)
+
+    def iter_runs(self, file, key, chunk_size=CHUNK_SIZE):
+        """Yields (value, count) runs of equal consecutive items of the list
+        field key in a binary file, parsing one item at a time."""
+        reader = _JSONReader(file, chunk_size)
+        reader.find(key)
+        yield from _runs(reader.items())
+
+
+class BinaryCodec:
+    """Encodes data in a compact length-prefixed binary layout.
+
+    After the magic bytes and a format version come the fields of the data
+    dict, each a length-prefixed UTF-8 name, a one-letter type and its value:
+
+        i   a signed 64-bit integer
+        s   a length-prefixed string
+        r   a string list: the number of runs, a length-prefixed block of
+            the run strings and one unsigned 32-bit repeat count per run
+        n   an integer list: the number of runs, one signed 64-bit integer
+            and then one unsigned 32-bit repeat count per run
+        t   a table of equally long string lists: the number of rows, the
+            row length and a length-prefixed block of all strings, one
+            column after the other
+        c   a table of equally long lists with integer columns: the number
+            of rows, the row length, an 's' or 'i' per column, then the
+            length-prefixed block of the strings of the 's' columns and one
+            signed 64-bit integer per row and 'i' column
+
+    Integers are little-endian.
+    """
+
+    name = 'binary'
+
+    def encode(self, data):
+        """Returns the bytes of some data."""
+        parts = [MAGIC, struct.pack('<BH', FORMAT_VERSION, len(data))]
+        for key, value in data.items():
+            key = key.encode('utf-8')
+            parts.append(struct.pack('<B', len(key)))
+            parts.append(key)
+            if isinstance(value, bool) or value is None:
+                raise TypeError(f'Cannot encode {key!r}: {value!r}')
+            if isinstance(value, int):
+                parts.append(b'i' + struct.pack('<q', value))
+            elif isinstance(value, str):
+                text = value.encode('utf-8')
+                parts.append(b's' + struct.pack('<I', len(text)) + text)
+            elif _values(value) and all(_is_integer(item)
+                                        for item in _values(value)):
+                if not isinstance(value, Runs):
+                    value = Runs.of(value)
+                parts.append(b'n' + struct.pack('<I', len(value.values)))
+                parts.append(_integers(value.values))
+                parts.append(_integers(value.counts, 'I'))
+            elif isinstance(value, Runs) or all(
+                    isinstance(item, str) for item in value):
+                if not isinstance(value, Runs):
+                    value = Runs.of(value)
+                counts = value.counts
+                if sys.byteorder == 'big':
+                    counts = array.array('I', counts)
+                    counts.byteswap()
+                parts.append(b'r' + struct.pack('<I', len(value.values)))
+                parts.append(_block(value.values))
+                parts.append(counts.tobytes())
+            elif value and all(isinstance(row, list)
+                               and len(row) == len(value[0])
+                               for row in value):
+                types = ''.join(
+                    'i' if all(_is_integer(row[column]) for row in value)
+                    else 's' for column in range(len(value[0])))
+                columns = [[row[column] for row in value]
+                           for column in range(len(types))]
+                strings = list(itertools.chain.from_iterable(
+                    column for column, kind in zip(columns, types)
+                    if kind == 's'))
+                if 'i' not in types:
+                    parts.append(b't' + struct.pack('<IB', len(value),
+                                                    len(types)))
+                    parts.append(_block(strings))
+                    continue
+                parts.append(b'c' + struct.pack('<IB', len(value),
+                                                len(types)))
+                parts.append(types.encode('ascii'))
+                parts.append(_block(strings))
+                parts.extend(_integers(column) for column, kind
+                             in zip(columns, types) if kind == 'i')
+            else:
+                raise TypeError(f'Cannot encode {key!r}: {value!r}')
+        return b''.join(parts)
+
+    def decode(self, raw):
+        """Returns the data encoded in some bytes."""
+        try:
+            return self._decode(raw)
+        except (struct.error, IndexError) as e:
+            raise ValueError(f'Truncated binary data: {e}') from None
+
+    def _decode(self, raw):
+        """Decodes some bytes, letting truncation errors through."""
+        if not raw.startswith(MAGIC):
+            raise ValueError('Not a binary hotel file')
+        view = memoryview(raw)
+        version, count = struct.unpack_from('<BH', view, len(MAGIC))
+        if version != FORMAT_VERSION:
+            raise ValueError(f'Unsupported binary format version {version}')
+        offset = len(MAGIC) + 3
+        data = {}
+        for _ in range(count):
+            length = view[offset]
+            key = bytes(view[offset + 1:offset + 1 + length]).decode('utf-8')
+            offset += 1 + length
+            tag = view[offset:offset + 1].tobytes()
+            offset += 1
+            if tag == b'i':
+                (data[key],) = struct.unpack_from('<q', view, offset)
+                offset += 8
+            elif tag == b's':
+                (length,) = struct.unpack_from('<I', view, offset)
+                offset += 4
+                data[key] = bytes(view[offset:offset + length]).decode(
+                    'utf-8')
+                offset += length
+            elif tag == b'r':
+                (runs,) = struct.unpack_from('<I', view, offset)
+                strings, offset = _unblock(view, offset + 4, runs)
+                counts = array.array('I')
+                counts.frombytes(view[offset:offset + 4 * runs])
+                if sys.byteorder == 'big':
+                    counts.byteswap()
+                offset += 4 * runs
+                data[key] = Runs(strings, counts)
+            elif tag == b'n':
+                (runs,) = struct.unpack_from('<I', view, offset)
+                values, offset = _unintegers(view, offset + 4, runs)
+                counts, offset = _unintegers(view, offset, runs, 'I')
+                data[key] = Runs(values.tolist(), counts)
+            elif tag == b'c':
+                rows, width = struct.unpack_from('<IB', view, offset)
+                offset += 5
+                types = bytes(view[offset:offset + width]).decode('ascii')
+                offset += width
+                strings, offset = _unblock(view, offset,
+                                           rows * types.count('s'))
+                columns = []
+                for kind in types:
+                    if kind == 's':
+                        columns.append(strings[:rows])
+                        strings = strings[rows:]
+                    else:
+                        column, offset = _unintegers(view, offset, rows)
+                        columns.append(column.tolist())
+                data[key] = [list(row) for row in zip(*columns)]
+            elif tag == b't':
+                rows, width = struct.unpack_from('<IB', view, offset)
+                strings, offset = _unblock(view, offset + 5, rows * width)
+                # The strings are stored column after column, as in 'c'
+                data[key] = [list(row) for row in zip(
+                    *[strings[i:i + rows]
+                      for i in range(0, len(strings), rows)])]
+            else:
+                raise ValueError(f'Unknown field type {tag!r}')
+        if offset != len(raw):
+            raise ValueError('Trailing bytes after the last field')
+        return data
+
+    def decode_header(self, raw):
+        """Returns the Header of the data encoded in some bytes, skipping
+        the lists by their lengths without decoding them."""
+        view = memoryview(raw)
+        fields = {}
+        lists = []
+        try:
+            if not raw.startswith(MAGIC):
+                raise ValueError('Not a binary hotel file')
+            version, count = struct.unpack_from('<BH', view, len(MAGIC))
+            if version != FORMAT_VERSION:
+                raise ValueError(
+                    f'Unsupported binary format version {version}')
+            offset = len(MAGIC) + 3
+            for _ in range(count):
+                length = view[offset]
+                key = bytes(view[offset + 1:offset + 1 + length]).decode(
+                    'utf-8')
+                offset += 1 + length
+                tag = view[offset:offset + 1].tobytes()
+                offset += 1
+                if tag == b'i':
+                    (fields[key],) = struct.unpack_from('<q', view, offset)
+                elif tag == b's':
+                    (length,) = struct.unpack_from('<I', view, offset)
+                    fields[key] = bytes(
+                        view[offset + 4:offset + 4 + length]).decode('utf-8')
+                else:
+                    lists.append(key)
+                offset += _size(lambda start, size: view[start:start + size],
+                                tag, offset)
+        except (struct.error, IndexError) as e:
+            raise ValueError(f'Truncated binary data: {e}') from None
+        if offset != len(raw):
+            raise ValueError('Trailing bytes after the last field')
+        return Header(fields, tuple(lists), None)
+
+    def iter_runs(self, file, key, chunk_size=CHUNK_SIZE):
+        """Yields the (value, count) runs of the list field key in a binary
+        file, reading its values and counts a chunk at a time; the rows of
+        tables are tuples."""
+
+        def read(start, size):
+            file.seek(start)
+            data = file.read(size)
+            if len(data) != size:
+                raise ValueError('Truncated binary data')
+            return data
+
+        if read(0, len(MAGIC)) != MAGIC:
+            raise ValueError('Not a binary hotel file')
+        version, count = struct.unpack('<BH', read(len(MAGIC), 3))
+        if version != FORMAT_VERSION:
+            raise ValueError(f'Unsupported binary format version {version}')
+        offset = len(MAGIC) + 3
+        for _ in range(count):
+            length = read(offset, 1)[0]
+            name = read(offset + 1, length).decode('utf-8')
+            tag = read(offset + 1 + length, 1)
+            offset += 2 + length
+            if name == key:
+                break
+            offset += _size(read, tag, offset)
+        else:
+            raise MissingFieldError(f'No list field {key!r}')
+        (runs,) = struct.unpack('<I', read(offset, 4))
+        if tag == b'r':
+            (length,) = struct.unpack('<I', read(offset + 4, 4))
+            counts_offset = offset + 8 + length
+            values = _iter_block(read, offset + 8, length, runs,
+                                 chunk_size)
+        elif tag == b'n':
+            counts_offset = offset + 4 + 8 * runs
+            values = _iter_integers(read, offset + 4, runs, 'q', chunk_size)
+        elif tag in (b't', b'c'):
+            yield from _runs(_iter_rows(read, tag, offset, chunk_size))
+            return
+        else:
+            raise ValueError(f'{key!r} is not a list')
+        counts = _iter_integers(read, counts_offset, runs, 'I', chunk_size)
+        yield from zip(values, counts)
+
+
+def _is_integer(value):
+    """Returns whether a value is an integer and not a bool."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _values(value):
+    """Returns the distinct values of a list or Runs."""
+    return value.values if isinstance(value, Runs) else value
+
+
+def _integers(values, typecode='q'):
+    """Returns the little-endian bytes of an array of integers."""
+    values = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unintegers(view, offset, count, typecode='q'):
+    """Returns an array of count little-endian integers and the offset after
+    them."""
+    values = array.array(typecode)
+    end = offset + values.itemsize * count
+    values.frombytes(view[offset:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end
+
+
+def _size(read, tag, offset):
+    """Returns the size of the field value of a tag at an offset, reading
+    only its length prefixes with read(offset, size)."""
+    if tag == b'i':
+        return 8
+    if tag == b's':
+        return 4 + struct.unpack('<I', read(offset, 4))[0]
+    if tag == b'r':
+        runs, length = struct.unpack('<II', read(offset, 8))
+        return 8 + length + 4 * runs
+    if tag == b'n':
+        return 4 + 12 * struct.unpack('<I', read(offset, 4))[0]
+    if tag == b't':
+        return 9 + struct.unpack('<I', read(offset + 5, 4))[0]
+    if tag == b'c':
+        rows, width = struct.unpack('<IB', read(offset, 5))
+        types = bytes(read(offset + 5, width)).decode('ascii')
+        (length,) = struct.unpack('<I', read(offset + 5 + width, 4))
+        return 9 + width + length + 8 * rows * types.count('i')
+    raise ValueError(f'Unknown field type {tag!r}')
+
+
+def _iter_block(read, offset, length, count, chunk_size):
+    """Yields the count strings of a block of a given length at an offset,
+    read a chunk at a time."""
+    if count and not length:
+        yield ''
+    partial = b''
+    end = offset + length
+    while offset < end:
+        size = min(chunk_size, end - offset)
+        pieces = (partial + read(offset, size)).split(b'\0')
+        offset += size
+        # The last piece goes on in the next chunk, if any
+        partial = pieces.pop() if offset < end else b''
+        for piece in pieces:
+            yield piece.decode('utf-8')
+
+
+def _iter_rows(read, tag, offset, chunk_size):
+    """Yields the rows of a 't' or 'c' table at an offset as tuples, reading
+    every column a chunk at a time."""
+    rows, width = struct.unpack('<IB', read(offset, 5))
+    offset += 5
+    if tag == b't':
+        types = 's' * width
+    else:
+        types = read(offset, width).decode('ascii')
+        offset += width
+    (length,) = struct.unpack('<I', read(offset, 4))
+    strings = rows * types.count('s')
+    integers = offset + 4 + length
+    # Columns are stored one after the other, so each is read on its own
+    columns = []
+    column = 0
+    for kind in types:
+        if kind == 's':
+            columns.append(itertools.islice(
+                _iter_block(read, offset + 4, length, strings, chunk_size),
+                column * rows, (column + 1) * rows))
+            column += 1
+        else:
+            columns.append(_iter_integers(read, integers, rows, 'q',
+                                          chunk_size))
+            integers += 8 * rows
+    return zip(*columns)
+
+
+def _iter_integers(read, offset, count, typecode, chunk_size):
+    """Yields count little-endian integers of a type at an offset, read a
+    chunk at a time."""
+    itemsize = array.array(typecode).itemsize
+    step = max(1, chunk_size // itemsize)
+    for start in range(0, count, step):
+        values = array.array(typecode)
+        values.frombytes(read(offset + start * itemsize,
+                              min(step, count - start) * itemsize))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        yield from values
+
+
+def _header(data):
+    """Returns the Header of some decoded data."""
+    return Header({key: value for key, value in data.items()
+                   if not isinstance(value, (list, Runs))},
+                  tuple(key for key, value in data.items()
+                        if isinstance(value, (list, Runs))),
+                  data)
+
+
+def _runs(values):
+    """Yields (value, count) runs of the equal consecutive values of an
+    iterable."""
+    for value, group in itertools.groupby(values):
+        yield value, sum(1 for _ in group)
+
+
+# A key of a JSON object, and the separators around the items of a list
+_JSON_KEY = re.compile(r'\s*("(?:[^"\\]|\\.)*")\s*:\s*', re.S)
+_JSON_SPACE = re.compile(r'\s*')
+# A key right after a list, and its opening bracket if its value is a list
+_JSON_KEY_AFTER_LIST = re.compile(
+    rb'\]\s*,\s*("(?:[^"\\]|\\.)*")\s*:\s*(\[?)', re.S)
+_JSON_DECODER = json.JSONDecoder()
+
+
+class _JSONReader:
+    """Parses a JSON object from a binary file one value at a time."""
+
+    def __init__(self, file, chunk_size):
+        """Initializes _JSONReader at the start of a file."""
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.position = 0
+        self.end = False
+
+    def _read(self):
+        """Appends the next chunk to the text, dropping what was parsed, or
+        raises ValueError at the end of the file."""
+        if self.end:
+            raise ValueError('Truncated JSON data')
+        chunk = self.file.read(self.chunk_size)
+        self.end = not chunk
+        self.text = self.text[self.position:] + self.decoder.decode(
+            chunk, final=self.end)
+        self.position = 0
+
+    def _next(self):
+        """Skips whitespace and returns the next character, reading on as
+        needed."""
+        while True:
+            self.position = _JSON_SPACE.match(self.text,
+                                              self.position).end()
+            if self.position < len(self.text):
+                return self.text[self.position]
+            self._read()
+
+    def _value(self):
+        """Returns the next value, reading on until it is complete."""
+        self._next()
+        while True:
+            try:
+                value, end = _JSON_DECODER.raw_decode(self.text,
+                                                      self.position)
+            except ValueError:
+                end = None
+            # A number at the end of the text may go on in the next chunk
+            if end is not None and (end < len(self.text) or self.end):
+                self.position = end
+                return value
+            self._read()
+
+    def _keys(self):
+        """Yields the keys of the object, leaving the position at the value
+        of each until the next key is asked for."""
+        if self._next() != '{':
+            raise ValueError('Not a JSON object')
+        self.position += 1
+        while self._next() != '}':
+            match = _JSON_KEY.match(self.text, self.position)
+            while match is None or match.end() == len(self.text):
+                self._read()
+                match = _JSON_KEY.match(self.text, self.position)
+            self.position = match.end()
+            yield json.loads(match.group(1))
+            if self._next() == ',':
+                self.position += 1
+
+    def find(self, key):
+        """Moves to the value of a key of the object."""
+        for name in self._keys():
+            if name == key:
+                return
+            # Values of other keys are parsed and dropped
+            self._value()
+        raise MissingFieldError(f'No field {key!r}')
+
+    def fields(self):
+        """Returns the fields of the object before its first list field, and
+        the name of that list or None if it has none."""
+        fields = {}
+        for name in self._keys():
+            if self._next() == '[':
+                return fields, name
+            fields[name] = self._value()
+        return fields, None
+
+    def items(self):
+        """Yields the items of the list at the current position."""
+        if self._next() != '[':
+            raise ValueError('Not a JSON list')
+        self.position += 1
+        while self._next() != ']':
+            value = self._value()
+            yield tuple(value) if isinstance(value, list) else value
+            if self._next() == ',':
+                self.position += 1
+
+
+def _block(strings):
+    """Returns a length-prefixed block of NUL-separated strings."""
+    text = SEPARATOR.join(strings)
+    if strings and text.count(SEPARATOR) != len(strings) - 1:
+        raise ValueError('Strings cannot contain NUL characters')
+    text = text.encode('utf-8')
+    return struct.pack('<I', len(text)) + text
+
+
+def _unblock(view, offset, count):
+    """Returns the strings of a block and the offset after it."""
+    (length,) = struct.unpack_from('<I', view, offset)
+    offset += 4
+    if count == 0:
+        return [], offset + length
+    strings = bytes(view[offset:offset + length]).decode('utf-8').split(
+        SEPARATOR)
+    if len(strings) != count:
+        raise ValueError('Corrupt string block')
+    return strings, offset + length
+
+
+JSON = JSONCodec()
+BINARY = BinaryCodec()
+
+CODECS = {codec.name: codec for codec in (JSON, BINARY)}
+
+
+def get_codec(name):
+    """Returns the codec with a name."""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f'Unknown codec {name!r}') from None
+
+
+def iter_runs(file, key, chunk_size=CHUNK_SIZE):
+    """Yields the (value, count) runs of the list field key in a binary
+    file written by any codec, or raises MissingFieldError before the first
+    run if there is no such field."""
+    file.seek(0)
+    codec = detect(file.read(len(MAGIC)))
+    file.seek(0)
+    yield from codec.iter_runs(file, key, chunk_size)
+
+
+def detect(raw):
+    """Returns the codec some encoded bytes were written with."""
+    return BINARY if raw[:len(MAGIC)] == MAGIC else JSON
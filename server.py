@@ -0,0 +1,458 @@
+"""
+This server module exposes the hotel reservation system as a local HTTP/JSON
+service built on asyncio.
+
+Hotels that were recently read or written are kept in memory. Reservations
+and cancellations for the same hotel that arrive while an earlier write is
+still being persisted are queued and persisted together with a single save.
+All blocking storage calls run in worker threads, so the event loop keeps
+serving other clients.
+
+Routes:
+
+    GET    /hotels                          list hotel names
+    POST   /hotels                          {"name": ..., "rooms": ...}
+    GET    /hotels/<name>                   hotel details
+    PATCH  /hotels/<name>                   {"rooms": ...} and/or {"name": ...}
+    DELETE /hotels/<name>
+    GET    /customers                       list customer names
+    POST   /customers                       {"name": ...}
+    GET    /customers/<name>                customer details
+    PATCH  /customers/<name>                {"name": ...} and/or {"tier": ...}
+    DELETE /customers/<name>
+    POST   /reservations                    {"customer": ..., "hotel": ...,
+                                             "wait": true}
+    DELETE /reservations/<hotel>/<customer>
+    GET    /waitlist/<hotel>/<ticket>       place of a waiting ticket
+    DELETE /waitlist/<hotel>/<ticket>
+
+A reservation made with "wait": true in a full hotel is answered with 202
+and a ticket on the hotel's waitlist; the customer gets a room as soon as
+one is freed, without asking again.
+
+The server can be run by executing this module.
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import json
+import os
+import re
+from urllib.parse import unquote
+
+import abstractions as a
+import workload
+
+REASONS = {
+    200: 'OK', 201: 'Created', 202: 'Accepted', 400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict',
+    500: 'Internal Server Error',
+}
+
+# HTTP status of each BatchResult failure reason
+FAILURE_STATUS = {
+    'unknown customer': 404,
+    'unknown hotel': 404,
+    'no rooms available': 409,
+    'no reservation': 409,
+}
+
+
+# Body fields holding the name of a hotel or customer
+NAME_FIELDS = ('name', 'customer', 'hotel')
+
+
+class HTTPError(Exception):
+    """Error answered with an HTTP status and a JSON message."""
+
+    def __init__(self, status, message):
+        """Initializes HTTPError with a status and a message."""
+        super().__init__(message)
+        self.status = status
+
+
+def check_name(name):
+    """Raises an HTTPError unless name can name a hotel or customer, whose
+    file must stay inside the data directory."""
+    separators = [sep for sep in (os.sep, os.altsep, '\0') if sep]
+    if (not isinstance(name, str) or name in ('', '.', '..')
+            or any(sep in name for sep in separators)):
+        raise HTTPError(400, f'Invalid name: {name!r}')
+
+
+class HotelWriter:
+    """Queue of reservation operations on one hotel.
+
+    Operations submitted while a previous batch is being persisted wait and
+    are persisted together, so a burst of bookings costs one save per batch
+    instead of one per booking.
+    """
+
+    def __init__(self, server, hotel_name):
+        """Initializes HotelWriter for a hotel of a server."""
+        self.server = server
+        self.hotel_name = hotel_name
+        self.pending = []
+        self.flushing = False
+
+    async def submit(self, customer_name, reserve):
+        """Queues a reservation or cancellation and returns its
+        BatchResult once it is persisted."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((customer_name, reserve, future))
+        if not self.flushing:
+            self.flushing = True
+            asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        """Persists queued operations until the queue is empty."""
+        try:
+            while self.pending:
+                batch, self.pending = self.pending, []
+                try:
+                    results, hotel, persists = await asyncio.to_thread(
+                        self._persist, batch)
+                except Exception as e:
+                    for _, _, future in batch:
+                        future.set_exception(e)
+                    continue
+                self.server.persists += persists
+                self.server.remember_hotel(self.hotel_name, hotel)
+                for (_, _, future), result in zip(batch, results):
+                    future.set_result(result)
+        finally:
+            self.flushing = False
+            if self.server.writers.get(self.hotel_name) is self:
+                del self.server.writers[self.hotel_name]
+
+    def _persist(self, batch):
+        """Applies a batch in a worker thread, one batch call per run of
+        operations of the same kind, and returns the results, the saved
+        hotel and the number of batch calls."""
+        results = []
+        persists = 0
+        start = 0
+        while start < len(batch):
+            reserve = batch[start][1]
+            end = start
+            while end < len(batch) and batch[end][1] == reserve:
+                end += 1
+            pairs = [(customer_name, self.hotel_name)
+                     for customer_name, _, _ in batch[start:end]]
+            if reserve:
+                results.extend(a.create_reservations(pairs))
+            else:
+                results.extend(a.cancel_reservations(pairs))
+            persists += 1
+            start = end
+        return results, a.get_storage().load_hotel(self.hotel_name), persists
+
+
+class ReservationServer:
+    """Asyncio HTTP/JSON front end to the abstractions module."""
+
+    def __init__(self, host='127.0.0.1', port=8080, max_hot_hotels=1024):
+        """Initializes ReservationServer on a host and port."""
+        self.host = host
+        self.port = port
+        self.max_hot_hotels = max_hot_hotels
+        # Recently used hotels, least recently used first
+        self.hotels = collections.OrderedDict()
+        self.writers = {}
+        self.persists = 0
+        self._server = None
+        self.routes = [
+            ('GET', r'/hotels', self.list_hotels),
+            ('POST', r'/hotels', self.create_hotel),
+            ('GET', r'/hotels/([^/]+)', self.get_hotel),
+            ('PATCH', r'/hotels/([^/]+)', self.modify_hotel),
+            ('DELETE', r'/hotels/([^/]+)', self.delete_hotel),
+            ('GET', r'/customers', self.list_customers),
+            ('POST', r'/customers', self.create_customer),
+            ('GET', r'/customers/([^/]+)', self.get_customer),
+            ('PATCH', r'/customers/([^/]+)', self.modify_customer),
+            ('DELETE', r'/customers/([^/]+)', self.delete_customer),
+            ('POST', r'/reservations', self.create_reservation),
+            ('DELETE', r'/reservations/([^/]+)/([^/]+)',
+             self.cancel_reservation),
+            ('GET', r'/waitlist/([^/]+)/([0-9]+)', self.get_ticket),
+            ('DELETE', r'/waitlist/([^/]+)/([0-9]+)', self.delete_ticket),
+        ]
+
+    async def start(self):
+        """Starts listening; port 0 picks a free port."""
+        self._server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """Starts listening and serves until cancelled."""
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        """Stops listening and waits for the server to shut down."""
+        self._server.close()
+        await self._server.wait_closed()
+
+    def remember_hotel(self, name, hotel):
+        """Keeps a hotel in memory, evicting the least recently used."""
+        if hotel is None:
+            self.hotels.pop(name, None)
+            return
+        self.hotels[name] = hotel
+        self.hotels.move_to_end(name)
+        while len(self.hotels) > self.max_hot_hotels:
+            self.hotels.popitem(last=False)
+
+    def forget_hotels(self, names):
+        """Drops hotels from memory."""
+        for name in names:
+            self.hotels.pop(name, None)
+
+    async def handle_connection(self, reader, writer):
+        """Serves HTTP/1.1 requests on a connection until it is closed."""
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except ValueError as e:
+                    await self.respond(writer, 400,
+                                       {'error': f'Malformed request: {e}'},
+                                       keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.dispatch(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        """Writes a response with a JSON payload."""
+        data = json.dumps(payload).encode()
+        writer.write(
+            f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(data)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}'
+            f'\r\n\r\n'.encode() + data)
+        await writer.drain()
+
+    async def read_request(self, reader):
+        """Reads one request, or returns None at the end of the stream;
+        raises ValueError if it is malformed."""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length < 0:
+            raise ValueError(f'Invalid Content-Length {length}')
+        body = await reader.readexactly(length) if length else b''
+        return method, target.split('?', 1)[0], headers, body
+
+    async def dispatch(self, method, path, body):
+        """Routes a request and returns its status and JSON payload."""
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if not match:
+                continue
+            allowed = True
+            if route_method != method:
+                continue
+            try:
+                data = json.loads(body) if body else {}
+                args = [unquote(group) for group in match.groups()]
+                for name in args:
+                    check_name(name)
+                if isinstance(data, dict):
+                    for field in NAME_FIELDS:
+                        if field in data:
+                            check_name(data[field])
+                return await handler(data, *args)
+            except HTTPError as e:
+                return e.status, {'error': str(e)}
+            except (ValueError, KeyError, TypeError) as e:
+                return 400, {'error': f'Invalid request: {e}'}
+            except Exception as e:
+                return 500, {'error': str(e)}
+        if allowed:
+            return 405, {'error': f'{method} is not allowed on {path}'}
+        return 404, {'error': f'No route for {path}'}
+
+    async def load_hotel(self, name):
+        """Returns a hotel from memory or storage."""
+        hotel = self.hotels.get(name)
+        if hotel is None:
+            hotel = await asyncio.to_thread(a.get_storage().load_hotel, name)
+            if hotel is None:
+                raise HTTPError(404, f"Hotel '{name}' not found")
+            self.remember_hotel(name, hotel)
+        else:
+            self.hotels.move_to_end(name)
+        return hotel
+
+    async def list_hotels(self, data):
+        """Lists all hotel names."""
+        return 200, await asyncio.to_thread(a.get_storage().hotel_names)
+
+    async def create_hotel(self, data):
+        """Creates a hotel."""
+        await asyncio.to_thread(a.create_hotel, data['name'],
+                                int(data['rooms']))
+        self.forget_hotels([data['name']])
+        return 201, {'name': data['name'], 'rooms': int(data['rooms'])}
+
+    async def get_hotel(self, data, name):
+        """Returns the details of a hotel."""
+        hotel = await self.load_hotel(name)
+        return 200, {'name': hotel.name, 'rooms': hotel.rooms,
+                     'reservations': list(hotel.reservations)}
+
+    async def modify_hotel(self, data, name):
+        """Changes the room count and/or the name of a hotel."""
+        await self.load_hotel(name)
+        if 'rooms' in data:
+            await asyncio.to_thread(a.modify_hotel, name, int(data['rooms']))
+        self.forget_hotels([name])
+        if data.get('name', name) != name:
+            await asyncio.to_thread(a.rename_hotel, name, data['name'])
+            name = data['name']
+        return await self.get_hotel({}, name)
+
+    async def delete_hotel(self, data, name):
+        """Deletes a hotel."""
+        await asyncio.to_thread(a.delete_hotel, name)
+        self.forget_hotels([name])
+        return 200, {'deleted': name}
+
+    async def list_customers(self, data):
+        """Lists all customer names."""
+        return 200, await asyncio.to_thread(a.get_storage().customer_names)
+
+    async def create_customer(self, data):
+        """Creates a customer."""
+        await asyncio.to_thread(a.create_customer, data['name'])
+        return 201, {'name': data['name']}
+
+    async def get_customer(self, data, name):
+        """Returns a customer and the hotels it has reservations in."""
+        customer = await asyncio.to_thread(a.get_storage().load_customer,
+                                           name)
+        if customer is None:
+            raise HTTPError(404, f"Customer '{name}' not found")
+        return 200, {'name': customer.name, 'tier': customer.tier,
+                     'hotels': list(dict.fromkeys(customer.hotels))}
+
+    async def modify_customer(self, data, name):
+        """Changes the loyalty tier and/or the name of a customer."""
+        if 'tier' in data:
+            await asyncio.to_thread(a.set_loyalty_tier, name,
+                                    int(data['tier']))
+        if data.get('name', name) != name:
+            hotels = await asyncio.to_thread(a.hotels_with_reservation, name)
+            await asyncio.to_thread(a.modify_customer, name, data['name'])
+            self.forget_hotels(hotels)
+            name = data['name']
+        return await self.get_customer({}, name)
+
+    async def delete_customer(self, data, name):
+        """Deletes a customer."""
+        await asyncio.to_thread(a.delete_customer, name)
+        return 200, {'deleted': name}
+
+    async def submit(self, customer_name, hotel_name, reserve):
+        """Queues an operation on the writer of a hotel and returns the
+        response for its BatchResult."""
+        writer = self.writers.get(hotel_name)
+        if writer is None:
+            writer = self.writers[hotel_name] = HotelWriter(self,
+                                                            hotel_name)
+        result = await writer.submit(customer_name, reserve)
+        status = 201 if reserve else 200
+        if not result.ok:
+            status = FAILURE_STATUS[result.reason]
+        return status, result._asdict()
+
+    async def create_reservation(self, data):
+        """Reserves a room for a customer in a hotel, or with "wait" puts
+        the customer on the waitlist of a full hotel."""
+        status, payload = await self.submit(data['customer'], data['hotel'],
+                                            True)
+        if payload['reason'] != 'no rooms available' or not data.get('wait'):
+            return status, payload
+        ticket = await asyncio.to_thread(
+            a.create_reservation, data['customer'], data['hotel'], None,
+            None, True)
+        self.forget_hotels([data['hotel']])
+        if ticket is None:
+            # A room was freed in the meantime
+            return 201, dict(payload, ok=True, reason=None)
+        return 202, ticket._asdict()
+
+    async def get_ticket(self, data, hotel_name, ticket):
+        """Returns the place of a ticket on the waitlist of a hotel."""
+        await self.load_hotel(hotel_name)
+        position = await asyncio.to_thread(a.waitlist_position, hotel_name,
+                                           int(ticket))
+        if position is None:
+            raise HTTPError(404, f'Ticket {ticket} is not waiting')
+        return 200, {'hotel': hotel_name, 'number': int(ticket),
+                     'position': position}
+
+    async def delete_ticket(self, data, hotel_name, ticket):
+        """Takes a ticket off the waitlist of a hotel."""
+        if not await asyncio.to_thread(a.leave_waitlist, hotel_name,
+                                       int(ticket)):
+            raise HTTPError(404, f'Ticket {ticket} is not waiting')
+        self.forget_hotels([hotel_name])
+        return 200, {'deleted': int(ticket)}
+
+    async def cancel_reservation(self, data, hotel_name, customer_name):
+        """Cancels a reservation of a customer in a hotel."""
+        return await self.submit(customer_name, hotel_name, False)
+
+
+def main():
+    """Run the reservation server until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--sqlite', metavar='PATH',
+                        help='store data in a SQLite database file')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='record the operations served to a trace file')
+    args = parser.parse_args()
+    if args.sqlite:
+        a.use_storage(a.SQLiteStorage(args.sqlite))
+    server = ReservationServer(args.host, args.port)
+    print(f'Serving on http://{args.host}:{args.port}')
+    with (workload.Recorder(args.trace) if args.trace
+          else contextlib.nullcontext()):
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+This sharding module runs reservation workloads on a pool of worker
+processes, one per shard, so bulk operations use every core.
+
+Hotels are partitioned across the shards by consistent hashing: every hotel
+is owned by one worker, which alone parses and writes its file and keeps it
+in its object cache. A ShardRouter sends hotel operations to the owning
+worker and splits batches by shard, so the shards work on them in parallel.
+Operations spanning several shards, such as renaming a customer, fan out to
+every shard involved and gather the results. Customer files are shared by
+all workers and guarded by the file locks of the data directory.
+
+Adding or removing a shard only moves the hotels between it and its
+neighbours on the ring, so the object caches of the other workers stay warm.
+
+Example:
+
+    with ShardRouter(workers=4, directory='data') as router:
+        results = router.create_reservations(pairs)
+"""
+import bisect
+import concurrent.futures
+import hashlib
+import multiprocessing
+import os
+
+import abstractions as a
+import serialization
+
+# Points every shard gets on the ring; more points spread hotels more evenly
+REPLICAS = 64
+
+
+def _hash(key):
+    """Returns the position of a key on the ring, stable across
+    processes."""
+    return int.from_bytes(
+        hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash ring assigning keys to nodes."""
+
+    def __init__(self, nodes, replicas=REPLICAS):
+        """Initializes HashRing with some nodes, each placed replicas times
+        on the ring."""
+        points = sorted((_hash(f'{node}#{replica}'), node)
+                        for node in nodes for replica in range(replicas))
+        if not points:
+            raise ValueError('A hash ring needs at least one node')
+        self._hashes = [position for position, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        """Returns the node owning a key: the first one clockwise from
+        it."""
+        index = bisect.bisect(self._hashes, _hash(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+def _start_worker(directory, codec_name):
+    """Installs the storage backend of a worker process."""
+    codec = serialization.get_codec(codec_name) if codec_name else None
+    a.use_storage(a.FileStorage(directory, codec))
+
+
+def _call(function_name, args):
+    """Calls a function of the abstractions module in a worker."""
+    return getattr(a, function_name)(*args)
+
+
+def _rename_reservations(hotel_names, old_name, new_name):
+    """Renames the reservations of a customer in some hotels of a
+    worker."""
+    storage = a.get_storage()
+    for hotel_name in hotel_names:
+        storage.update_hotel(
+            hotel_name,
+            lambda hotel: hotel.update_reservation(old_name, new_name))
+
+
+class ShardRouter:
+    """Dispatches operations on a data directory to sharded workers."""
+
+    def __init__(self, workers=None, directory=os.curdir, codec=None,
+                 replicas=REPLICAS):
+        """Initializes ShardRouter with a number of worker processes, by
+        default one per core, on a data directory of FileStorage."""
+        workers = workers or os.cpu_count() or 1
+        self.storage = a.FileStorage(directory, codec)
+        self.ring = HashRing(range(workers), replicas)
+        # Spawned rather than forked workers inherit no lock held by
+        # another thread of this process
+        context = multiprocessing.get_context('spawn')
+        initargs = (os.path.abspath(directory), codec.name if codec else None)
+        self._workers = [
+            concurrent.futures.ProcessPoolExecutor(
+                1, context, initializer=_start_worker, initargs=initargs)
+            for _ in range(workers)]
+
+    def shard(self, hotel_name):
+        """Returns the index of the shard owning a hotel."""
+        return self.ring.node(hotel_name)
+
+    def submit(self, hotel_name, function_name, *args):
+        """Calls a function of the abstractions module on the shard owning
+        a hotel and returns a Future of its result."""
+        return self._workers[self.shard(hotel_name)].submit(
+            _call, function_name, args)
+
+    def create_reservation(self, customer_name, hotel_name, check_in=None,
+                           check_out=None, wait=False):
+        """Creates a reservation on the shard owning the hotel, or with
+        wait=True returns a Ticket on its waitlist if it is full."""
+        return self.submit(hotel_name, 'create_reservation', customer_name,
+                           hotel_name, check_in, check_out, wait).result()
+
+    def cancel_reservation(self, customer_name, hotel_name, check_in=None,
+                           check_out=None):
+        """Cancels a reservation on the shard owning the hotel."""
+        return self.submit(hotel_name, 'cancel_reservation', customer_name,
+                           hotel_name, check_in, check_out).result()
+
+    def modify_hotel(self, name, new_rooms):
+        """Modifies the number of rooms on the shard owning the hotel."""
+        return self.submit(name, 'modify_hotel', name, new_rooms).result()
+
+    def waitlist_position(self, hotel_name, ticket):
+        """Returns the place of a ticket on the waitlist of a hotel from
+        the shard owning it."""
+        return self.submit(hotel_name, 'waitlist_position', hotel_name,
+                           ticket).result()
+
+    def leave_waitlist(self, hotel_name, ticket):
+        """Takes a ticket off the waitlist of a hotel on the shard owning
+        it."""
+        return self.submit(hotel_name, 'leave_waitlist', hotel_name,
+                           ticket).result()
+
+    def _split(self, hotel_names):
+        """Returns the indexes of some hotel names grouped by shard."""
+        indexes_by_shard = {}
+        for index, hotel_name in enumerate(hotel_names):
+            indexes_by_shard.setdefault(self.shard(hotel_name), []).append(
+                index)
+        return indexes_by_shard
+
+    def _apply_batch(self, pairs, function_name):
+        """Runs a batch function on every shard with its share of
+        (customer name, hotel name) pairs and returns the results in the
+        order of the pairs."""
+        pairs = list(pairs)
+        futures = {
+            shard: (indexes, self._workers[shard].submit(
+                _call, function_name, ([pairs[i] for i in indexes],)))
+            for shard, indexes in self._split(
+                [pair[1] for pair in pairs]).items()}
+        results = [None] * len(pairs)
+        for indexes, future in futures.values():
+            for index, result in zip(indexes, future.result()):
+                results[index] = result
+        return results
+
+    def create_reservations(self, pairs):
+        """Creates reservations for (customer name, hotel name) pairs on all
+        shards in parallel and returns a BatchResult for each pair, in
+        order."""
+        return self._apply_batch(pairs, 'create_reservations')
+
+    def cancel_reservations(self, pairs):
+        """Cancels reservations for (customer name, hotel name) pairs on all
+        shards in parallel and returns a BatchResult for each pair, in
+        order."""
+        return self._apply_batch(pairs, 'cancel_reservations')
+
+    def modify_customer(self, old_name, new_name):
+        """Renames a customer, then renames its reservations on every shard
+        owning one of its hotels."""
+        hotel_names = self.storage.move_customer(old_name, new_name)
+        futures = [
+            self._workers[shard].submit(
+                _rename_reservations, [hotel_names[i] for i in indexes],
+                old_name, new_name)
+            for shard, indexes in self._split(hotel_names).items()]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """Stops the worker processes."""
+        for worker in self._workers:
+            worker.shutdown()
+        self.storage.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,293 @@
+"""
+This snapshot module keeps the encoded contents of every hotel and customer
+file of a data directory in one memory-mapped file.
+
+The snapshot starts with a header pointing at an offset table, which maps
+each file name to the byte range of its encoded data and to the size and
+modification time the file had when the data was taken. Opening a snapshot
+maps the file and parses the table; a single entity is then read by slicing
+its byte range, so the cost of a cold start grows with the entities viewed
+rather than with the size of the dataset. Entries whose file has changed
+since are ignored, and the caller falls back to the file.
+
+Updates are collected in memory and written in batches: the new data is
+appended, followed by a new table, and the header is switched to it last.
+Once more than half of the file is superseded data, the snapshot is
+rewritten from its live entries.
+"""
+import array
+import contextlib
+import mmap
+import os
+import struct
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock (e.g. on Windows) snapshot updates only exclude threads
+    fcntl = None
+
+MAGIC = b'HRSNAP\x00\x01'
+
+# Magic bytes, table offset and table length
+HEADER = struct.Struct('<8sQQ')
+
+# Every signature is stored as this many integers, padded with -1
+SIGNATURE_LENGTH = 4
+
+# Pending updates written at once
+FLUSH_AFTER = 256
+
+# Superseded bytes tolerated before the file is rewritten
+COMPACT_AFTER = 1 << 20
+
+
+class Snapshot:
+    """Memory-mapped snapshot of the files of a data directory."""
+
+    def __init__(self, path, flush_after=FLUSH_AFTER):
+        """Initializes Snapshot on a snapshot file, which need not exist."""
+        self.path = path
+        self.flush_after = flush_after
+        self._lock = threading.RLock()
+        self._file = None
+        self._map = None
+        self._table = _Table()
+        # Entry name to (data, signature, journal length), or None for a
+        # removed entry, not yet written to the file
+        self._pending = {}
+        self._open()
+
+    def _open(self):
+        """Maps the snapshot file and reads its offset table."""
+        self._close()
+        self._table = _Table()
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            magic, offset, length = HEADER.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ValueError('Not a snapshot file')
+            self._table = _Table.decode(self._map[offset:offset + length])
+        except (ValueError, struct.error, OSError):
+            # A damaged snapshot is ignored and rewritten by the next flush
+            self._close()
+            self._table = _Table()
+
+    def _close(self):
+        """Unmaps the snapshot file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get(self, name, signature):
+        """Returns the data and journal length of an entry taken from a file
+        with the given signature, or None."""
+        with self._lock:
+            if name in self._pending:
+                pending = self._pending[name]
+                if pending is None or pending[1] != signature:
+                    return None
+                return pending[0], pending[2]
+            entry = self._table.get(name)
+            if entry is None or entry[2] != signature:
+                return None
+            offset, length, _, journal_length = entry
+            return self._map[offset:offset + length], journal_length
+
+    def put(self, name, data, signature, journal_length=0):
+        """Records the data of a file with a signature."""
+        if signature is None:
+            self.remove(name)
+            return
+        with self._lock:
+            self._pending[name] = (bytes(data), signature, journal_length)
+            due = len(self._pending) >= self.flush_after
+        if due:
+            self.flush()
+
+    def remove(self, name):
+        """Forgets the entry of a file."""
+        with self._lock:
+            self._pending[name] = None
+
+    def names(self):
+        """Returns the names of the entries, pending ones included."""
+        with self._lock:
+            names = dict.fromkeys(self._table.index)
+            for name, pending in self._pending.items():
+                if pending is None:
+                    names.pop(name, None)
+                else:
+                    names[name] = None
+            return list(names)
+
+    def flush(self):
+        """Writes the pending updates to the snapshot file."""
+        with self._lock:
+            if not self._pending:
+                return
+            with self._exclusive():
+                # Another process may have written since the file was read
+                self._open()
+                pending, self._pending = self._pending, {}
+                live = sum(entry[1] for name, entry in self._table.items()
+                           if name not in pending)
+                live += sum(len(value[0]) for value in pending.values()
+                            if value is not None)
+                size = os.path.getsize(self.path) if self._map else 0
+                if not self._map or size - live > max(live, COMPACT_AFTER):
+                    self._rewrite(pending)
+                else:
+                    self._append(pending, size)
+                self._open()
+
+    def _append(self, pending, size):
+        """Appends pending data and a new table, then switches the header
+        to the table."""
+        entries = dict(self._table.items())
+        with open(self.path, 'r+b') as file:
+            file.seek(size)
+            offset = size
+            for name, value in pending.items():
+                if value is None:
+                    entries.pop(name, None)
+                    continue
+                data, signature, journal_length = value
+                file.write(data)
+                entries[name] = (offset, len(data), signature, journal_length)
+                offset += len(data)
+            table = _encode_table(entries)
+            file.write(table)
+            file.flush()
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, offset, len(table)))
+
+    def _rewrite(self, pending):
+        """Writes every live entry to a new snapshot file that replaces the
+        current one."""
+        entries = {}
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, 0, 0))
+            offset = HEADER.size
+            for name, entry in self._table.items():
+                if name in pending:
+                    continue
+                data = self._map[entry[0]:entry[0] + entry[1]]
+                file.write(data)
+                entries[name] = (offset,) + entry[1:]
+                offset += len(data)
+            for name, value in pending.items():
+                if value is None:
+                    continue
+                data, signature, journal_length = value
+                file.write(data)
+                entries[name] = (offset, len(data), signature, journal_length)
+                offset += len(data)
+            table = _encode_table(entries)
+            file.write(table)
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, offset, len(table)))
+        # Readers keep their mapping of the replaced file
+        os.replace(temporary, self.path)
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Excludes other processes writing the snapshot file."""
+        if fcntl is None:
+            yield
+            return
+        with open(f'{self.path}.lock', 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def close(self):
+        """Writes the pending updates and unmaps the file."""
+        with self._lock:
+            self.flush()
+            self._close()
+
+    def __len__(self):
+        return len(self.names())
+
+
+def _encode_table(entries):
+    """Returns the bytes of an offset table."""
+    names = '\0'.join(entries).encode('utf-8')
+    offsets = array.array('q')
+    signatures = array.array('q')
+    for offset, length, signature, journal_length in entries.values():
+        offsets.extend((offset, length, journal_length))
+        signatures.extend(signature)
+        signatures.extend([-1] * (SIGNATURE_LENGTH - len(signature)))
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+        signatures.byteswap()
+    return b''.join([struct.pack('<II', len(entries), len(names)), names,
+                     offsets.tobytes(), signatures.tobytes()])
+
+
+class _Table:
+    """Offset table of a snapshot file.
+
+    The decoded table keeps its columns in arrays and only maps names to
+    their row, so opening a snapshot costs a few C-level conversions and a
+    single entry is assembled when it is asked for.
+    """
+
+    def __init__(self, names=(), offsets=None, signatures=None):
+        """Initializes _Table from its decoded columns."""
+        self.index = dict(zip(names, range(len(names))))
+        self.offsets = offsets if offsets is not None else array.array('q')
+        self.signatures = (signatures if signatures is not None
+                           else array.array('q'))
+
+    @classmethod
+    def decode(cls, raw):
+        """Returns the table encoded in some bytes."""
+        count, length = struct.unpack_from('<II', raw)
+        position = 8 + length
+        names = raw[8:position].decode('utf-8').split('\0') if count else []
+        offsets = array.array('q')
+        offsets.frombytes(raw[position:position + 24 * count])
+        position += 24 * count
+        signatures = array.array('q')
+        signatures.frombytes(
+            raw[position:position + 8 * SIGNATURE_LENGTH * count])
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+            signatures.byteswap()
+        if (len(names) != count or len(offsets) != 3 * count
+                or len(signatures) != SIGNATURE_LENGTH * count):
+            raise ValueError('Corrupt snapshot table')
+        return cls(names, offsets, signatures)
+
+    def get(self, name):
+        """Returns (offset, length, signature, journal length) of an entry,
+        or None."""
+        row = self.index.get(name)
+        if row is None:
+            return None
+        signature = tuple(
+            value for value in self.signatures[SIGNATURE_LENGTH * row:
+                                               SIGNATURE_LENGTH * (row + 1)]
+            if value != -1)
+        return (self.offsets[3 * row], self.offsets[3 * row + 1], signature,
+                self.offsets[3 * row + 2])
+
+    def items(self):
+        """Returns (name, entry) pairs of every entry."""
+        return [(name, self.get(name)) for name in self.index]
@@ -0,0 +1,217 @@
+"""
+This table module holds a whole dataset in memory as columns of arrays, for
+reports and other bulk operations over every hotel and customer.
+
+A Hotel object keeps its reservations in dicts keyed by customer name, and
+every hotel repeats the names of its customers, so a chain of hotels loaded
+as objects takes hundreds of bytes per reservation. The tables instead
+intern every name once and number it: a CustomerTable maps customer names
+to integer ids, and a HotelTable keeps the rooms of every hotel in arrays
+and the reservations of all hotels as runs of (customer id, count,
+check-in, check-out) in four more arrays, with the first run of every hotel
+in an array of offsets. Aggregates scan the arrays directly, without
+creating an object per hotel or reservation.
+
+Example:
+
+    customers = CustomerTable.load()
+    hotels = HotelTable.load(customers=customers)
+    print(hotels.total_reservations(),
+          customers.without_reservation(hotels))
+"""
+import array
+import bisect
+import datetime
+import sys
+
+import abstractions as a
+
+# Check-in and check-out ordinal of the runs of open-ended reservations
+OPEN_ENDED = 0
+
+
+class CustomerTable:
+    """Interned customer names numbered by integer ids."""
+
+    __slots__ = ('names', '_ids')
+
+    def __init__(self, names=()):
+        """Initializes CustomerTable with an iterable of names."""
+        self.names = []
+        self._ids = {}
+        for name in names:
+            self.add(name)
+
+    @classmethod
+    def load(cls, storage=None):
+        """Returns a CustomerTable of the customers of a storage backend, by
+        default the one in use."""
+        if storage is None:
+            storage = a.get_storage()
+        return cls(storage.customer_names())
+
+    def add(self, name):
+        """Returns the id of a customer name, adding the name if it is
+        new."""
+        customer_id = self._ids.get(name)
+        if customer_id is None:
+            name = sys.intern(name)
+            customer_id = self._ids[name] = len(self.names)
+            self.names.append(name)
+        return customer_id
+
+    def lookup(self, name):
+        """Returns the id of a customer name, or None."""
+        return self._ids.get(name)
+
+    def without_reservation(self, hotels):
+        """Returns the names of the customers without any reservation in a
+        HotelTable."""
+        counts = hotels.reservation_counts()
+        return [name for name, count in zip(self.names, counts)
+                if not count]
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class HotelTable:
+    """Hotels and their reservations as columns of arrays."""
+
+    __slots__ = ('customers', 'names', '_ids', 'rooms', 'free', 'reserved',
+                 'versions', 'sequences', 'offsets', 'run_customers',
+                 'run_counts', 'check_ins', 'check_outs')
+
+    def __init__(self, customers=None):
+        """Initializes an empty HotelTable whose reservations refer to the
+        ids of a CustomerTable."""
+        self.customers = CustomerTable() if customers is None else customers
+        self.names = []
+        self._ids = {}
+        # Rooms left for open-ended reservations, rooms free on every
+        # night, and open-ended reservations of every hotel
+        self.rooms = array.array('q')
+        self.free = array.array('q')
+        self.reserved = array.array('q')
+        self.versions = array.array('q')
+        self.sequences = array.array('q')
+        # The runs of hotel i are offsets[i] up to offsets[i + 1]
+        self.offsets = array.array('Q', [0])
+        self.run_customers = array.array('I')
+        self.run_counts = array.array('I')
+        self.check_ins = array.array('i')
+        self.check_outs = array.array('i')
+
+    @classmethod
+    def load(cls, storage=None, customers=None):
+        """Returns a HotelTable of the hotels of a storage backend, by
+        default the one in use, loading one hotel at a time."""
+        if storage is None:
+            storage = a.get_storage()
+        if customers is None:
+            customers = CustomerTable.load(storage)
+        table = cls(customers)
+        for name in storage.hotel_names():
+            hotel = storage.load_hotel(name)
+            if hotel is not None:
+                table.append(hotel)
+        return table
+
+    def append(self, hotel):
+        """Adds a Hotel object as the last row and returns its id."""
+        if hotel.name in self._ids:
+            raise ValueError(f'Hotel {hotel.name!r} is already in the table')
+        name = sys.intern(hotel.name)
+        hotel_id = self._ids[name] = len(self.names)
+        self.names.append(name)
+        self.rooms.append(hotel.rooms)
+        self.free.append(hotel.free_rooms())
+        self.reserved.append(len(hotel.reservations))
+        self.versions.append(hotel.version)
+        self.sequences.append(hotel.sequence)
+        for customer, count in hotel.reservations.items():
+            self._append_run(customer, count, OPEN_ENDED, OPEN_ENDED)
+        for stay, count in hotel.stays.items():
+            self._append_run(stay.customer, count, stay.check_in.toordinal(),
+                             stay.check_out.toordinal())
+        self.offsets.append(len(self.run_customers))
+        return hotel_id
+
+    def _append_run(self, customer, count, check_in, check_out):
+        """Adds a run of reservations to the last hotel."""
+        self.run_customers.append(self.customers.add(customer))
+        self.run_counts.append(count)
+        self.check_ins.append(check_in)
+        self.check_outs.append(check_out)
+
+    def hotel(self, name):
+        """Returns a Hotel object of a row, or None."""
+        hotel_id = self._ids.get(name)
+        if hotel_id is None:
+            return None
+        hotel = a.Hotel(self.names[hotel_id], self.rooms[hotel_id])
+        names = self.customers.names
+        pairs = []
+        for run in range(self.offsets[hotel_id], self.offsets[hotel_id + 1]):
+            customer = names[self.run_customers[run]]
+            if self.check_ins[run] == OPEN_ENDED:
+                pairs.append((customer, self.run_counts[run]))
+                continue
+            stay = a.Stay(customer,
+                          datetime.date.fromordinal(self.check_ins[run]),
+                          datetime.date.fromordinal(self.check_outs[run]))
+            for _ in range(self.run_counts[run]):
+                hotel._add_stay(stay)
+        hotel.reservations = a.Reservations.from_counts(pairs)
+        hotel.version = self.versions[hotel_id]
+        hotel.sequence = self.sequences[hotel_id]
+        return hotel
+
+    def total_rooms(self):
+        """Returns the number of rooms of all hotels."""
+        return sum(self.rooms) + sum(self.reserved)
+
+    def total_reservations(self):
+        """Returns the number of reservations and dated stays of all
+        hotels."""
+        return sum(self.run_counts)
+
+    def reservation_counts(self):
+        """Returns an array of the number of reservations of every customer,
+        indexed by customer id."""
+        counts = array.array('Q', bytes(8 * len(self.customers)))
+        for customer_id, count in zip(self.run_customers, self.run_counts):
+            counts[customer_id] += count
+        return counts
+
+    def hotels_with_reservation(self, customer_name):
+        """Returns the hotels a customer has reservations in."""
+        customer_id = self.customers.lookup(customer_name)
+        hotels = []
+        for run, run_customer in enumerate(self.run_customers):
+            if run_customer == customer_id:
+                hotel = self.names[bisect.bisect(self.offsets, run) - 1]
+                if not hotels or hotels[-1] != hotel:
+                    hotels.append(hotel)
+        return hotels
+
+    def hotels_with_free_rooms(self, minimum=1):
+        """Returns the hotels with at least minimum rooms free on every
+        night."""
+        return [name for name, free in zip(self.names, self.free)
+                if free >= minimum]
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
@@ -15,10 +15,14 @@ the tests.
 
 The tests can be run by executing this module.
 """
+import datetime
 import unittest
 from unittest import mock
 import os
+import tempfile
+import threading
 import abstractions
+import serialization
 
 
 class TestHotel(unittest.TestCase):
@@ -69,6 +73,150 @@ class TestHotel(unittest.TestCase):
         self.assertEqual(hotel.rooms, 10)
         self.assertEqual(hotel.reservations, [])
 
+    def test_json_round_trip(self):
+        """Test that reservations round-trip through JSON in order, including
+        customers holding several rooms."""
+        json_str = ('{"name": "Test Hotel", "rooms": 6, '
+                    '"reservations": ["A", "B", "A", "C"]}')
+        hotel = abstractions.Hotel.from_json(json_str)
+        self.assertEqual(hotel.reservations.count('A'), 2)
+        self.assertEqual(len(hotel.reservations), 4)
+        self.assertEqual(abstractions.Hotel.from_json(hotel.to_json()).
+                         reservations, ['A', 'A', 'B', 'C'])
+
+    def test_cancel_one_of_several_reservations(self):
+        """Test that cancelling removes a single reservation of a customer
+        holding several rooms."""
+        self.hotel.reserve_room(self.customer)
+        self.hotel.reserve_room(self.customer)
+        self.assertTrue(self.hotel.cancel_reservation(self.customer))
+        self.assertIn(self.customer.name, self.hotel.reservations)
+        self.assertEqual(self.hotel.rooms, 9)
+
+    def test_update_reservation_moves_every_room(self):
+        """Test that renaming moves all reservations of a customer."""
+        self.hotel.reserve_room(self.customer)
+        self.hotel.reserve_room(self.customer)
+        self.hotel.update_reservation(self.customer.name, 'New Customer')
+        self.assertEqual(self.hotel.reservations,
+                         ['New Customer', 'New Customer'])
+
+    def test_dated_stays_reuse_rooms(self):
+        """Test that stays on different nights share a room, and
+        overlapping stays need one room each."""
+        hotel = abstractions.Hotel('Small Hotel', 1)
+        self.assertTrue(hotel.reserve_room(self.customer, '2024-05-01',
+                                           '2024-05-03'))
+        self.assertTrue(hotel.reserve_room(self.customer, '2024-05-03',
+                                           '2024-05-05'))
+        self.assertFalse(hotel.reserve_room(self.customer, '2024-05-02',
+                                            '2024-05-04'))
+        self.assertFalse(hotel.reserve_room(self.customer))
+        self.assertEqual(hotel.rooms, 1)
+        self.assertFalse(hotel.is_available('2024-04-30', '2024-05-02'))
+        self.assertTrue(hotel.is_available('2024-05-05', '2024-05-06'))
+
+    def test_peak_occupancy(self):
+        """Test that the peak counts overlapping stays and undated
+        reservations."""
+        self.hotel.reserve_room(self.customer)
+        self.hotel.reserve_room(self.customer, '2024-05-01', '2024-05-10')
+        self.hotel.reserve_room(self.customer, '2024-05-05', '2024-05-06')
+        self.hotel.reserve_room(self.customer, '2024-05-08', '2024-05-12')
+        self.assertEqual(self.hotel.peak_occupancy('2024-05-01',
+                                                   '2024-05-05'), 2)
+        self.assertEqual(self.hotel.peak_occupancy('2024-05-05',
+                                                   '2024-05-09'), 3)
+        self.assertEqual(self.hotel.peak_occupancy('2024-06-01',
+                                                   '2024-06-02'), 1)
+        self.assertTrue(self.hotel.cancel_reservation(
+            self.customer, '2024-05-05', '2024-05-06'))
+        self.assertEqual(self.hotel.peak_occupancy('2024-05-05',
+                                                   '2024-05-06'), 2)
+        self.assertFalse(self.hotel.cancel_reservation(
+            self.customer, '2024-05-05', '2024-05-06'))
+
+    def test_invalid_stay(self):
+        """Test that a stay must end after it starts."""
+        with self.assertRaises(ValueError):
+            self.hotel.reserve_room(self.customer, '2024-05-02',
+                                    '2024-05-02')
+
+    def test_stays_json_round_trip(self):
+        """Test that stays survive JSON and renaming, while undated
+        reservations load as open-ended stays."""
+        self.hotel.reserve_room(self.customer)
+        self.hotel.reserve_room(self.customer, '2024-05-01', '2024-05-03')
+        self.hotel.update_reservation(self.customer.name, 'New Customer')
+        hotel = abstractions.Hotel.from_json(self.hotel.to_json())
+        self.assertEqual(hotel.reservations, ['New Customer'])
+        self.assertEqual(list(hotel.stays), [abstractions.Stay(
+            'New Customer', datetime.date(2024, 5, 1),
+            datetime.date(2024, 5, 3))])
+        self.assertEqual(hotel.peak_occupancy('2024-05-02', '2024-05-03'), 2)
+
+    def test_lazy_reservations(self):
+        """Test that a hotel built from a header parses its data on first
+        use of its reservations, after applying journal records."""
+        self.hotel.reserve_room(self.customer)
+        data = self.hotel.to_data()
+        loads = []
+
+        def load():
+            loads.append(1)
+            return data
+
+        hotel = abstractions.Hotel.from_header(
+            serialization.Header({'name': 'Test Hotel', 'rooms': 9},
+                                 ('reservations',), None), load)
+        hotel.replay({'op': 'reserve', 'customer': 'Other', 'rooms': 8})
+        copy = hotel.copy()
+        self.assertEqual((hotel.rooms, hotel.free_rooms()), (8, 8))
+        self.assertEqual(loads, [])
+        self.assertEqual(list(hotel.reservations), ['Test Customer',
+                                                    'Other'])
+        self.assertEqual(hotel.rooms, 8)
+        self.assertTrue(copy.cancel_reservation(self.customer))
+        self.assertEqual(list(copy.reservations), ['Other'])
+        self.assertEqual(len(hotel.reservations), 2)
+        self.assertEqual(loads, [1, 1])
+
+    def test_waitlist(self):
+        """Test that a full hotel serves its waitlist by loyalty tier and
+        then by ticket, keeping customers whose stay does not fit."""
+        hotel = abstractions.Hotel('Test Hotel', 1)
+        hotel.track_changes()
+        hotel.reserve_room(self.customer)
+        customers = [abstractions.Customer(name) for name in 'ABC']
+        customers[2].tier = 1
+        for customer in customers:
+            hotel.join_waitlist(customer)
+        dated = hotel.join_waitlist(customers[0], '2024-05-01',
+                                    '2024-05-03')
+        self.assertEqual(hotel.join_waitlist(customers[1]).ticket, 2)
+        self.assertEqual([entry.customer for entry in hotel.waitlist],
+                         ['C', 'A', 'B', 'A'])
+        self.assertEqual(hotel.waitlist.position(dated.ticket), 4)
+        self.assertEqual(hotel.drain_waitlist(), [])
+        hotel.cancel_reservation(self.customer)
+        served = hotel.drain_waitlist(lambda customer: customer != 'C')
+        self.assertEqual([entry.ticket for entry in served], [1])
+        self.assertEqual(list(hotel.reservations), ['A'])
+        self.assertEqual(hotel.waitlist.position(2), 1)
+        self.assertTrue(hotel.leave_waitlist(2))
+        self.assertFalse(hotel.leave_waitlist(2))
+        hotel.rooms += 1
+        self.assertEqual(hotel.drain_waitlist(), [dated])
+        replayed = abstractions.Hotel('Test Hotel', 1)
+        for record in hotel.changes:
+            replayed.replay(record)
+        copy = abstractions.Hotel.from_json(hotel.to_json())
+        for other in (replayed, copy):
+            self.assertEqual(list(other.reservations), ['A'])
+            self.assertEqual(list(other.stays), list(hotel.stays))
+            self.assertEqual(len(other.waitlist), 0)
+            self.assertEqual(other.tickets, 4)
+
 
 class TestCustomer(unittest.TestCase):
     """Test cases for the Customer class in the abstractions module."""
@@ -81,6 +229,14 @@ class TestCustomer(unittest.TestCase):
         """Test that a Customer object can be serialized to JSON."""
         self.assertEqual(self.customer.to_json(), '{"name": "Test Customer"}')
 
+    def test_to_json_with_hotels(self):
+        """Test that the hotel index of a customer is serialized."""
+        self.customer.add_hotel('Test Hotel')
+        self.assertEqual(
+            self.customer.to_json(),
+            '{"name": "Test Customer", "hotels": ["Test Hotel"]}'
+            )
+
     def test_from_json(self):
         """Test that a Customer object can be deserialized from JSON."""
         json_str = '{"name": "Test Customer"}'
@@ -107,6 +263,8 @@ class TestFunctions(unittest.TestCase):
         """Remove the test hotel and customer files after each test."""
         if os.path.exists(f'{self.hotel_name}.hotel'):
             os.remove(f'{self.hotel_name}.hotel')
+        if os.path.exists(f'{self.hotel_name}.hotel.log'):
+            os.remove(f'{self.hotel_name}.hotel.log')
         if os.path.exists(f'{self.customer_name}.customer'):
             os.remove(f'{self.customer_name}.customer')
 
@@ -150,6 +308,203 @@ class TestFunctions(unittest.TestCase):
             )
         self.assertEqual(modified_customer.name, 'New Customer Name')
 
+    def test_reservation_index(self):
+        """Test that the customer-to-hotel index follows reservations,
+        renames and hotel deletion."""
+        abstractions.create_reservation(self.customer_name, self.hotel_name)
+        self.assertEqual(
+            abstractions.hotels_with_reservation(self.customer_name),
+            [self.hotel_name]
+            )
+        self.assertNotIn(self.customer_name,
+                         abstractions.customers_without_reservation())
+        abstractions.delete_hotel(self.hotel_name)
+        self.assertEqual(
+            abstractions.hotels_with_reservation(self.customer_name), []
+            )
+        self.assertIn(self.customer_name,
+                      abstractions.customers_without_reservation())
+
+    def test_modify_customer_updates_reservations(self):
+        """Test that renaming a customer renames its reservations."""
+        abstractions.create_reservation(self.customer_name, self.hotel_name)
+        abstractions.modify_customer(self.customer_name, 'Renamed Customer')
+        hotel = abstractions.load_from_file(
+            abstractions.Hotel, f'{self.hotel_name}.hotel'
+            )
+        self.assertEqual(hotel.reservations, ['Renamed Customer'])
+        os.remove('Renamed Customer.customer')
+
+    def test_rebuild_reservation_index(self):
+        """Test that the index is rebuilt from the hotel files."""
+        self.hotel.reserve_room(self.customer)
+        abstractions.save_to_file(self.hotel, f'{self.hotel_name}.hotel')
+        abstractions.rebuild_reservation_index()
+        self.assertEqual(
+            abstractions.hotels_with_reservation(self.customer_name),
+            [self.hotel_name]
+            )
+
+    def test_reservations_are_journaled(self):
+        """Test that reservations are appended to the journal and replayed
+        on load without rewriting the snapshot."""
+        with open(f'{self.hotel_name}.hotel', encoding='utf-8') as file:
+            snapshot = file.read()
+        abstractions.create_reservation(self.customer_name, self.hotel_name)
+        with open(f'{self.hotel_name}.hotel', encoding='utf-8') as file:
+            self.assertEqual(file.read(), snapshot)
+        self.assertTrue(os.path.exists(f'{self.hotel_name}.hotel.log'))
+        hotel = abstractions.load_from_file(
+            abstractions.Hotel, f'{self.hotel_name}.hotel'
+            )
+        self.assertEqual(hotel.rooms, 9)
+        self.assertEqual(hotel.reservations, [self.customer_name])
+
+    def test_stays_are_journaled(self):
+        """Test that dated stays are journaled and answer availability
+        queries after reloading."""
+        abstractions.create_reservation(self.customer_name, self.hotel_name,
+                                        '2024-05-01', '2024-05-03')
+        self.assertTrue(os.path.exists(f'{self.hotel_name}.hotel.log'))
+        abstractions.object_cache.clear()
+        self.assertEqual(abstractions.peak_occupancy(
+            self.hotel_name, '2024-05-02', '2024-05-04'), 1)
+        self.assertTrue(abstractions.room_available(
+            self.hotel_name, '2024-05-01', '2024-05-03'))
+        self.assertEqual(abstractions.hotels_with_reservation(
+            self.customer_name), [self.hotel_name])
+        abstractions.cancel_reservation(self.customer_name, self.hotel_name,
+                                        '2024-05-01', '2024-05-03')
+        abstractions.object_cache.clear()
+        self.assertEqual(abstractions.peak_occupancy(
+            self.hotel_name, '2024-05-02', '2024-05-04'), 0)
+        self.assertEqual(abstractions.hotels_with_reservation(
+            self.customer_name), [])
+
+    def test_torn_journal_record_is_ignored(self):
+        """Test that a partially written last record is skipped."""
+        abstractions.create_reservation(self.customer_name, self.hotel_name)
+        with open(f'{self.hotel_name}.hotel.log', 'a',
+                  encoding='utf-8') as file:
+            file.write('{"op": "cancel", "cust')
+        hotel = abstractions.load_from_file(
+            abstractions.Hotel, f'{self.hotel_name}.hotel'
+            )
+        self.assertEqual(hotel.reservations, [self.customer_name])
+
+    @mock.patch('abstractions.COMPACT_JOURNAL_AFTER', 2)
+    def test_journal_compaction(self):
+        """Test that a full journal is compacted into the snapshot."""
+        abstractions.create_reservation(self.customer_name, self.hotel_name)
+        abstractions.cancel_reservation(self.customer_name, self.hotel_name)
+        self.assertFalse(os.path.exists(f'{self.hotel_name}.hotel.log'))
+        with open(f'{self.hotel_name}.hotel', encoding='utf-8') as file:
+            self.assertEqual(
+                file.read(),
+                '{"name": "Test Hotel", "rooms": 10, "version": 2, '
+                '"sequence": 1, "reservations": []}'
+                )
+
+    def test_stale_hotel_is_not_saved(self):
+        """Test that a hotel saved by another writer after it was loaded is
+        not overwritten."""
+        storage = abstractions.get_storage()
+        stale = storage.load_hotel(self.hotel_name)
+        abstractions.create_reservation(self.customer_name, self.hotel_name)
+        stale.rooms = 0
+        self.assertFalse(storage.compare_and_save_hotel(stale))
+        hotel = storage.load_hotel(self.hotel_name)
+        self.assertEqual((hotel.rooms, hotel.version), (9, 1))
+
+    def test_concurrent_reservations(self):
+        """Test that concurrent reservations in one hotel are all kept."""
+        names = [f'Concurrent Customer {i}' for i in range(8)]
+        for name in names:
+            abstractions.create_customer(name)
+        threads = [threading.Thread(target=abstractions.create_reservation,
+                                    args=(name, self.hotel_name))
+                   for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in names:
+            abstractions.delete_customer(name)
+        hotel = abstractions.load_from_file(
+            abstractions.Hotel, f'{self.hotel_name}.hotel'
+            )
+        self.assertEqual(hotel.rooms, 2)
+        self.assertCountEqual(hotel.reservations, names)
+
+    def test_reservations_with_invalid_dates(self):
+        """Test that batch items with invalid dates are refused without
+        stopping the others."""
+        results = abstractions.create_reservations([
+            (self.customer_name, self.hotel_name, '2024-05-01',
+             '2024-05-03'),
+            (self.customer_name, self.hotel_name, '2024-05-03',
+             '2024-05-01'),
+            (self.customer_name, self.hotel_name, 'tomorrow', None),
+            (self.customer_name, self.hotel_name, None, None),
+            ])
+        self.assertEqual([result.reason for result in results],
+                         [None, 'invalid dates', 'invalid dates', None])
+        self.assertEqual(
+            abstractions.hotels_with_reservation(self.customer_name),
+            [self.hotel_name]
+            )
+        results = abstractions.cancel_reservations([
+            (self.customer_name, self.hotel_name, '2024-05-01', 5),
+            (self.customer_name, self.hotel_name),
+            ])
+        self.assertEqual([result.reason for result in results],
+                         ['invalid dates', None])
+
+    def test_create_and_cancel_reservations(self):
+        """Test that batch reservations report a result for every pair."""
+        abstractions.save_to_file(abstractions.Hotel('Full Hotel', 0),
+                                  'Full Hotel.hotel')
+        results = abstractions.create_reservations([
+            (self.customer_name, self.hotel_name),
+            ('Unknown Customer', self.hotel_name),
+            (self.customer_name, 'Unknown Hotel'),
+            (self.customer_name, 'Full Hotel'),
+            (self.customer_name, self.hotel_name),
+            ])
+        os.remove('Full Hotel.hotel')
+        self.assertEqual([result.reason for result in results], [
+            None, 'unknown customer', 'unknown hotel', 'no rooms available',
+            None])
+        hotel = abstractions.load_from_file(
+            abstractions.Hotel, f'{self.hotel_name}.hotel'
+            )
+        self.assertEqual(hotel.rooms, 8)
+        self.assertEqual(
+            abstractions.hotels_with_reservation(self.customer_name),
+            [self.hotel_name]
+            )
+
+        results = abstractions.cancel_reservations([
+            (self.customer_name, self.hotel_name),
+            (self.customer_name, self.hotel_name),
+            (self.customer_name, self.hotel_name),
+            ])
+        self.assertEqual([result.ok for result in results],
+                         [True, True, False])
+        self.assertEqual(results[2].reason, 'no reservation')
+        self.assertIn(self.customer_name,
+                      abstractions.customers_without_reservation())
+
+    def test_rename_hotel(self):
+        """Test that a hotel can be renamed and its file is moved."""
+        abstractions.rename_hotel(self.hotel_name, 'New Hotel')
+        self.assertFalse(os.path.exists(f'{self.hotel_name}.hotel'))
+        renamed_hotel = abstractions.load_from_file(
+            abstractions.Hotel, 'New Hotel.hotel'
+            )
+        self.assertEqual(renamed_hotel.name, 'New Hotel')
+        os.remove('New Hotel.hotel')
+
     def test_create_and_cancel_reservation(self):
         """Test that a reservation can be created and cancelled, and the
         hotel's reservation list is updated."""
@@ -165,6 +520,621 @@ class TestFunctions(unittest.TestCase):
         self.assertNotIn(self.customer_name, hotel.reservations)
 
 
+class TestObjectCache(unittest.TestCase):
+    """Test cases for the object cache in front of load_from_file."""
+
+    def setUp(self):
+        """Save a test hotel and start from an empty cache."""
+        self.hotel_name = 'Test Hotel'
+        abstractions.save_to_file(abstractions.Hotel(self.hotel_name, 10),
+                                  f'{self.hotel_name}.hotel')
+        abstractions.object_cache.clear()
+
+    def tearDown(self):
+        """Remove the test hotel file after each test."""
+        if os.path.exists(f'{self.hotel_name}.hotel'):
+            os.remove(f'{self.hotel_name}.hotel')
+
+    def test_second_load_is_a_hit(self):
+        """Test that an unchanged file is served from the cache."""
+        abstractions.load_from_file(abstractions.Hotel,
+                                    f'{self.hotel_name}.hotel')
+        abstractions.load_from_file(abstractions.Hotel,
+                                    f'{self.hotel_name}.hotel')
+        stats = abstractions.cache_stats()
+        self.assertEqual((stats['misses'], stats['hits']), (1, 1))
+
+    def test_loaded_objects_are_copies(self):
+        """Test that changing a loaded object does not change the cache."""
+        hotel = abstractions.load_from_file(abstractions.Hotel,
+                                            f'{self.hotel_name}.hotel')
+        hotel.rooms = 0
+        hotel = abstractions.load_from_file(abstractions.Hotel,
+                                            f'{self.hotel_name}.hotel')
+        self.assertEqual(hotel.rooms, 10)
+
+    def test_save_updates_cache(self):
+        """Test that saving replaces the cached object."""
+        abstractions.save_to_file(abstractions.Hotel(self.hotel_name, 3),
+                                  f'{self.hotel_name}.hotel')
+        hotel = abstractions.load_from_file(abstractions.Hotel,
+                                            f'{self.hotel_name}.hotel')
+        self.assertEqual(hotel.rooms, 3)
+        self.assertEqual(abstractions.cache_stats()['hits'], 1)
+
+    def test_changed_file_is_reloaded(self):
+        """Test that a file written behind the cache's back is read again."""
+        abstractions.load_from_file(abstractions.Hotel,
+                                    f'{self.hotel_name}.hotel')
+        with open(f'{self.hotel_name}.hotel', 'w', encoding='utf-8') as file:
+            file.write('{"name": "Test Hotel", "rooms": 100, '
+                       '"reservations": []}')
+        hotel = abstractions.load_from_file(abstractions.Hotel,
+                                            f'{self.hotel_name}.hotel')
+        self.assertEqual(hotel.rooms, 100)
+
+    def test_eviction(self):
+        """Test that the least recently used object is evicted."""
+        cache = abstractions.ObjectCache(maxsize=2)
+        for name in ('a', 'b', 'c'):
+            cache.put(name, abstractions.Customer(name), (0, 0))
+        self.assertIsNone(cache.get('a', (0, 0)))
+        self.assertEqual(cache.get('c', (0, 0)).name, 'c')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class TestAvailabilityIndex(unittest.TestCase):
+    """Test cases for the AvailabilityIndex class and the storage backends
+    maintaining it."""
+
+    def setUp(self):
+        """Set up an index of three hotels."""
+        self.index = abstractions.AvailabilityIndex()
+        self.index.update('A', 3)
+        self.index.update('B', 10)
+        self.index.update('C', 0)
+
+    def test_threshold_and_top_k(self):
+        """Test that hotels come most free first above a threshold."""
+        self.assertEqual(self.index.at_least(), ['B', 'A'])
+        self.assertEqual(self.index.at_least(5), ['B'])
+        self.assertEqual(self.index.at_least(0), ['B', 'A', 'C'])
+        self.assertEqual(self.index.at_least(1, limit=1), ['B'])
+
+    def test_update_discard_and_rename(self):
+        """Test that entries move when their counts or names change."""
+        self.index.update('C', 20)
+        self.index.discard('B')
+        self.index.rename('A', 'D')
+        self.assertEqual(self.index.at_least(), ['C', 'D'])
+        self.assertEqual(self.index.free_rooms('D'), 3)
+        self.assertIsNone(self.index.free_rooms('A'))
+
+    def test_storage_keeps_index_current(self):
+        """Test that reservations, modifications, renames and deletions
+        update the index of a file backend."""
+        previous_storage = abstractions.get_storage()
+        with tempfile.TemporaryDirectory() as directory:
+            abstractions.use_storage(abstractions.FileStorage(directory))
+            try:
+                abstractions.create_hotel('Small', 1)
+                abstractions.create_hotel('Large', 5)
+                abstractions.create_customer('Ali')
+                self.assertEqual(abstractions.hotels_with_free_rooms(),
+                                 ['Large', 'Small'])
+                abstractions.create_reservation('Ali', 'Small')
+                self.assertEqual(abstractions.hotels_with_free_rooms(),
+                                 ['Large'])
+                abstractions.modify_hotel('Small', 10)
+                abstractions.rename_hotel('Large', 'Grand')
+                self.assertEqual(abstractions.hotels_with_free_rooms(5),
+                                 ['Small', 'Grand'])
+                abstractions.delete_hotel('Small')
+                self.assertEqual(abstractions.hotels_with_free_rooms(),
+                                 ['Grand'])
+            finally:
+                abstractions.use_storage(previous_storage)
+
+
+class TestDurability(unittest.TestCase):
+    """Test cases for atomic saves and the Fsync and GroupCommit durability
+    modes."""
+
+    def setUp(self):
+        """Use a temporary data directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'Izmir.hotel')
+
+    def tearDown(self):
+        """Remove the data directory."""
+        self.directory.cleanup()
+
+    def test_failed_save_keeps_file(self):
+        """Test that a save failing before the rename leaves the old file
+        and no temporary file behind."""
+        abstractions.save_to_file(abstractions.Hotel('Izmir', 5), self.path)
+        with mock.patch('os.replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                abstractions.save_to_file(abstractions.Hotel('Izmir', 7),
+                                          self.path)
+        self.assertEqual(os.listdir(self.directory.name), ['Izmir.hotel'])
+        abstractions.object_cache.clear()
+        self.assertEqual(
+            abstractions.load_from_file(abstractions.Hotel, self.path).rooms,
+            5)
+
+    def test_crash_during_compaction(self):
+        """Test that a journal left behind by a crash after its snapshot was
+        rewritten is not applied twice."""
+        storage = abstractions.FileStorage(self.directory.name)
+        storage.save_hotel(abstractions.Hotel('Izmir', 10))
+        for i in range(3):
+            hotel = storage.load_hotel('Izmir')
+            hotel.reserve_room(abstractions.Customer(f'c{i}'))
+            storage.save_hotel(hotel)
+        journal = abstractions.journal_path(self.path)
+        with open(journal, encoding='utf-8') as file:
+            records = file.read()
+        abstractions.compact_journal(abstractions.Hotel, self.path)
+        with open(journal, 'w', encoding='utf-8') as file:
+            file.write(records)
+        abstractions.object_cache.clear()
+        hotel = storage.load_hotel('Izmir')
+        self.assertEqual((hotel.rooms, list(hotel.reservations)),
+                         (7, ['c0', 'c1', 'c2']))
+        hotel.reserve_room(abstractions.Customer('c3'))
+        storage.save_hotel(hotel)
+        abstractions.object_cache.clear()
+        self.assertEqual(len(storage.load_hotel('Izmir').reservations), 4)
+
+    def test_fsync(self):
+        """Test that Fsync flushes the file and its directory."""
+        with mock.patch('os.fsync') as fsync:
+            abstractions.save_to_file(abstractions.Hotel('Izmir', 5),
+                                      self.path,
+                                      durability=abstractions.Fsync())
+        self.assertEqual(fsync.call_count, 2)
+        self.assertEqual(
+            abstractions.load_from_file(abstractions.Hotel, self.path).rooms,
+            5)
+
+    def test_group_commit(self):
+        """Test that concurrent saves share flushes and all arrive."""
+        durability = abstractions.GroupCommit(window=0.05)
+        storage = abstractions.FileStorage(self.directory.name,
+                                           durability=durability)
+        with mock.patch('os.fsync') as fsync:
+            threads = [threading.Thread(
+                target=storage.save_hotel,
+                args=(abstractions.Hotel(f'Hotel {i}', i),))
+                for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertLess(fsync.call_count, 16)
+        self.assertEqual(sorted(storage.hotel_names()),
+                         [f'Hotel {i}' for i in range(8)])
+        self.assertEqual(storage.load_hotel('Hotel 7').rooms, 7)
+
+    def test_group_commit_error(self):
+        """Test that a failed flush fails the save."""
+        durability = abstractions.GroupCommit()
+        with mock.patch('os.fsync', side_effect=OSError('I/O error')):
+            with self.assertRaises(OSError):
+                abstractions.save_to_file(abstractions.Hotel('Izmir', 5),
+                                          self.path, durability=durability)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+class TestWaitlist(unittest.TestCase):
+    """Test cases for the waitlist functions on FileStorage."""
+
+    def setUp(self):
+        """Fill the only room of a hotel in a new data directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.FileStorage(self.directory.name)
+        abstractions.use_storage(self.storage)
+        abstractions.create_hotel('Izmir', 1)
+        for name in ('Ali', 'Ayse', 'Veli'):
+            abstractions.create_customer(name)
+        abstractions.set_loyalty_tier('Veli', 2)
+        abstractions.create_reservation('Ali', 'Izmir')
+
+    def tearDown(self):
+        """Remove the data directory."""
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    def test_tickets(self):
+        """Test that customers of a full hotel get tickets by loyalty tier,
+        and the same ticket when they ask again."""
+        self.assertIsNone(abstractions.create_reservation('Ayse', 'Izmir'))
+        ticket = abstractions.create_reservation('Ayse', 'Izmir', wait=True)
+        self.assertEqual(ticket, abstractions.Ticket('Izmir', 1, 1))
+        ticket = abstractions.create_reservation('Veli', 'Izmir', wait=True)
+        self.assertEqual(ticket, abstractions.Ticket('Izmir', 2, 1))
+        self.assertEqual(abstractions.waitlist_position('Izmir', 1), 2)
+        version = self.storage.load_hotel('Izmir').version
+        self.assertEqual(abstractions.create_reservation(
+            'Ayse', 'Izmir', wait=True).number, 1)
+        self.assertEqual(self.storage.load_hotel('Izmir').version, version)
+        self.assertEqual(self.storage.load_customer('Ayse').waiting,
+                         ['Izmir'])
+        self.assertTrue(abstractions.leave_waitlist('Izmir', 1))
+        self.assertEqual(self.storage.load_customer('Ayse').waiting, [])
+        self.assertIsNone(abstractions.waitlist_position('Izmir', 1))
+        self.assertIsNone(abstractions.waitlist_position('Konak', 1))
+
+    def test_drain(self):
+        """Test that cancellations and added rooms give rooms to waiting
+        customers, and the waitlist survives reloading from the files."""
+        abstractions.create_reservation('Ayse', 'Izmir', wait=True)
+        abstractions.create_reservation('Veli', 'Izmir', wait=True)
+        abstractions.object_cache.clear()
+        other = abstractions.FileStorage(self.directory.name)
+        self.assertEqual(len(other.load_hotel('Izmir').waitlist), 2)
+        abstractions.cancel_reservation('Ali', 'Izmir')
+        self.assertEqual(abstractions.hotels_with_reservation('Veli'),
+                         ['Izmir'])
+        self.assertEqual(abstractions.waitlist_position('Izmir', 1), 1)
+        abstractions.modify_hotel('Izmir', 2)
+        hotel = self.storage.load_hotel('Izmir')
+        self.assertEqual(list(hotel.reservations), ['Veli', 'Ayse'])
+        self.assertEqual((hotel.rooms, len(hotel.waitlist)), (0, 0))
+        self.assertEqual(abstractions.hotels_with_reservation('Ayse'),
+                         ['Izmir'])
+
+    def test_batch_cancellation_and_deleted_customers(self):
+        """Test that batch cancellations drain the waitlist and skip
+        customers deleted while waiting."""
+        abstractions.create_reservation('Ayse', 'Izmir', wait=True)
+        abstractions.create_reservation('Veli', 'Izmir', wait=True)
+        abstractions.delete_customer('Veli')
+        results = abstractions.cancel_reservations([('Ali', 'Izmir')])
+        self.assertTrue(results[0].ok)
+        hotel = self.storage.load_hotel('Izmir')
+        self.assertEqual(list(hotel.reservations), ['Ayse'])
+        self.assertEqual(len(hotel.waitlist), 0)
+        self.assertEqual(abstractions.hotels_with_reservation('Ayse'),
+                         ['Izmir'])
+
+
+class TestUnindexedDirectory(unittest.TestCase):
+    """Test cases for FileStorage on a directory written before customer
+    files had an index of their hotels."""
+
+    def setUp(self):
+        """Write a hotel and a customer in the oldest file format."""
+        self.directory = tempfile.TemporaryDirectory()
+        for filename, text in (
+                ('Izmir.hotel', '{"name": "Izmir", "rooms": 4, '
+                                '"reservations": ["Ali"]}'),
+                ('Ali.customer', '{"name": "Ali"}'),
+                ('Ayse.customer', '{"name": "Ayse"}')):
+            with open(os.path.join(self.directory.name, filename), 'w',
+                      encoding='utf-8') as file:
+                file.write(text)
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.FileStorage(self.directory.name)
+        abstractions.use_storage(self.storage)
+
+    def tearDown(self):
+        """Remove the data directory."""
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    def test_lookups_build_the_index(self):
+        """Test that the first lookup indexes the directory once."""
+        self.assertEqual(abstractions.customers_without_reservation(),
+                         ['Ayse'])
+        self.assertEqual(abstractions.hotels_with_reservation('Ali'),
+                         ['Izmir'])
+        self.assertTrue(os.path.exists(os.path.join(
+            self.directory.name, abstractions.FileStorage.INDEXED_NAME)))
+
+    @mock.patch('builtins.print')
+    def test_invalid_customer_file(self, mock_print):
+        """Test that indexing and scans skip a customer file that cannot be
+        loaded."""
+        with open(os.path.join(self.directory.name, 'Can.customer'), 'w',
+                  encoding='utf-8') as file:
+            file.write('{"name": ')
+        self.assertEqual(abstractions.customers_without_reservation(),
+                         ['Ayse'])
+        self.assertEqual(abstractions.hotels_with_reservation('Ali'),
+                         ['Izmir'])
+
+    def test_rename(self):
+        """Test that renaming a customer renames its reservations."""
+        abstractions.modify_customer('Ali', 'Veli')
+        self.assertEqual(list(self.storage.load_hotel('Izmir').reservations),
+                         ['Veli'])
+        self.assertEqual(abstractions.hotels_with_reservation('Veli'),
+                         ['Izmir'])
+
+    def test_rename_waiting_customer(self):
+        """Test that a customer renamed while waiting for a room keeps its
+        place and gets the room."""
+        abstractions.modify_hotel('Izmir', 1)
+        ticket = abstractions.create_reservation('Ayse', 'Izmir', wait=True)
+        self.assertEqual(self.storage.load_customer('Ayse').waiting,
+                         ['Izmir'])
+        abstractions.modify_customer('Ayse', 'Zeynep')
+        self.assertEqual(abstractions.waitlist_position('Izmir',
+                                                        ticket.number), 1)
+        abstractions.cancel_reservation('Ali', 'Izmir')
+        hotel = self.storage.load_hotel('Izmir')
+        self.assertEqual((hotel.rooms, list(hotel.reservations)),
+                         (0, ['Zeynep']))
+        customer = self.storage.load_customer('Zeynep')
+        self.assertEqual((customer.hotels, customer.waiting), (['Izmir'], []))
+
+
+class TestCustomerIds(unittest.TestCase):
+    """Test cases for hotels referring to customers by id in
+    FileStorage."""
+
+    def setUp(self):
+        """Book a room in a hotel of a new data directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.FileStorage(self.directory.name)
+        abstractions.use_storage(self.storage)
+        abstractions.create_hotel('Izmir', 5)
+        abstractions.create_customer('Ali')
+        abstractions.create_reservation('Ali', 'Izmir')
+        abstractions.create_reservation('Ali', 'Izmir', '2024-05-01',
+                                        '2024-05-03')
+
+    def tearDown(self):
+        """Remove the data directory."""
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    def hotel_files(self):
+        """Returns the contents of the hotel file and its journal."""
+        path = self.storage.hotel_path('Izmir')
+        contents = []
+        for filename in (path, abstractions.journal_path(path)):
+            with open(filename, 'rb') as file:
+                contents.append(file.read())
+        return contents
+
+    def test_rename_keeps_hotel_files(self):
+        """Test that renaming a customer only changes its name."""
+        customer_id = self.storage.load_customer('Ali').id
+        self.assertIsNotNone(customer_id)
+        contents = self.hotel_files()
+        self.assertNotIn(b'Ali', b''.join(contents))
+        abstractions.modify_customer('Ali', 'Veli')
+        self.assertEqual(self.hotel_files(), contents)
+        self.assertEqual(self.storage.load_customer('Veli').id, customer_id)
+        hotel = self.storage.load_hotel('Izmir')
+        self.assertEqual(list(hotel.reservations), ['Veli'])
+        self.assertEqual([stay.customer for stay in hotel.stays], ['Veli'])
+        self.assertEqual(abstractions.hotels_with_reservation('Veli'),
+                         ['Izmir'])
+        other = abstractions.FileStorage(self.directory.name)
+        self.assertEqual(list(other.load_hotel('Izmir').reservations),
+                         ['Veli'])
+
+    def test_rename_cached_hotel(self):
+        """Test that renaming a hotel in the object cache indexes its
+        customers by name, leaving the cached copy unchanged."""
+        abstractions.create_customer('Ayse')
+        abstractions.create_reservation('Ayse', 'Izmir')
+        abstractions.object_cache.clear()
+        self.storage.load_hotel('Izmir')
+        cached = self.storage.load_hotel('Izmir')
+        abstractions.rename_hotel('Izmir', 'Konak')
+        self.assertEqual(abstractions.hotels_with_reservation('Ali'),
+                         ['Konak'])
+        self.assertEqual(abstractions.hotels_with_reservation('Ayse'),
+                         ['Konak'])
+        self.assertEqual(list(cached.reservations), ['Ali', 'Ayse'])
+
+    def test_table_created_on_first_write(self):
+        """Test that opening an empty directory leaves it empty, and that
+        its first hotel creates the table of ids."""
+        with tempfile.TemporaryDirectory() as directory:
+            storage = abstractions.FileStorage(directory)
+            self.assertEqual(os.listdir(directory), [])
+            storage.save_hotel(abstractions.Hotel('Izmir', 5))
+            self.assertIn(storage.CUSTOMER_IDS_NAME, os.listdir(directory))
+            other = abstractions.FileStorage(directory)
+            self.assertIsNotNone(other.customer_ids)
+
+    def test_hotel_loaded_before_rename(self):
+        """Test that a hotel loaded before a rename saves the reservations
+        of the old name under the customer's id."""
+        hotel = self.storage.load_hotel('Izmir')
+        abstractions.modify_customer('Ali', 'Veli')
+        hotel.reserve_room(abstractions.Customer('Ali'))
+        self.assertTrue(self.storage.compare_and_save_hotel(hotel))
+        abstractions.create_customer('Ali')
+        self.assertNotEqual(self.storage.load_customer('Ali').id,
+                            self.storage.load_customer('Veli').id)
+        self.assertEqual(
+            list(self.storage.load_hotel('Izmir').reservations),
+            ['Veli', 'Veli'])
+
+    def test_iter_reservations(self):
+        """Test that reservations and stays stream from the file with their
+        customer names, and from the journal once the hotel has one."""
+        abstractions.create_hotel('Konak', 5)
+        for name in ('Ayse', 'Ali', 'Ayse'):
+            abstractions.create_customer(name)
+            abstractions.create_reservation(name, 'Konak')
+        abstractions.create_reservation('Ali', 'Konak', '2024-05-01',
+                                        '2024-05-03')
+        abstractions.compact_journal(abstractions.Hotel,
+                                     self.storage.hotel_path('Konak'))
+        stay = ('Ali', datetime.date(2024, 5, 1), datetime.date(2024, 5, 3),
+                1)
+        for codec in serialization.CODECS.values():
+            self.storage.convert(codec)
+            self.assertEqual(list(self.storage.iter_reservations('Konak')),
+                             [('Ayse', None, None, 2),
+                              ('Ali', None, None, 1), stay])
+        abstractions.cancel_reservation('Ali', 'Konak')
+        self.assertEqual(list(self.storage.iter_reservations('Konak')),
+                         [('Ayse', None, None, 2), stay])
+        self.assertEqual(list(self.storage.iter_reservations('Alsancak')),
+                         [])
+
+    def test_binary_codec(self):
+        """Test that ids are stored by the binary codec."""
+        self.storage.convert(serialization.BINARY)
+        abstractions.object_cache.clear()
+        hotel = self.storage.load_hotel('Izmir')
+        self.assertEqual(list(hotel.reservations), ['Ali'])
+        self.assertEqual([stay.customer for stay in hotel.stays], ['Ali'])
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    """Test cases for running the functions on the SQLite backend."""
+
+    def setUp(self):
+        """Install an in-memory SQLite backend with a hotel and customer."""
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.SQLiteStorage(':memory:')
+        abstractions.use_storage(self.storage)
+        abstractions.create_hotel('Test Hotel', 10)
+        abstractions.create_customer('Test Customer')
+
+    def tearDown(self):
+        """Restore the previous backend and close the database."""
+        abstractions.use_storage(self.previous_storage)
+        self.storage.close()
+
+    def test_create_and_delete_hotel(self):
+        """Test that hotels are stored as rows and can be deleted."""
+        abstractions.create_hotel('New Hotel', 5)
+        self.assertCountEqual(self.storage.hotel_names(),
+                              ['Test Hotel', 'New Hotel'])
+        abstractions.delete_hotel('New Hotel')
+        self.assertEqual(self.storage.hotel_names(), ['Test Hotel'])
+
+    def test_create_and_cancel_reservation(self):
+        """Test that reservations are stored and removed."""
+        abstractions.create_reservation('Test Customer', 'Test Hotel')
+        hotel = self.storage.load_hotel('Test Hotel')
+        self.assertEqual(hotel.rooms, 9)
+        self.assertEqual(hotel.reservations, ['Test Customer'])
+        abstractions.cancel_reservation('Test Customer', 'Test Hotel')
+        hotel = self.storage.load_hotel('Test Hotel')
+        self.assertEqual(hotel.rooms, 10)
+        self.assertEqual(hotel.reservations, [])
+
+    def test_dated_stays(self):
+        """Test that stays keep their dates apart from undated rows."""
+        abstractions.create_reservation('Test Customer', 'Test Hotel')
+        abstractions.create_reservation('Test Customer', 'Test Hotel',
+                                        '2024-05-01', '2024-05-03')
+        hotel = self.storage.load_hotel('Test Hotel')
+        self.assertEqual(hotel.reservations, ['Test Customer'])
+        self.assertEqual(len(hotel.stays), 1)
+        self.assertEqual(abstractions.peak_occupancy(
+            'Test Hotel', '2024-05-02', '2024-05-03'), 2)
+        abstractions.cancel_reservation('Test Customer', 'Test Hotel',
+                                        '2024-05-01', '2024-05-03')
+        hotel = self.storage.load_hotel('Test Hotel')
+        self.assertEqual(hotel.reservations, ['Test Customer'])
+        self.assertEqual(len(hotel.stays), 0)
+
+    def test_availability_index(self):
+        """Test that the index follows reservations and renames."""
+        abstractions.create_hotel('New Hotel', 5)
+        self.assertEqual(abstractions.hotels_with_free_rooms(6),
+                         ['Test Hotel'])
+        for _ in range(6):
+            abstractions.create_reservation('Test Customer', 'Test Hotel')
+        abstractions.rename_hotel('New Hotel', 'Renamed Hotel')
+        self.assertEqual(abstractions.hotels_with_free_rooms(limit=1),
+                         ['Renamed Hotel'])
+        self.assertEqual(self.storage.availability().free_rooms(
+            'Test Hotel'), 4)
+
+    def test_modify_customer(self):
+        """Test that renaming a customer renames its reservations."""
+        abstractions.create_reservation('Test Customer', 'Test Hotel')
+        abstractions.modify_customer('Test Customer', 'New Customer Name')
+        self.assertEqual(self.storage.customer_names(), ['New Customer Name'])
+        hotel = self.storage.load_hotel('Test Hotel')
+        self.assertEqual(hotel.reservations, ['New Customer Name'])
+
+    def test_rename_hotel(self):
+        """Test that renaming a hotel keeps its reservations."""
+        abstractions.create_reservation('Test Customer', 'Test Hotel')
+        abstractions.rename_hotel('Test Hotel', 'New Hotel')
+        self.assertIsNone(self.storage.load_hotel('Test Hotel'))
+        hotel = self.storage.load_hotel('New Hotel')
+        self.assertEqual(hotel.reservations, ['Test Customer'])
+
+    def test_create_reservations(self):
+        """Test that batch reservations load customers in bulk."""
+        abstractions.create_customer('Other Customer')
+        results = abstractions.create_reservations([
+            ('Test Customer', 'Test Hotel'),
+            ('Other Customer', 'Test Hotel'),
+            ('Unknown Customer', 'Test Hotel'),
+            ])
+        self.assertEqual([result.ok for result in results],
+                         [True, True, False])
+        hotel = self.storage.load_hotel('Test Hotel')
+        self.assertEqual(hotel.reservations,
+                         ['Test Customer', 'Other Customer'])
+        self.assertEqual(hotel.rooms, 8)
+
+    def test_stale_hotel_is_not_saved(self):
+        """Test that a hotel row changed after loading is not overwritten."""
+        stale = self.storage.load_hotel('Test Hotel')
+        abstractions.create_reservation('Test Customer', 'Test Hotel')
+        self.assertFalse(self.storage.compare_and_save_hotel(stale))
+        hotel = self.storage.load_hotel('Test Hotel')
+        self.assertEqual((hotel.rooms, hotel.version), (9, 1))
+
+    def test_reservation_index(self):
+        """Test that reservation lookups are answered from the index."""
+        abstractions.create_customer('Other Customer')
+        abstractions.create_reservation('Test Customer', 'Test Hotel')
+        self.assertEqual(
+            abstractions.hotels_with_reservation('Test Customer'),
+            ['Test Hotel']
+            )
+        self.assertEqual(abstractions.customers_without_reservation(),
+                         ['Other Customer'])
+
+    def test_waitlist(self):
+        """Test that waitlist rows and loyalty tiers follow the journal
+        records, renames and freed rooms."""
+        abstractions.modify_hotel('Test Hotel', 1)
+        abstractions.create_customer('Other Customer')
+        abstractions.set_loyalty_tier('Other Customer', 3)
+        abstractions.create_reservation('Test Customer', 'Test Hotel')
+        ticket = abstractions.create_reservation(
+            'Other Customer', 'Test Hotel', '2024-05-01', '2024-05-03',
+            wait=True)
+        self.assertEqual(ticket, abstractions.Ticket('Test Hotel', 1, 1))
+        abstractions.modify_customer('Other Customer', 'Renamed Customer')
+        self.assertEqual(self.storage.load_customer('Renamed Customer').tier,
+                         3)
+        hotel = self.storage.load_hotel('Test Hotel')
+        self.assertEqual([(entry.customer, entry.tier, str(entry.check_in))
+                          for entry in hotel.waitlist],
+                         [('Renamed Customer', 3, '2024-05-01')])
+        abstractions.cancel_reservation('Test Customer', 'Test Hotel')
+        hotel = self.storage.load_hotel('Test Hotel')
+        self.assertEqual([stay.customer for stay in hotel.stays],
+                         ['Renamed Customer'])
+        self.assertEqual((len(hotel.waitlist), hotel.tickets), (0, 1))
+        self.assertEqual(
+            abstractions.hotels_with_reservation('Renamed Customer'),
+            ['Test Hotel'])
+
+
 class TestDisplayFunctions(unittest.TestCase):
     """Test cases for the display functions in the abstractions module."""
 
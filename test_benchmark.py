@@ -0,0 +1,52 @@
+"""
+This module contains unit tests for the benchmark module.
+
+The tests run the benchmark on a tiny synthetic dataset, so they check that
+every operation can still be driven by the harness rather than measuring
+anything.
+
+The tests can be run by executing this module.
+"""
+import unittest
+import abstractions
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test cases for the benchmark module."""
+
+    def test_zipf_weights(self):
+        """Test that Zipf weights are cumulative and favour low ranks."""
+        weights = benchmark.zipf_weights(3, 1.0)
+        self.assertEqual(weights, [1.0, 1.5, 1.5 + 1 / 3])
+
+    def test_run(self):
+        """Test that a run reports every operation and restores the
+        previous storage backend."""
+        storage = abstractions.get_storage()
+        report = benchmark.run(hotels=5, customers=20, reservations=30,
+                               iterations=3, scan_iterations=1,
+                               batch_size=5)
+        self.assertIs(abstractions.get_storage(), storage)
+        self.assertIn('create_reservation', report['results'])
+        self.assertIn('customers_without_reservation', report['results'])
+        self.assertIn('peak_occupancy', report['results'])
+        self.assertIn('leave_waitlist', report['results'])
+        for result in report['results'].values():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_compare(self):
+        """Test that slower operations are reported as regressions."""
+        config = {'hotels': 1}
+        previous = {'config': config,
+                    'results': {'fast': {'p50_ms': 1.0},
+                                'slow': {'p50_ms': 1.0}}}
+        current = {'config': config,
+                   'results': {'fast': {'p50_ms': 1.1},
+                               'slow': {'p50_ms': 3.0}}}
+        _, regressions = benchmark.compare(previous, current, threshold=1.5)
+        self.assertEqual(regressions, ['slow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
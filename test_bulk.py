@@ -0,0 +1,168 @@
+"""
+This module contains unit tests for the bulk module.
+
+The tests import CSV and JSON Lines records into a FileStorage in a
+temporary directory, check which records are rejected, and export the data
+again.
+
+The tests can be run by executing this module.
+"""
+import datetime
+import io
+import os
+import tempfile
+import unittest
+import abstractions
+import bulk
+
+CSV = """type,name,rooms,customer,hotel,check_in,check_out
+hotel,Izmir,2,,,,
+customer,Ali,,,,,
+customer,,,,,,
+reservation,,,Ali,Izmir,,
+reservation,,,Ali,Izmir,2024-05-01,2024-05-03
+reservation,,,Ali,Izmir,,
+reservation,,,Ayse,Izmir,,
+hotel,Konak,many,,,,
+"""
+
+
+class TestBulk(unittest.TestCase):
+    """Test cases for the import and export functions of the bulk
+    module."""
+
+    def setUp(self):
+        """Use an empty data directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.FileStorage(self.directory.name)
+        abstractions.use_storage(self.storage)
+
+    def tearDown(self):
+        """Remove the data directory."""
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    def test_import_csv(self):
+        """Test valid records are stored and the others rejected with their
+        line number."""
+        rejections = []
+        counts = bulk.import_records(
+            bulk.read_records(io.StringIO(CSV), 'csv'), batch_size=2,
+            on_reject=rejections.append)
+        self.assertEqual(counts, {'hotel': 1, 'customer': 1,
+                                  'reservation': 2, 'rejected': 4})
+        self.assertEqual(sorted(rejections), [
+            (4, 'Missing name of customer'),
+            (7, 'no rooms available'),
+            (8, 'unknown customer'),
+            (9, 'Rooms must be an integer')])
+        hotel = self.storage.load_hotel('Izmir')
+        self.assertEqual(list(hotel.reservations), ['Ali'])
+        self.assertEqual(list(hotel.stays), [abstractions.Stay(
+            'Ali', datetime.date(2024, 5, 1), datetime.date(2024, 5, 3))])
+        self.assertEqual(abstractions.hotels_with_reservation('Ali'),
+                         ['Izmir'])
+
+    def test_import_jsonl(self):
+        """Test JSON Lines records are validated like CSV records."""
+        lines = ['{"type": "hotel", "name": "Izmir", "rooms": 1}', '',
+                 '{"type": "customer", "name": "Ali"}', 'not json',
+                 '["a list"]',
+                 '{"type": "reservation", "customer": "Ali", '
+                 '"hotel": "Izmir", "check_in": "2024-05-03", '
+                 '"check_out": "2024-05-01"}',
+                 '{"type": "guest", "name": "Ali"}']
+        rejections = []
+        counts = bulk.import_records(
+            bulk.read_records(io.StringIO('\n'.join(lines)), 'jsonl'),
+            on_reject=rejections.append)
+        self.assertEqual(counts, {'hotel': 1, 'customer': 1, 'rejected': 4})
+        self.assertEqual([line for line, _ in rejections], [4, 5, 6, 7])
+        self.assertEqual(rejections[-1].reason,
+                         "Unknown record type 'guest'")
+
+    def test_round_trip(self):
+        """Test an exported dataset imports into an equal one."""
+        abstractions.create_hotel('Izmir', 3)
+        abstractions.create_hotel('Konak', 1)
+        for name in ('Ali', 'Ayse', 'Can'):
+            abstractions.create_customer(name)
+        abstractions.create_reservation('Ali', 'Izmir')
+        abstractions.create_reservation('Ali', 'Izmir')
+        abstractions.create_reservation('Ayse', 'Izmir', '2024-05-01',
+                                        '2024-05-04')
+        abstractions.create_reservation('Ayse', 'Konak')
+        for fmt in bulk.FORMATS:
+            with self.subTest(fmt=fmt):
+                path = os.path.join(self.directory.name, f'export.{fmt}')
+                self.assertEqual(bulk.export_file(path), 9)
+                with tempfile.TemporaryDirectory() as directory:
+                    abstractions.use_storage(
+                        abstractions.FileStorage(directory))
+                    try:
+                        counts = bulk.import_file(path)
+                        self.assertCountEqual(list(bulk.export_records()),
+                                              self.export(self.storage))
+                    finally:
+                        abstractions.use_storage(self.storage)
+                self.assertEqual(counts, {'hotel': 2, 'customer': 3,
+                                          'reservation': 4})
+
+    def test_round_trip_waitlist(self):
+        """Test an exported dataset keeps loyalty tiers, waitlists and their
+        ticket numbers."""
+        abstractions.create_hotel('Konak', 1)
+        for name in ('Ali', 'Ayse', 'Can'):
+            abstractions.create_customer(name)
+        abstractions.set_loyalty_tier('Can', 2)
+        abstractions.create_reservation('Ali', 'Konak')
+        abstractions.create_reservation('Ayse', 'Konak', wait=True)
+        ticket = abstractions.create_reservation('Can', 'Konak', '2024-05-01',
+                                                 '2024-05-03', wait=True)
+        abstractions.create_reservation('Ali', 'Konak', wait=True)
+        abstractions.leave_waitlist('Konak', 3)
+        records = list(bulk.export_records())
+        self.assertIn({'type': 'customer', 'name': 'Can', 'tier': 2},
+                      records)
+        self.assertIn({'type': 'waiting', 'customer': 'Can', 'hotel': 'Konak',
+                       'ticket': 2, 'tier': 2, 'check_in': '2024-05-01',
+                       'check_out': '2024-05-03'}, records)
+        path = os.path.join(self.directory.name, 'export.csv')
+        bulk.export_file(path)
+        with tempfile.TemporaryDirectory() as directory:
+            abstractions.use_storage(abstractions.FileStorage(directory))
+            try:
+                counts = bulk.import_file(path)
+                self.assertCountEqual(list(bulk.export_records()), records)
+                self.assertEqual(
+                    abstractions.waitlist_position('Konak', ticket.number), 1)
+                self.assertEqual(abstractions.create_reservation(
+                    'Ali', 'Konak', wait=True).number, 4)
+                abstractions.modify_customer('Ayse', 'Aysel')
+                self.assertEqual(abstractions.waitlist_position('Konak', 1),
+                                 2)
+            finally:
+                abstractions.use_storage(self.storage)
+        self.assertEqual(counts, {'hotel': 1, 'customer': 3,
+                                  'reservation': 1, 'waiting': 2})
+
+    def export(self, storage):
+        """Returns the exported records of a storage backend."""
+        previous = abstractions.get_storage()
+        abstractions.use_storage(storage)
+        try:
+            return list(bulk.export_records())
+        finally:
+            abstractions.use_storage(previous)
+
+    def test_file_format(self):
+        """Test formats are recognized from file extensions."""
+        self.assertEqual(bulk.file_format('bookings.CSV'), 'csv')
+        self.assertEqual(bulk.file_format('bookings.ndjson'), 'jsonl')
+        with self.assertRaises(ValueError):
+            bulk.file_format('bookings.xlsx')
+
+
+if __name__ == '__main__':
+    unittest.main()
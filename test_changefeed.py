@@ -0,0 +1,106 @@
+"""
+This module contains unit tests for the changefeed module.
+
+The tests change a FileStorage in a temporary directory through the
+abstractions module and check the events a ChangeFeed reports, once with
+the inotify watcher where it is available and once with the polling one.
+
+The tests can be run by executing this module.
+"""
+import tempfile
+import time
+import unittest
+import abstractions
+import changefeed as c
+
+
+class TestChangeFeed(unittest.TestCase):
+    """Test cases for the ChangeFeed class in the changefeed module."""
+
+    polling = True
+
+    def setUp(self):
+        """Create a hotel and a customer, then start a feed."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        abstractions.use_storage(
+            abstractions.FileStorage(self.directory.name))
+        abstractions.create_hotel('Izmir', 3)
+        abstractions.create_customer('Ali')
+        self.feed = c.ChangeFeed(self.directory.name, interval=0.01,
+                                 polling=self.polling)
+
+    def tearDown(self):
+        """Stop the feed and remove the directory."""
+        self.feed.close()
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    def events(self, expected):
+        """Returns the events reported until as many as expected arrived
+        or a second passed."""
+        events = []
+        deadline = time.monotonic() + 1
+        while len(events) < expected and time.monotonic() < deadline:
+            events += self.feed.poll(timeout=0.05)
+        return events
+
+    def test_reservations(self):
+        """Test bookings and cancellations are reported per customer."""
+        abstractions.create_customer('Ayse')
+        abstractions.create_reservation('Ali', 'Izmir')
+        abstractions.create_reservation('Ali', 'Izmir')
+        self.assertCountEqual(self.events(3), [
+            c.Event(c.CUSTOMER_CREATED, customer='Ayse'),
+            c.Event(c.RESERVATION_ADDED, 'Izmir', 'Ali', 2),
+            c.Event(c.CUSTOMER_MODIFIED, customer='Ali')])
+        abstractions.cancel_reservation('Ali', 'Izmir')
+        self.assertCountEqual(self.events(2), [
+            c.Event(c.RESERVATION_REMOVED, 'Izmir', 'Ali'),
+            c.Event(c.CUSTOMER_MODIFIED, customer='Ali')])
+
+    def test_hotels(self):
+        """Test created, modified, renamed and deleted hotels."""
+        abstractions.create_hotel('Konak', 2)
+        abstractions.modify_hotel('Izmir', 10)
+        self.assertCountEqual(self.events(2), [
+            c.Event(c.HOTEL_CREATED, 'Konak'),
+            c.Event(c.HOTEL_MODIFIED, 'Izmir')])
+        abstractions.rename_hotel('Konak', 'Karsiyaka')
+        abstractions.delete_customer('Ali')
+        self.assertCountEqual(self.events(3), [
+            c.Event(c.HOTEL_CREATED, 'Karsiyaka'),
+            c.Event(c.HOTEL_DELETED, 'Konak'),
+            c.Event(c.CUSTOMER_DELETED, customer='Ali')])
+
+    def test_customer_renamed(self):
+        """Test a renamed customer takes over its reservations."""
+        abstractions.create_reservation('Ali', 'Izmir')
+        self.events(2)
+        abstractions.modify_customer('Ali', 'Veli')
+        self.assertCountEqual(self.events(4), [
+            c.Event(c.CUSTOMER_CREATED, customer='Veli'),
+            c.Event(c.CUSTOMER_DELETED, customer='Ali'),
+            c.Event(c.RESERVATION_REMOVED, 'Izmir', 'Ali'),
+            c.Event(c.RESERVATION_ADDED, 'Izmir', 'Veli')])
+
+    def test_no_changes(self):
+        """Test an unchanged directory reports nothing."""
+        self.assertEqual(self.feed.poll(timeout=0.05), [])
+
+
+class TestInotifyChangeFeed(TestChangeFeed):
+    """Test cases for a ChangeFeed using the inotify watcher."""
+
+    polling = False
+
+    def setUp(self):
+        """Skip the tests where inotify is not available."""
+        super().setUp()
+        if not isinstance(self.feed.watcher, c.InotifyWatcher):
+            self.tearDown()
+            self.skipTest('inotify is not available')
+
+
+if __name__ == '__main__':
+    unittest.main()
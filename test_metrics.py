@@ -0,0 +1,76 @@
+"""
+This module contains unit tests for the metrics module.
+
+The tests drive the abstractions module against a FileStorage in a temporary
+directory and check what the instrumentation recorded. Metrics are reset and
+disabled again after each test.
+
+The tests can be run by executing this module.
+"""
+import json
+import tempfile
+import unittest
+import abstractions
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """Test cases for the metrics module."""
+
+    def setUp(self):
+        """Use an empty data directory and start from empty metrics."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        abstractions.use_storage(
+            abstractions.FileStorage(self.directory.name))
+        metrics.reset()
+
+    def tearDown(self):
+        """Disable metrics and remove the data directory."""
+        metrics.disable()
+        metrics.reset()
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    def test_disabled_records_nothing(self):
+        """Test that nothing is recorded while metrics are disabled."""
+        abstractions.create_hotel('Test Hotel', 10)
+        self.assertEqual(metrics.snapshot(),
+                         {'counters': {}, 'histograms': {}})
+
+    def test_operations_and_io_are_recorded(self):
+        """Test that operation calls, file I/O and JSON parsing are
+        recorded."""
+        metrics.enable()
+        abstractions.create_hotel('Test Hotel', 10)
+        abstractions.create_customer('Test Customer')
+        abstractions.object_cache.clear()
+        abstractions.create_reservation('Test Customer', 'Test Hotel')
+        data = metrics.snapshot()
+        operations = data['histograms']['operation_seconds']
+        self.assertEqual(operations['create_hotel']['count'], 1)
+        self.assertEqual(operations['create_reservation']['count'], 1)
+        self.assertEqual(operations['create_reservation']['buckets']['+Inf'],
+                         1)
+        self.assertGreater(data['counters']['bytes_written_total'][''], 0)
+        self.assertGreater(data['counters']['bytes_read_total'][''], 0)
+        self.assertGreater(data['counters']['files_opened_total'][''], 0)
+        self.assertGreater(data['histograms']['json_parse_seconds']['']
+                           ['count'], 0)
+        self.assertEqual(json.loads(metrics.to_json()), data)
+
+    def test_prometheus_format(self):
+        """Test that metrics are exported in the Prometheus text format."""
+        metrics.enable()
+        abstractions.create_hotel('Test Hotel', 10)
+        text = metrics.to_prometheus()
+        self.assertIn('# TYPE hotel_operation_seconds histogram', text)
+        self.assertIn('hotel_operation_seconds_count'
+                      '{operation="create_hotel"} 1', text)
+        self.assertIn('hotel_operation_seconds_bucket'
+                      '{operation="create_hotel",le="+Inf"} 1', text)
+        self.assertIn('# TYPE hotel_bytes_written_total counter', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
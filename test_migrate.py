@@ -0,0 +1,115 @@
+"""
+This module contains unit tests for the migrate module.
+
+The tests convert a temporary data directory between codecs, and to
+customer ids, and check that the abstractions module reads the converted
+files.
+
+The tests can be run by executing this module.
+"""
+import json
+import os
+import tempfile
+import unittest
+import abstractions
+import migrate
+import serialization
+
+
+class TestMigrate(unittest.TestCase):
+    """Test cases for the migrate function."""
+
+    def setUp(self):
+        """Create a journaled hotel and a customer in a temporary
+        directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.FileStorage(self.directory.name)
+        abstractions.use_storage(self.storage)
+        abstractions.create_hotel('Izmir', 5)
+        abstractions.create_customer('Ali')
+        abstractions.create_reservation('Ali', 'Izmir')
+
+    def tearDown(self):
+        """Remove the data directory."""
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    def test_migrate_to_binary_and_back(self):
+        """Test that files are converted once and stay readable."""
+        path = self.storage.hotel_path('Izmir')
+        self.assertEqual(migrate.migrate(self.directory.name,
+                                         serialization.BINARY), 2)
+        self.assertIs(abstractions.file_codec(path), serialization.BINARY)
+        self.assertFalse(os.path.exists(abstractions.journal_path(path)))
+        self.assertEqual(migrate.migrate(self.directory.name,
+                                         serialization.BINARY), 0)
+        abstractions.object_cache.clear()
+        self.assertEqual(self.storage.load_hotel('Izmir').reservations,
+                         ['Ali'])
+        self.assertEqual(abstractions.hotels_with_reservation('Ali'),
+                         ['Izmir'])
+
+        # Later snapshots keep the binary format
+        abstractions.modify_hotel('Izmir', 10)
+        abstractions.compact_journal(abstractions.Hotel, path)
+        self.assertIs(abstractions.file_codec(path), serialization.BINARY)
+
+        self.assertEqual(migrate.migrate(self.directory.name,
+                                         serialization.JSON), 2)
+        abstractions.object_cache.clear()
+        hotel = self.storage.load_hotel('Izmir')
+        self.assertEqual((hotel.rooms, hotel.reservations), (9, ['Ali']))
+
+
+class TestMigrateCustomerIds(unittest.TestCase):
+    """Test cases for migrating to customer ids."""
+
+    def setUp(self):
+        """Write a hotel and a customer referring to each other by name, as
+        before customers had ids."""
+        self.directory = tempfile.TemporaryDirectory()
+        files = {'Izmir.hotel': '{"name": "Izmir", "rooms": 4, '
+                                '"reservations": ["Ali", "Ali"], "stays": '
+                                '[["Ali", "2024-05-01", "2024-05-03"]]}',
+                 'Ali.customer': '{"name": "Ali", "hotels": '
+                                 '["Izmir", "Izmir", "Izmir"]}'}
+        for name, text in files.items():
+            with open(os.path.join(self.directory.name, name), 'w',
+                      encoding='utf-8') as file:
+                file.write(text)
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.FileStorage(self.directory.name)
+        abstractions.use_storage(self.storage)
+
+    def tearDown(self):
+        """Remove the data directory."""
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    def test_migrate_customer_ids(self):
+        """Test hotels refer to ids after the migration, and renames leave
+        them alone."""
+        self.assertIsNone(self.storage.customer_ids)
+        self.assertEqual(migrate.migrate(self.directory.name,
+                                         customer_ids=True), 2)
+        self.assertEqual(migrate.migrate(self.directory.name,
+                                         customer_ids=True), 0)
+        customer_id = self.storage.load_customer('Ali').id
+        path = self.storage.hotel_path('Izmir')
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+        self.assertEqual(data['reservations'], [customer_id] * 2)
+        self.assertEqual(data['stays'][0][0], customer_id)
+
+        abstractions.modify_customer('Ali', 'Veli')
+        with open(path, encoding='utf-8') as file:
+            self.assertEqual(json.load(file), data)
+        hotel = self.storage.load_hotel('Izmir')
+        self.assertEqual(list(hotel.reservations), ['Veli', 'Veli'])
+        self.assertEqual(abstractions.hotels_with_reservation('Veli'),
+                         ['Izmir'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+"""
+This module contains unit tests for the model module.
+
+Each test fills a FileStorage in a temporary directory through the
+abstractions module and checks that a DatasetModel loads it and follows
+later changes.
+
+The tests can be run by executing this module.
+"""
+import tempfile
+import threading
+import unittest
+import abstractions
+import changefeed
+import model
+
+
+class TestDatasetModel(unittest.TestCase):
+    """Test cases for the DatasetModel class in the model module."""
+
+    def setUp(self):
+        """Create a small dataset and load it into a model."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        abstractions.use_storage(
+            abstractions.FileStorage(self.directory.name))
+        abstractions.create_hotel('Izmir', 2)
+        abstractions.create_hotel('Alsancak', 1)
+        abstractions.create_customer('Ali')
+        abstractions.create_customer('Ayse')
+        abstractions.create_reservation('Ali', 'Alsancak')
+        self.model = model.DatasetModel()
+
+    def tearDown(self):
+        """Remove the data directory."""
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    def test_load(self):
+        """Test loading reports progress and answers the queries."""
+        progress = []
+        self.assertTrue(self.model.load(
+            progress=lambda done, total: progress.append((done, total))))
+        self.assertTrue(self.model.loaded)
+        self.assertEqual(progress[-1], (4, 4))
+        self.assertEqual(sorted(self.model.hotel_names()),
+                         ['Alsancak', 'Izmir'])
+        self.assertEqual(self.model.hotels_with_available_rooms(), ['Izmir'])
+        self.assertEqual(self.model.customers_without_reservation(),
+                         ['Ayse'])
+        self.assertEqual(self.model.hotels_with_reservation('Ali'),
+                         ['Alsancak'])
+
+    def test_load_cancelled(self):
+        """Test a cancelled load leaves the model unloaded."""
+        cancelled = threading.Event()
+        cancelled.set()
+        self.assertFalse(self.model.load(cancelled=cancelled))
+        self.assertFalse(self.model.loaded)
+        self.assertEqual(self.model.hotel_names(), [])
+
+    def test_reservations(self):
+        """Test reservations update the hotel and the customer."""
+        self.model.load()
+        self.model.create_reservation('Ayse', 'Izmir')
+        self.assertEqual(self.model.hotel('Izmir').rooms, 1)
+        self.assertEqual(self.model.customers_without_reservation(), [])
+        self.model.cancel_reservation('Ali', 'Alsancak')
+        self.assertEqual(self.model.customers_without_reservation(), ['Ali'])
+        self.assertEqual(self.model.hotel('Alsancak').rooms, 1)
+
+    def test_waiting_customers_served(self):
+        """Test rooms given to waiting customers update those customers."""
+        abstractions.create_customer('Can')
+        abstractions.create_reservation('Ayse', 'Alsancak', wait=True)
+        abstractions.create_reservation('Can', 'Alsancak', wait=True)
+        self.model.load()
+        self.model.cancel_reservation('Ali', 'Alsancak')
+        self.assertEqual(self.model.hotels_with_reservation('Ayse'),
+                         ['Alsancak'])
+        self.model.modify_hotel('Alsancak', 2)
+        self.assertEqual(self.model.hotels_with_reservation('Can'),
+                         ['Alsancak'])
+        self.assertEqual(self.model.customers_without_reservation(),
+                         ['Ali'])
+
+    def test_modify_customer(self):
+        """Test renaming a customer updates the hotels it holds rooms in."""
+        self.model.load()
+        self.model.modify_customer('Ali', 'Veli')
+        self.assertIsNone(self.model.customer('Ali'))
+        self.assertEqual(self.model.hotels_with_reservation('Veli'),
+                         ['Alsancak'])
+        self.assertEqual(
+            list(self.model.hotel('Alsancak').reservations), ['Veli'])
+
+    def test_delete_hotel(self):
+        """Test deleting a hotel updates the customers holding rooms in it."""
+        self.model.load()
+        self.model.delete_hotel('Alsancak')
+        self.assertEqual(self.model.hotel_names(), ['Izmir'])
+        self.assertEqual(sorted(self.model.customers_without_reservation()),
+                         ['Ali', 'Ayse'])
+
+    def test_create_and_rename_hotel(self):
+        """Test created and renamed hotels appear under their new names."""
+        self.model.load()
+        self.model.create_hotel('Konak', 3)
+        self.model.rename_hotel('Alsancak', 'Karsiyaka')
+        self.assertEqual(sorted(self.model.hotel_names()),
+                         ['Izmir', 'Karsiyaka', 'Konak'])
+        self.assertEqual(self.model.hotels_with_reservation('Ali'),
+                         ['Karsiyaka'])
+
+    def test_apply(self):
+        """Test change events reload only the entities they name."""
+        self.model.load()
+        storage = abstractions.get_storage()
+        hotel = storage.load_hotel('Izmir')
+        hotel.rooms = 9
+        storage.save_hotel(hotel)
+        abstractions.create_customer('Can')
+        abstractions.create_hotel('Konak', 1)
+        self.assertEqual(
+            self.model.apply([changefeed.Event(changefeed.HOTEL_MODIFIED,
+                                               'Izmir'),
+                              changefeed.Event(changefeed.CUSTOMER_CREATED,
+                                               customer='Can')]),
+            ({'Izmir'}, {'Can'}))
+        self.assertEqual(self.model.hotel('Izmir').rooms, 9)
+        self.assertIsNotNone(self.model.customer('Can'))
+        self.assertIsNone(self.model.hotel('Konak'))
+
+
+class TestPaging(unittest.TestCase):
+    """Test cases for the search and paging helpers of the model module."""
+
+    def test_matching(self):
+        """Test matching ignores case and sorts the names."""
+        names = ['Konak', 'Izmir', 'Alsancak', 'Karsiyaka']
+        self.assertEqual(model.matching(names, 'AK'),
+                         ['Alsancak', 'Karsiyaka', 'Konak'])
+        self.assertEqual(model.matching(names, ''), sorted(names))
+        self.assertEqual(model.matching(names, 'Ankara'), [])
+
+    def test_paginate(self):
+        """Test pages are sliced and out of range pages are clamped."""
+        items = list(range(25))
+        self.assertEqual(model.paginate(items, 0, 10),
+                         (list(range(10)), 0, 3))
+        self.assertEqual(model.paginate(items, 2, 10),
+                         (list(range(20, 25)), 2, 3))
+        self.assertEqual(model.paginate(items, 7, 10),
+                         (list(range(20, 25)), 2, 3))
+        self.assertEqual(model.paginate([], 1, 10), ([], 0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
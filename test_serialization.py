@@ -0,0 +1,160 @@
+"""
+This module contains unit tests for the serialization module.
+
+The codecs are tested on the data of hotels and customers from the
+abstractions module, including reservation-heavy hotels, dated stays and
+names outside ASCII.
+
+The tests can be run by executing this module.
+"""
+import io
+import unittest
+import abstractions
+import serialization
+
+
+class TestCodecs(unittest.TestCase):
+    """Test cases for the JSON and binary codecs."""
+
+    def setUp(self):
+        """Set up a hotel with reservations and stays, and a customer."""
+        self.hotel = abstractions.Hotel('Otel Çeşme', 10)
+        for name in ['Ali', 'Ayşe', 'Ali', 'Veli']:
+            self.hotel.reserve_room(abstractions.Customer(name))
+        self.hotel.reserve_room(abstractions.Customer('Veli'),
+                                '2024-05-01', '2024-05-03')
+        self.hotel.reserve_room(abstractions.Customer('Ayşe'),
+                                '2024-06-01', '2024-06-02')
+        self.hotel.version = 3
+        self.customer = abstractions.Customer('Ayşe')
+        self.customer.hotels = ['Otel Çeşme', 'Otel Çeşme', 'Izmir']
+
+    def assertRoundTrip(self, codec):
+        """Assert that the hotel and customer survive a codec."""
+        hotel = abstractions.Hotel.from_data(
+            codec.decode(codec.encode(self.hotel.to_data())))
+        self.assertEqual(hotel.name, self.hotel.name)
+        self.assertEqual(hotel.rooms, 6)
+        self.assertEqual(hotel.reservations, self.hotel.reservations)
+        self.assertEqual(list(hotel.stays), list(self.hotel.stays))
+        self.assertEqual(hotel.version, 3)
+        customer = abstractions.Customer.from_data(
+            codec.decode(codec.encode(self.customer.to_data())))
+        self.assertEqual(customer.hotels, self.customer.hotels)
+
+    def test_json_round_trip(self):
+        """Test that the JSON codec keeps every field."""
+        self.assertRoundTrip(serialization.JSON)
+
+    def test_binary_round_trip(self):
+        """Test that the binary codec keeps every field."""
+        self.assertRoundTrip(serialization.BINARY)
+
+    def test_json_matches_to_json(self):
+        """Test that the JSON codec writes what to_json returns."""
+        self.assertEqual(
+            serialization.JSON.encode(self.hotel.to_data()),
+            self.hotel.to_json().encode('utf-8'))
+
+    def test_deterministic(self):
+        """Test that equal data encodes to equal bytes."""
+        copy = abstractions.Hotel.from_json(self.hotel.to_json())
+        for codec in serialization.CODECS.values():
+            self.assertEqual(codec.encode(copy.to_data()),
+                             codec.encode(self.hotel.to_data()))
+
+    def test_detect(self):
+        """Test that the format of encoded data is recognized."""
+        data = self.hotel.to_data()
+        for codec in serialization.CODECS.values():
+            self.assertIs(serialization.detect(codec.encode(data)), codec)
+
+    def test_binary_is_smaller(self):
+        """Test that a hotel with many reservations encodes compactly."""
+        hotel = abstractions.Hotel('Big Hotel', 0)
+        hotel.reservations = [f'customer-{i % 500}' for i in range(5000)]
+        data = hotel.to_data()
+        self.assertLess(len(serialization.BINARY.encode(data)),
+                        len(serialization.JSON.encode(data)) / 4)
+
+    def test_corrupt_binary(self):
+        """Test that truncated binary data raises ValueError."""
+        raw = serialization.BINARY.encode(self.hotel.to_data())
+        with self.assertRaises(ValueError):
+            serialization.BINARY.decode(raw[:-3])
+
+    def test_customer_ids(self):
+        """Test that hotels referring to customers by id survive both
+        codecs."""
+        self.hotel.map_customers(len)
+        data = self.hotel.to_data()
+        for codec in serialization.CODECS.values():
+            hotel = abstractions.Hotel.from_data(
+                codec.decode(codec.encode(data)))
+            self.assertEqual(list(hotel.reservations), [3, 3, 4, 4])
+            self.assertEqual([stay.customer for stay in hotel.stays], [4, 4])
+
+    def test_nul_in_names(self):
+        """Test that names with NUL characters are refused."""
+        self.hotel.reservations = ['A\0B']
+        with self.assertRaises(ValueError):
+            serialization.BINARY.encode(self.hotel.to_data())
+
+    def test_decode_header(self):
+        """Test that headers hold the integer and string fields and name the
+        lists."""
+        data = self.hotel.to_data()
+        for codec in serialization.CODECS.values():
+            header = codec.decode_header(codec.encode(data))
+            self.assertEqual(header.fields, {'name': 'Otel Çeşme',
+                                             'rooms': 6, 'version': 3})
+            self.assertEqual(header.lists, ('reservations', 'stays'))
+        for codec in serialization.CODECS.values():
+            raw = codec.encode(data)
+            self.assertIsNone(codec.decode_header(raw).data)
+            with self.assertRaises(ValueError):
+                codec.decode_header(raw[:-3])
+
+    def test_decode_old_json_header(self):
+        """Test that JSON data with fields after its lists is parsed
+        whole."""
+        data = self.hotel.to_data()
+        data['version'] = data.pop('version')
+        header = serialization.JSON.decode_header(
+            serialization.JSON.encode(data))
+        self.assertEqual(header.fields, {'name': 'Otel Çeşme', 'rooms': 6,
+                                         'version': 3})
+        self.assertEqual(header.lists, ('reservations', 'stays'))
+        self.assertEqual(header.data['stays'], data['stays'])
+
+    def test_iter_runs(self):
+        """Test that lists stream from files in chunks of any size."""
+        self.hotel.reservations = [f'Müşteri {i % 7}' for i in range(40)]
+        for codec in serialization.CODECS.values():
+            raw = codec.encode(self.hotel.to_data())
+            for chunk_size in (1, 5, 64, serialization.CHUNK_SIZE):
+                self.assertEqual(
+                    list(serialization.iter_runs(io.BytesIO(raw),
+                                                 'reservations',
+                                                 chunk_size)),
+                    list(self.hotel.reservations.items()))
+                self.assertEqual(
+                    list(serialization.iter_runs(io.BytesIO(raw), 'stays',
+                                                 chunk_size)),
+                    [(('Veli', '2024-05-01', '2024-05-03'), 1),
+                     (('Ayşe', '2024-06-01', '2024-06-02'), 1)])
+            with self.assertRaises(serialization.MissingFieldError):
+                list(serialization.iter_runs(io.BytesIO(raw), 'hotels'))
+        self.hotel.map_customers(len)
+        for codec in serialization.CODECS.values():
+            raw = codec.encode(self.hotel.to_data())
+            self.assertEqual(list(serialization.iter_runs(
+                io.BytesIO(raw), 'reservations', 3)), [(9, 40)])
+            self.assertEqual(list(serialization.iter_runs(
+                io.BytesIO(raw), 'stays', 3)),
+                [((4, '2024-05-01', '2024-05-03'), 1),
+                 ((4, '2024-06-01', '2024-06-02'), 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+This module contains unit tests for the server module.
+
+Each test starts a ReservationServer on a free localhost port, backed by a
+FileStorage in a temporary directory, and drives it with a minimal HTTP/1.1
+client built on asyncio streams.
+
+The tests can be run by executing this module.
+"""
+import asyncio
+import json
+import tempfile
+import unittest
+from urllib.parse import quote
+import abstractions
+import server
+
+
+class TestReservationServer(unittest.IsolatedAsyncioTestCase):
+    """Test cases for the ReservationServer class in the server module."""
+
+    async def asyncSetUp(self):
+        """Start a server on an empty data directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        abstractions.use_storage(
+            abstractions.FileStorage(self.directory.name))
+        self.server = server.ReservationServer(port=0)
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        """Stop the server and remove the data directory."""
+        await self.server.close()
+        abstractions.use_storage(self.previous_storage)
+        self.directory.cleanup()
+
+    async def request(self, method, path, payload=None):
+        """Send one request on a new connection and return the status and
+        decoded JSON response."""
+        reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                       self.server.port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b''):
+            key, _, value = line.decode().partition(':')
+            headers[key.strip().lower()] = value.strip()
+        data = await reader.readexactly(int(headers['content-length']))
+        writer.close()
+        return int(status_line.split()[1]), json.loads(data)
+
+    async def test_hotel_and_customer_routes(self):
+        """Test that hotels and customers can be created, read, modified
+        and deleted."""
+        self.assertEqual((await self.request(
+            'POST', '/hotels', {'name': 'Test Hotel', 'rooms': 10}))[0], 201)
+        self.assertEqual((await self.request(
+            'POST', '/customers', {'name': 'Test Customer'}))[0], 201)
+        self.assertEqual(await self.request('GET', '/hotels'),
+                         (200, ['Test Hotel']))
+        status, hotel = await self.request(
+            'PATCH', f'/hotels/{quote("Test Hotel")}', {'rooms': 5})
+        self.assertEqual((status, hotel['rooms']), (200, 5))
+        status, customer = await self.request(
+            'PATCH', f'/customers/{quote("Test Customer")}',
+            {'name': 'New Customer'})
+        self.assertEqual((status, customer['name']), (200, 'New Customer'))
+        self.assertEqual((await self.request(
+            'DELETE', f'/hotels/{quote("Test Hotel")}'))[0], 200)
+        self.assertEqual((await self.request(
+            'GET', f'/hotels/{quote("Test Hotel")}'))[0], 404)
+
+    async def test_reservation_failures(self):
+        """Test that failed reservations are answered with an error
+        status and reason."""
+        await self.request('POST', '/hotels', {'name': 'Full', 'rooms': 0})
+        await self.request('POST', '/customers', {'name': 'Test Customer'})
+        status, result = await self.request(
+            'POST', '/reservations',
+            {'customer': 'Test Customer', 'hotel': 'Full'})
+        self.assertEqual((status, result['reason']),
+                         (409, 'no rooms available'))
+        status, result = await self.request(
+            'POST', '/reservations',
+            {'customer': 'Unknown', 'hotel': 'Full'})
+        self.assertEqual((status, result['reason']), (404, 'unknown customer'))
+        self.assertEqual((await self.request('PUT', '/hotels'))[0], 405)
+
+    async def test_invalid_names(self):
+        """Test that names that would leave the data directory are
+        refused."""
+        for name in ('../../evil', '.', '', 'a\0b'):
+            status, _ = await self.request('POST', '/hotels',
+                                           {'name': name, 'rooms': 1})
+            self.assertEqual(status, 400)
+        self.assertEqual((await self.request(
+            'GET', f'/customers/{quote("../x", safe="")}'))[0], 400)
+        self.assertEqual(abstractions.get_storage().hotel_names(), [])
+
+    async def test_malformed_requests(self):
+        """Test that malformed request lines and lengths are answered with
+        400."""
+        for request in (b'GARBAGE\r\n\r\n',
+                        b'GET /hotels HTTP/1.1\r\n'
+                        b'Content-Length: ten\r\n\r\n'):
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', self.server.port)
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+            self.assertEqual(status_line.split()[1], b'400')
+            writer.close()
+
+    async def test_waitlist(self):
+        """Test that customers waiting for a full hotel get tickets, and a
+        room once one is cancelled."""
+        await self.request('POST', '/hotels', {'name': 'Full', 'rooms': 1})
+        for name in ('Ali', 'Ayse', 'Veli'):
+            await self.request('POST', '/customers', {'name': name})
+        status, customer = await self.request('PATCH', '/customers/Veli',
+                                              {'tier': 1})
+        self.assertEqual((status, customer['tier']), (200, 1))
+        await self.request('POST', '/reservations',
+                           {'customer': 'Ali', 'hotel': 'Full'})
+        status, ticket = await self.request(
+            'POST', '/reservations',
+            {'customer': 'Ayse', 'hotel': 'Full', 'wait': True})
+        self.assertEqual((status, ticket),
+                         (202, {'hotel': 'Full', 'number': 1,
+                                'position': 1}))
+        await self.request('POST', '/reservations',
+                           {'customer': 'Veli', 'hotel': 'Full',
+                            'wait': True})
+        status, ticket = await self.request('GET', '/waitlist/Full/1')
+        self.assertEqual((status, ticket['position']), (200, 2))
+        self.assertEqual((await self.request(
+            'DELETE', '/reservations/Full/Ali'))[0], 200)
+        status, hotel = await self.request('GET', '/hotels/Full')
+        self.assertEqual(hotel['reservations'], ['Veli'])
+        self.assertEqual((await self.request(
+            'DELETE', '/waitlist/Full/1'))[0], 200)
+        self.assertEqual((await self.request('GET', '/waitlist/Full/1'))[0],
+                         404)
+
+    async def test_concurrent_reservations_are_coalesced(self):
+        """Test that concurrent bookings of one hotel are all kept and are
+        persisted in fewer saves than bookings."""
+        await self.request('POST', '/hotels', {'name': 'Hotel', 'rooms': 100})
+        names = [f'Customer {i}' for i in range(50)]
+        await asyncio.gather(*[
+            self.request('POST', '/customers', {'name': name})
+            for name in names])
+        responses = await asyncio.gather(*[
+            self.request('POST', '/reservations',
+                         {'customer': name, 'hotel': 'Hotel'})
+            for name in names])
+        self.assertTrue(all(status == 201 for status, _ in responses))
+        self.assertLess(self.server.persists, len(names))
+        status, hotel = await self.request('GET', '/hotels/Hotel')
+        self.assertEqual(hotel['rooms'], 50)
+        self.assertCountEqual(hotel['reservations'], names)
+
+        status, result = await self.request(
+            'DELETE', f'/reservations/Hotel/{quote("Customer 0")}')
+        self.assertEqual((status, result['ok']), (200, True))
+        status, customer = await self.request(
+            'GET', f'/customers/{quote("Customer 0")}')
+        self.assertEqual(customer['hotels'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+This module contains unit tests for the sharding module.
+
+The tests check how the hash ring spreads and moves keys, and drive a
+ShardRouter with two worker processes on a temporary data directory.
+
+The tests can be run by executing this module.
+"""
+import tempfile
+import unittest
+import abstractions
+import sharding
+
+
+class TestHashRing(unittest.TestCase):
+    """Test cases for the HashRing class in the sharding module."""
+
+    def setUp(self):
+        """Create some keys to place on rings."""
+        self.keys = [f'hotel-{i}' for i in range(2000)]
+
+    def test_spread(self):
+        """Test every node owns a fair share of the keys."""
+        ring = sharding.HashRing(range(4))
+        counts = [0] * 4
+        for key in self.keys:
+            counts[ring.node(key)] += 1
+        for count in counts:
+            self.assertGreater(count, len(self.keys) / 4 / 2)
+
+    def test_adding_a_node(self):
+        """Test adding a node only moves keys to the new node."""
+        before = sharding.HashRing(range(4))
+        after = sharding.HashRing(range(5))
+        moved = [key for key in self.keys
+                 if before.node(key) != after.node(key)]
+        self.assertTrue(moved)
+        self.assertLess(len(moved), len(self.keys) / 3)
+        self.assertTrue(all(after.node(key) == 4 for key in moved))
+
+    def test_no_nodes(self):
+        """Test a ring needs a node."""
+        with self.assertRaises(ValueError):
+            sharding.HashRing([])
+
+
+class TestShardRouter(unittest.TestCase):
+    """Test cases for the ShardRouter class in the sharding module."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start a router with two workers on a temporary directory."""
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.router = sharding.ShardRouter(2, cls.directory.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the workers and remove the directory."""
+        cls.router.close()
+        cls.directory.cleanup()
+
+    def setUp(self):
+        """Create hotels owned by both shards and some customers."""
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.FileStorage(self.directory.name)
+        abstractions.use_storage(self.storage)
+        names = [f'hotel-{i}' for i in range(20)]
+        self.hotels = [
+            next(name for name in names if self.router.shard(name) == shard)
+            for shard in range(2)]
+        for name in self.hotels:
+            abstractions.create_hotel(name, 2)
+        for name in ('Ali', 'Ayse'):
+            abstractions.create_customer(name)
+
+    def tearDown(self):
+        """Remove the data of the test."""
+        for name in self.storage.hotel_names():
+            self.storage.delete_hotel(name)
+        for name in self.storage.customer_names():
+            self.storage.delete_customer(name)
+        abstractions.use_storage(self.previous_storage)
+
+    def test_single_operations(self):
+        """Test single operations reach the hotel on its shard."""
+        first, second = self.hotels
+        self.router.create_reservation('Ali', first)
+        self.router.create_reservation('Ali', second)
+        self.router.cancel_reservation('Ali', first)
+        self.router.modify_hotel(second, 5)
+        self.assertEqual(abstractions.hotels_with_reservation('Ali'),
+                         [second])
+        self.assertEqual(self.storage.load_hotel(second).rooms, 4)
+
+    def test_batches(self):
+        """Test batches return their results in order across shards."""
+        first, second = self.hotels
+        results = self.router.create_reservations(
+            [('Ali', first), ('Ayse', second), ('Ali', first),
+             ('Ayse', first), ('Nobody', second)])
+        self.assertEqual([result.reason for result in results],
+                         [None, None, None, 'no rooms available',
+                          'unknown customer'])
+        self.assertEqual([result.hotel for result in results],
+                         [first, second, first, first, second])
+        results = self.router.cancel_reservations(
+            [('Ayse', second), ('Ayse', first)])
+        self.assertEqual([result.ok for result in results], [True, False])
+        self.assertEqual(abstractions.customers_without_reservation(),
+                         ['Ayse'])
+
+    def test_modify_customer(self):
+        """Test renaming a customer renames its reservations on every
+        shard."""
+        self.router.create_reservations(
+            [('Ali', name) for name in self.hotels])
+        self.router.modify_customer('Ali', 'Veli')
+        self.assertIsNone(self.storage.load_customer('Ali'))
+        self.assertEqual(abstractions.hotels_with_reservation('Veli'),
+                         self.hotels)
+        for name in self.hotels:
+            self.assertEqual(
+                list(self.storage.load_hotel(name).reservations), ['Veli'])
+
+
+if __name__ == '__main__':
+    unittest.main()
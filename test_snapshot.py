@@ -0,0 +1,181 @@
+"""
+This module contains unit tests for the snapshot module.
+
+The tests write snapshots to a temporary directory, check that entries are
+only handed out for unchanged files, and that a FileStorage with a snapshot
+serves cold loads from it.
+
+The tests can be run by executing this module.
+"""
+import os
+import tempfile
+import unittest
+import abstractions
+import metrics
+import snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+    """Test cases for the Snapshot class in the snapshot module."""
+
+    def setUp(self):
+        """Open a snapshot in a temporary directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'dataset.snapshot')
+        self.snapshot = snapshot.Snapshot(self.path)
+
+    def tearDown(self):
+        """Close the snapshot and remove the directory."""
+        self.snapshot.close()
+        self.directory.cleanup()
+
+    def test_put_and_get(self):
+        """Test entries are returned before and after being flushed."""
+        self.snapshot.put('Izmir.hotel', b'data', (1, 2, 3, 4), 2)
+        self.assertEqual(self.snapshot.get('Izmir.hotel', (1, 2, 3, 4)),
+                         (b'data', 2))
+        self.snapshot.flush()
+        self.assertEqual(self.snapshot.get('Izmir.hotel', (1, 2, 3, 4)),
+                         (b'data', 2))
+        self.assertEqual(self.snapshot.names(), ['Izmir.hotel'])
+
+    def test_signature_mismatch(self):
+        """Test an entry of a changed file is not returned."""
+        self.snapshot.put('Ali.customer', b'data', (1, 2))
+        self.snapshot.flush()
+        self.assertIsNone(self.snapshot.get('Ali.customer', (1, 3)))
+        self.assertIsNone(self.snapshot.get('Ayse.customer', (1, 2)))
+
+    def test_remove(self):
+        """Test removed entries are forgotten, flushed or not."""
+        self.snapshot.put('Ali.customer', b'data', (1, 2))
+        self.snapshot.flush()
+        self.snapshot.remove('Ali.customer')
+        self.assertIsNone(self.snapshot.get('Ali.customer', (1, 2)))
+        self.snapshot.flush()
+        self.assertIsNone(self.snapshot.get('Ali.customer', (1, 2)))
+        self.assertEqual(len(self.snapshot), 0)
+
+    def test_reopen(self):
+        """Test a reopened snapshot has the flushed entries."""
+        self.snapshot.put('Ali.customer', b'first', (1, 2))
+        self.snapshot.flush()
+        self.snapshot.put('Ayse.customer', 'ş'.encode('utf-8'), (3, 4))
+        self.snapshot.put('Ali.customer', b'second', (5, 6))
+        self.snapshot.close()
+        self.snapshot = snapshot.Snapshot(self.path)
+        self.assertEqual(self.snapshot.get('Ali.customer', (5, 6)),
+                         (b'second', 0))
+        self.assertEqual(self.snapshot.get('Ayse.customer', (3, 4)),
+                         ('ş'.encode('utf-8'), 0))
+
+    def test_rewrite(self):
+        """Test a file mostly made of superseded data is rewritten."""
+        original = snapshot.COMPACT_AFTER
+        snapshot.COMPACT_AFTER = 0
+        try:
+            for value in range(5):
+                self.snapshot.put('Izmir.hotel', b'x' * 100, (value,))
+                self.snapshot.flush()
+        finally:
+            snapshot.COMPACT_AFTER = original
+        self.assertLess(os.path.getsize(self.path), 300)
+        self.assertEqual(self.snapshot.get('Izmir.hotel', (4,)),
+                         (b'x' * 100, 0))
+
+    def test_flush_after(self):
+        """Test updates are written once enough of them are pending."""
+        self.snapshot.close()
+        self.snapshot = snapshot.Snapshot(self.path, flush_after=2)
+        self.snapshot.put('Ali.customer', b'data', (1,))
+        self.assertFalse(os.path.exists(self.path))
+        self.snapshot.put('Ayse.customer', b'data', (2,))
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_corrupt_file(self):
+        """Test a damaged snapshot is ignored and replaced."""
+        with open(self.path, 'wb') as file:
+            file.write(b'not a snapshot')
+        self.snapshot = snapshot.Snapshot(self.path)
+        self.assertEqual(self.snapshot.names(), [])
+        self.snapshot.put('Ali.customer', b'data', (1,))
+        self.snapshot.flush()
+        self.assertEqual(snapshot.Snapshot(self.path).names(),
+                         ['Ali.customer'])
+
+
+class TestFileStorageSnapshot(unittest.TestCase):
+    """Test cases for FileStorage with a snapshot."""
+
+    def setUp(self):
+        """Create a hotel and a customer in a storage with a snapshot."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.FileStorage(self.directory.name,
+                                                snapshot=True)
+        abstractions.use_storage(self.storage)
+        abstractions.create_hotel('Izmir', 3)
+        abstractions.create_customer('Ali')
+        abstractions.create_reservation('Ali', 'Izmir')
+        self.storage.close()
+        self.storages = []
+
+    def tearDown(self):
+        """Remove the data directory."""
+        abstractions.use_storage(self.previous_storage)
+        abstractions.object_cache.clear()
+        for storage in self.storages:
+            storage.close()
+        self.directory.cleanup()
+
+    def cold_storage(self):
+        """Returns a new storage on the directory with empty caches."""
+        abstractions.object_cache.clear()
+        storage = abstractions.FileStorage(self.directory.name,
+                                           snapshot=True)
+        self.storages.append(storage)
+        return storage
+
+    def test_cold_load(self):
+        """Test unchanged files are loaded from the snapshot."""
+        storage = self.cold_storage()
+        # Loading the hotel once folds its journal into the snapshot
+        hotel = storage.load_hotel('Izmir')
+        storage.close()
+        storage = self.cold_storage()
+        metrics.enable()
+        try:
+            loaded = storage.load_hotel('Izmir')
+            customer = storage.load_customer('Ali')
+            counters = metrics.snapshot()['counters']
+        finally:
+            metrics.disable()
+            metrics.reset()
+        self.assertEqual(counters['snapshot_hits_total'][''], 2)
+        self.assertNotIn('files_opened_total', counters)
+        self.assertEqual(loaded.rooms, hotel.rooms)
+        self.assertEqual(list(loaded.reservations), ['Ali'])
+        self.assertEqual(customer.hotels, ['Izmir'])
+
+    def test_changed_file(self):
+        """Test a file changed without the snapshot is read again."""
+        other = abstractions.FileStorage(self.directory.name)
+        hotel = other.load_hotel('Izmir')
+        hotel.rooms = 7
+        abstractions.save_to_file(hotel, other.hotel_path('Izmir'))
+        storage = self.cold_storage()
+        self.assertEqual(storage.load_hotel('Izmir').rooms, 7)
+
+    def test_delete(self):
+        """Test deleted files leave the snapshot."""
+        storage = self.cold_storage()
+        abstractions.use_storage(storage)
+        abstractions.cancel_reservation('Ali', 'Izmir')
+        abstractions.delete_customer('Ali')
+        storage.close()
+        self.assertEqual(snapshot.Snapshot(storage.snapshot.path).names(),
+                         ['Izmir.hotel'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+This module contains unit tests for the table module.
+
+The tests store hotels, customers and reservations in a FileStorage in a
+temporary directory, load them into a HotelTable and a CustomerTable, and
+compare the aggregates of the tables with those of the storage.
+
+The tests can be run by executing this module.
+"""
+import tempfile
+import unittest
+import abstractions
+import table
+
+
+class TestTable(unittest.TestCase):
+    """Test cases for the HotelTable and CustomerTable classes in the table
+    module."""
+
+    def setUp(self):
+        """Create two hotels, three customers and some reservations."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        self.storage = abstractions.FileStorage(self.directory.name)
+        abstractions.use_storage(self.storage)
+        abstractions.create_hotel('Izmir', 3)
+        abstractions.create_hotel('Konak', 1)
+        for name in ('Ali', 'Ayse', 'Can'):
+            abstractions.create_customer(name)
+        abstractions.create_reservation('Ali', 'Izmir')
+        abstractions.create_reservation('Ali', 'Izmir')
+        abstractions.create_reservation('Ayse', 'Izmir', '2024-05-01',
+                                        '2024-05-04')
+        abstractions.create_reservation('Ali', 'Konak', '2024-05-01',
+                                        '2024-05-02')
+        self.customers = table.CustomerTable.load()
+        self.hotels = table.HotelTable.load(customers=self.customers)
+
+    def tearDown(self):
+        """Remove the data directory."""
+        abstractions.use_storage(self.previous_storage)
+        self.storage.close()
+        self.directory.cleanup()
+
+    def test_hotel(self):
+        """Test rows convert back into equal Hotel objects."""
+        self.assertEqual(len(self.hotels), 2)
+        for name in self.storage.hotel_names():
+            stored = self.storage.load_hotel(name)
+            hotel = self.hotels.hotel(name)
+            self.assertEqual(hotel.to_data(), stored.to_data())
+            self.assertEqual(hotel.free_rooms(), stored.free_rooms())
+        self.assertIsNone(self.hotels.hotel('Alsancak'))
+
+    def test_interned_names(self):
+        """Test every customer name is stored once."""
+        self.assertCountEqual(self.customers, ['Ali', 'Ayse', 'Can'])
+        ali = self.customers.lookup('Ali')
+        self.assertEqual(list(self.hotels.run_customers).count(ali), 2)
+        self.assertIsNone(self.customers.lookup('Deniz'))
+        with self.assertRaises(ValueError):
+            self.hotels.append(self.storage.load_hotel('Izmir'))
+
+    def test_aggregates(self):
+        """Test the aggregates match those of the storage backend."""
+        self.assertEqual(self.hotels.total_rooms(), 4)
+        self.assertEqual(self.hotels.total_reservations(), 4)
+        counts = self.hotels.reservation_counts()
+        self.assertEqual({name: counts[self.customers.lookup(name)]
+                          for name in self.customers},
+                         {'Ali': 3, 'Ayse': 1, 'Can': 0})
+        for name in self.customers:
+            self.assertCountEqual(
+                self.hotels.hotels_with_reservation(name),
+                self.storage.hotels_with_reservation(name))
+        self.assertCountEqual(self.customers.without_reservation(self.hotels),
+                              self.storage.customers_without_reservation())
+        self.assertEqual(self.hotels.hotels_with_free_rooms(), [])
+        abstractions.cancel_reservation('Ali', 'Izmir')
+        hotels = table.HotelTable.load()
+        self.assertEqual(hotels.hotels_with_free_rooms(), ['Izmir'])
+
+    def test_slots(self):
+        """Test hotels and customers have no attribute dictionary."""
+        for obj in (self.storage.load_hotel('Izmir'),
+                    self.storage.load_customer('Ali')):
+            with self.assertRaises(AttributeError):
+                obj.nickname = 'x'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+This module contains unit tests for the workload module.
+
+The tests record operations on a FileStorage in a temporary directory and
+replay the trace into another temporary directory, with worker threads and
+with worker processes, comparing the final datasets.
+
+The tests can be run by executing this module.
+"""
+import os
+import tempfile
+import unittest
+import abstractions
+import workload
+
+
+class TestWorkload(unittest.TestCase):
+    """Test cases for the Recorder class and the replay function in the
+    workload module."""
+
+    def setUp(self):
+        """Record a session that starts from a hotel and a customer."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous_storage = abstractions.get_storage()
+        recorded = os.path.join(self.directory.name, 'recorded')
+        os.mkdir(recorded)
+        self.storage = abstractions.FileStorage(recorded)
+        abstractions.use_storage(self.storage)
+        abstractions.create_hotel('Izmir', 3)
+        abstractions.create_customer('Ali')
+        self.trace = os.path.join(self.directory.name, 'trace.jsonl')
+        self.create_hotel = abstractions.create_hotel
+        with workload.Recorder(self.trace):
+            abstractions.create_hotel('Konak', 2)
+            abstractions.create_customer('Ayse')
+            abstractions.create_reservation('Ali', 'Izmir')
+            abstractions.create_reservation('Ayse', 'Konak', '2024-05-01',
+                                            '2024-05-03')
+            abstractions.create_reservations(
+                iter([('Ayse', 'Izmir'), ('Ali', 'Alsancak')]))
+            abstractions.modify_hotel('Izmir', 5)
+            abstractions.modify_customer('Ali', 'Veli')
+            abstractions.cancel_reservation('Ayse', 'Izmir')
+            abstractions.hotels_with_free_rooms(limit=1)
+            with self.assertRaises(ValueError):
+                abstractions.create_reservation('Ayse', 'Konak', '2024-05-03',
+                                                '2024-05-01')
+
+    def tearDown(self):
+        """Remove the data directories and the trace."""
+        abstractions.use_storage(self.previous_storage)
+        self.storage.close()
+        self.directory.cleanup()
+
+    def test_trace(self):
+        """Test the trace holds the datasets and every outermost call."""
+        trace = workload.read_trace(self.trace)
+        self.assertCountEqual(trace.dataset, [
+            {'type': 'customer', 'name': 'Ali'},
+            {'type': 'hotel', 'name': 'Izmir', 'rooms': 3}])
+        self.assertEqual(
+            [operation['op'] for operation in trace.operations],
+            ['create_hotel', 'create_customer', 'create_reservation',
+             'create_reservation', 'create_reservations', 'modify_hotel',
+             'modify_customer', 'cancel_reservation',
+             'hotels_with_free_rooms', 'create_reservation'])
+        self.assertEqual(trace.operations[4]['args'],
+                         [[['Ayse', 'Izmir'], ['Ali', 'Alsancak']]])
+        self.assertEqual(trace.operations[8]['args'], [1, 1])
+        self.assertIn({'type': 'customer', 'name': 'Veli'}, trace.final)
+        # The recorder restores the operations
+        self.assertIs(abstractions.create_hotel, self.create_hotel)
+
+    def replay(self, **options):
+        """Returns the report of a replay into a new directory."""
+        return workload.replay(
+            self.trace, os.path.join(self.directory.name, 'replayed'),
+            speed=0, **options)
+
+    def test_replay(self):
+        """Test a sequential replay reproduces the final dataset."""
+        report = self.replay()
+        self.assertEqual(report['operations'], 10)
+        self.assertEqual(report['divergence']['missing'], 0)
+        self.assertEqual(report['divergence']['unexpected'], 0)
+        self.assertEqual(sum(report['errors'].values()), 1)
+        self.assertEqual(
+            report['operation_latency']['create_reservation']['count'], 3)
+        self.assertEqual(len(workload.format_report(report)), 12)
+        with self.assertRaises(ValueError):
+            self.replay()
+
+    def test_replay_processes(self):
+        """Test a replay on worker processes stores into the directory."""
+        report = self.replay(concurrency=2, processes=True)
+        self.assertEqual(report['operations'], 10)
+        self.assertIn('divergence', report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,357 @@
+"""
+This workload module records the operations made through the abstractions
+module into a trace file, and replays a trace against a fresh data
+directory to reproduce a recorded load offline.
+
+A Recorder wraps every public operation of the abstractions module while it
+is active and appends one JSON line per call to the trace, with its start
+time relative to the start of the recording, its arguments and its
+duration. The trace begins with the dataset the recording started from, as
+records of the bulk module, and ends with the dataset it finished with.
+
+A replay imports the starting dataset into an empty directory and calls the
+operations at their recorded times, divided by a speed-up factor, on a pool
+of worker threads or processes. It reports the throughput, the latency
+percentiles of every operation, and how far the final dataset diverges from
+the recorded one; with more than one worker, reordered operations may make
+it diverge.
+
+Example:
+
+    python server.py --trace peak.jsonl
+    python workload.py replay peak.jsonl --directory replay/ \\
+        --concurrency 8 --processes --speed 10
+
+Recording and replay can be run by executing this module.
+"""
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import functools
+import inspect
+import json
+import multiprocessing
+import os
+import runpy
+import sys
+import threading
+import time
+
+import abstractions as a
+import bulk
+import serialization
+
+# The operations of the abstractions module that are recorded
+OPERATIONS = [
+    'create_hotel', 'delete_hotel', 'rename_hotel', 'display_hotel',
+    'modify_hotel', 'create_customer', 'delete_customer', 'display_customer',
+    'modify_customer', 'hotels_with_reservation',
+    'customers_without_reservation', 'rebuild_reservation_index',
+    'create_reservation', 'cancel_reservation', 'hotels_with_free_rooms',
+    'room_available', 'peak_occupancy', 'create_reservations',
+    'cancel_reservations', 'set_loyalty_tier', 'waitlist_position',
+    'leave_waitlist',
+]
+
+# Operations whose first argument is an iterable of reservation tuples
+BATCHES = ('create_reservations', 'cancel_reservations')
+
+Trace = collections.namedtuple('Trace', ['dataset', 'operations', 'final'])
+
+
+def _default(value):
+    """Returns the JSON form of the dates in the arguments of a call."""
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f'Cannot record {value!r}')
+
+
+def _state(records):
+    """Returns a dataset as a multiset of its records, independent of their
+    order."""
+    return collections.Counter(json.dumps(record, sort_keys=True)
+                               for record in records)
+
+
+class Recorder:
+    """Records the operations of the abstractions module to a trace file."""
+
+    def __init__(self, path):
+        """Initializes Recorder writing to a trace file."""
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._originals = {}
+        self._start = None
+
+    def start(self):
+        """Writes the current dataset and starts recording."""
+        self._file = open(self.path, 'w', encoding='utf-8')
+        for record in bulk.export_records():
+            self._write({'record': record})
+        self._start = time.perf_counter()
+        for name in OPERATIONS:
+            self._originals[name] = getattr(a, name)
+            setattr(a, name, self._wrap(name, self._originals[name]))
+
+    def stop(self):
+        """Stops recording and writes the final dataset."""
+        for name, func in self._originals.items():
+            setattr(a, name, func)
+        self._originals.clear()
+        self._write({'final': list(bulk.export_records())})
+        self._file.close()
+        self._file = None
+
+    def _write(self, line):
+        """Appends a line to the trace."""
+        text = json.dumps(line, default=_default) + '\n'
+        with self._lock:
+            self._file.write(text)
+
+    def _wrap(self, name, func):
+        """Returns func recording its outermost calls."""
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, 'active', False):
+                # Called by another recorded operation
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            args = list(bound.args)
+            if name in BATCHES:
+                # Iterables can only be read once
+                args[0] = [tuple(pair) for pair in args[0]]
+            self._local.active = True
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                end = time.perf_counter()
+                self._local.active = False
+                self._write({'time': start - self._start, 'op': name,
+                             'args': args, 'seconds': end - start})
+
+        return wrapper
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def read_trace(path):
+    """Returns the starting dataset, the operations ordered by time and the
+    final dataset of a trace file."""
+    dataset = []
+    operations = []
+    final = None
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            line = json.loads(line)
+            if 'record' in line:
+                dataset.append(line['record'])
+            elif 'final' in line:
+                final = line['final']
+            else:
+                operations.append(line)
+    operations.sort(key=lambda operation: operation['time'])
+    return Trace(dataset, operations, final)
+
+
+def _start_worker(directory, codec_name):
+    """Installs the storage backend of a worker process and silences the
+    display operations."""
+    codec = serialization.get_codec(codec_name) if codec_name else None
+    a.use_storage(a.FileStorage(directory, codec))
+    sys.stdout = open(os.devnull, 'w', encoding='utf-8')
+
+
+def _execute(name, args):
+    """Calls an operation and returns its duration and its error, if
+    any."""
+    start = time.perf_counter()
+    try:
+        getattr(a, name)(*args)
+    except Exception as e:  # pylint: disable=broad-except
+        return time.perf_counter() - start, f'{type(e).__name__}: {e}'
+    return time.perf_counter() - start, None
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value at a fraction of a sorted list."""
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def _latencies(seconds):
+    """Returns the count and latency percentiles of some durations."""
+    seconds = sorted(seconds)
+    return {'count': len(seconds),
+            'p50_ms': percentile(seconds, 0.50) * 1000,
+            'p90_ms': percentile(seconds, 0.90) * 1000,
+            'p99_ms': percentile(seconds, 0.99) * 1000,
+            'max_ms': seconds[-1] * 1000}
+
+
+def replay(path, directory, concurrency=1, processes=False, speed=1.0,
+           codec=None):
+    """Replays a trace file against an empty data directory with
+    concurrency worker threads, or processes, calling the operations at
+    their recorded times divided by speed, or as fast as possible with a
+    speed of 0, and returns a report."""
+    trace = read_trace(path)
+    os.makedirs(directory, exist_ok=True)
+    if os.listdir(directory):
+        raise ValueError(f'{directory} is not empty')
+    previous_storage = a.get_storage()
+    storage = a.FileStorage(directory, codec)
+    a.use_storage(storage)
+    try:
+        bulk.import_records(enumerate(trace.dataset, 1))
+        if processes:
+            # Spawned rather than forked workers inherit no held lock
+            executor = concurrent.futures.ProcessPoolExecutor(
+                concurrency, multiprocessing.get_context('spawn'),
+                initializer=_start_worker,
+                initargs=(os.path.abspath(directory),
+                          codec.name if codec else None))
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+        with executor, contextlib.redirect_stdout(open(
+                os.devnull, 'w', encoding='utf-8')) as devnull:
+            if processes:
+                # Wait for the workers to start before the clock does
+                list(executor.map(time.sleep, [0] * concurrency))
+            futures = []
+            lag = 0.0
+            start = time.perf_counter()
+            for operation in trace.operations:
+                if speed:
+                    delay = (operation['time'] / speed
+                             - (time.perf_counter() - start))
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        lag = max(lag, -delay)
+                futures.append((operation['op'], executor.submit(
+                    _execute, operation['op'], operation['args'])))
+            results = [(name, future.result()) for name, future in futures]
+            elapsed = time.perf_counter() - start
+        devnull.close()
+        final = list(bulk.export_records())
+    finally:
+        a.use_storage(previous_storage)
+        storage.close()
+
+    seconds_by_operation = {}
+    errors = collections.Counter()
+    for name, (seconds, error) in results:
+        seconds_by_operation.setdefault(name, []).append(seconds)
+        if error is not None:
+            errors[error] += 1
+    report = {
+        'config': {'trace': path, 'concurrency': concurrency,
+                   'processes': processes, 'speed': speed},
+        'operations': len(results),
+        'seconds': elapsed,
+        'ops_per_sec': len(results) / elapsed if elapsed else float('inf'),
+        'lag_seconds': lag,
+        'errors': dict(errors),
+        'latency': _latencies(
+            [seconds for _, (seconds, _) in results]) if results else {},
+        'operation_latency': {name: _latencies(seconds) for name, seconds
+                              in sorted(seconds_by_operation.items())},
+    }
+    if trace.final is not None:
+        expected = _state(trace.final)
+        actual = _state(final)
+        missing = expected - actual
+        unexpected = actual - expected
+        report['divergence'] = {
+            'missing': sum(missing.values()),
+            'unexpected': sum(unexpected.values()),
+            'examples': [json.loads(record) for record in
+                         list(missing)[:5] + list(unexpected)[:5]]}
+    return report
+
+
+def format_report(report):
+    """Returns report lines for a replay."""
+    lines = [f'Replayed {report["operations"]} operations in '
+             f'{report["seconds"]:.2f} s ({report["ops_per_sec"]:.1f} ops/s,'
+             f' at most {report["lag_seconds"]:.3f} s behind schedule)',
+             f'{"operation":32} {"count":>8} {"p50 ms":>10} {"p90 ms":>10} '
+             f'{"p99 ms":>10}']
+    for name, latency in report['operation_latency'].items():
+        lines.append(f'{name:32} {latency["count"]:8} '
+                     f'{latency["p50_ms"]:10.3f} {latency["p90_ms"]:10.3f} '
+                     f'{latency["p99_ms"]:10.3f}')
+    for error, count in report['errors'].items():
+        lines.append(f'{count} operations failed with {error}')
+    divergence = report.get('divergence')
+    if divergence is None:
+        lines.append('The trace has no final dataset to compare with')
+    elif divergence['missing'] or divergence['unexpected']:
+        lines.append(f'The final dataset diverges: '
+                     f'{divergence["missing"]} records missing and '
+                     f'{divergence["unexpected"]} unexpected, e.g.')
+        lines += [f'  {json.dumps(record)}'
+                  for record in divergence['examples']]
+    else:
+        lines.append('The final dataset matches the recording')
+    return lines
+
+
+def main():
+    """Record a program or replay a trace from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser(
+        'record', help='run a Python program and record its operations')
+    record.add_argument('trace')
+    record.add_argument('program', help='the Python file to run')
+    record.add_argument('arguments', nargs=argparse.REMAINDER)
+    play = commands.add_parser('replay', help='replay a trace')
+    play.add_argument('trace')
+    play.add_argument('--directory', required=True,
+                      help='the empty data directory to replay against')
+    play.add_argument('--concurrency', type=int, default=1,
+                      help='the number of workers')
+    play.add_argument('--processes', action='store_true',
+                      help='use worker processes instead of threads')
+    play.add_argument('--speed', type=float, default=1.0,
+                      help='speed-up factor of the recorded times, or 0 '
+                           'for as fast as possible')
+    play.add_argument('--codec', choices=sorted(serialization.CODECS))
+    play.add_argument('--output', help='save the report as JSON')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        sys.argv = [args.program] + args.arguments
+        with Recorder(args.trace):
+            try:
+                runpy.run_path(args.program, run_name='__main__')
+            except KeyboardInterrupt:
+                pass
+        return
+    codec = serialization.get_codec(args.codec) if args.codec else None
+    report = replay(args.trace, args.directory, args.concurrency,
+                    args.processes, args.speed, codec)
+    print('\n'.join(format_report(report)))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()